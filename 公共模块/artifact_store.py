@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成产物存储
+按总字节数上限和 TTL 淘汰生成的音频等文件；内存部分超过上限时把最旧的产物
+溢写到磁盘，磁盘上的产物由 send_file 直接从文件流式发送，并统计驻留字节与淘汰次数
+"""
+
+import os
+import io
+import time
+import atexit
+import uuid
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import send_file
+
+MAX_BYTES = int(os.environ.get('ARTIFACT_MAX_MB', 512)) * 1024 * 1024              # 内存 + 磁盘总上限
+MAX_MEMORY_BYTES = int(os.environ.get('ARTIFACT_MAX_MEMORY_MB', 64)) * 1024 * 1024  # 内存驻留上限
+TTL_SECONDS = int(os.environ.get('ARTIFACT_TTL_SECONDS', 3600))                   # 产物有效期
+SPILL_ROOT = os.environ.get('ARTIFACT_SPILL_DIR', os.path.join(tempfile.gettempdir(), 'transformers_artifacts'))
+
+class ArtifactStore:
+    """有界产物存储：LRU + TTL 淘汰，可选溢写到磁盘，线程安全"""
+
+    def __init__(self, name, max_bytes=MAX_BYTES, max_memory_bytes=MAX_MEMORY_BYTES,
+                 ttl_seconds=TTL_SECONDS, spill_to_disk=True, spill_dir=None):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl_seconds = ttl_seconds
+        self.spill_to_disk = spill_to_disk
+        self.spill_dir = spill_dir
+        self._items = OrderedDict()  # key -> {'data', 'path', 'size', 'created_at'}
+        self._pending_delete = []    # 正在被发送、暂时无法删除的文件（Windows）
+        self._lock = threading.Lock()
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.stats = {'puts': 0, 'hits': 0, 'misses': 0, 'spills': 0,
+                      'evicted_ttl': 0, 'evicted_capacity': 0}
+
+        if self.spill_to_disk and self.spill_dir is None:
+            # 根目录可能被多个服务进程共用（独立服务与统一宿主、多个 worker），
+            # 每个进程使用自己的子目录，退出时只清理自己的文件
+            os.makedirs(SPILL_ROOT, exist_ok=True)
+            self.spill_dir = tempfile.mkdtemp(prefix=f'{name}-', dir=SPILL_ROOT)
+            atexit.register(shutil.rmtree, self.spill_dir, ignore_errors=True)
+        elif self.spill_to_disk:
+            os.makedirs(self.spill_dir, exist_ok=True)
+
+    def put(self, data, key=None):
+        """保存一段字节数据，返回 key"""
+        key = key or uuid.uuid4().hex
+        with self._lock:
+            self._sweep()
+            if key in self._items:
+                self._drop(key)
+            self._items[key] = {'data': data, 'path': None, 'size': len(data), 'created_at': time.time()}
+            self.memory_bytes += len(data)
+            self.stats['puts'] += 1
+            self._enforce_limits(keep=key)
+        return key
+
+    def __contains__(self, key):
+        with self._lock:
+            self._sweep()
+            return key in self._items
+
+    def send(self, key, mimetype, download_name=None, as_attachment=False):
+        """返回产物的 Flask 响应；内存中的直接发送，磁盘上的从文件流式发送。不存在时返回 None"""
+        download_name = download_name or key
+        with self._lock:
+            self._sweep()
+            item = self._items.get(key)
+            if item is None:
+                self.stats['misses'] += 1
+                return None
+            self._items.move_to_end(key)
+            self.stats['hits'] += 1
+            data, path = item['data'], item['path']
+            if data is None:
+                # send_file 在调用时即打开文件，持锁调用保证打开前文件不会被并发淘汰删除；
+                # 打开之后再被淘汰时，响应仍从已打开的句柄读取（Windows 上删除会推迟到下次清理）
+                return send_file(path, mimetype=mimetype, as_attachment=as_attachment,
+                                 download_name=download_name, conditional=True)
+
+        return send_file(io.BytesIO(data), mimetype=mimetype,
+                         as_attachment=as_attachment, download_name=download_name)
+
+    def _sweep(self):
+        """淘汰过期产物，并重试删除之前未能删除的文件（调用方需持有锁）"""
+        if self.ttl_seconds is not None:
+            deadline = time.time() - self.ttl_seconds
+            for key in [k for k, item in self._items.items() if item['created_at'] < deadline]:
+                self._drop(key)
+                self.stats['evicted_ttl'] += 1
+        if self._pending_delete:
+            self._pending_delete = [path for path in self._pending_delete if not self._remove_file(path)]
+
+    def _enforce_limits(self, keep):
+        # 总量超限：按 LRU 顺序淘汰（不淘汰刚写入的产物）
+        for key in list(self._items):
+            if self.memory_bytes + self.disk_bytes <= self.max_bytes:
+                break
+            if key != keep:
+                self._drop(key)
+                self.stats['evicted_capacity'] += 1
+
+        # 内存超限：最旧的内存产物溢写到磁盘，未开启溢写时直接淘汰
+        for key in list(self._items):
+            if self.memory_bytes <= self.max_memory_bytes:
+                break
+            item = self._items[key]
+            if item['data'] is None:
+                continue
+            if self.spill_to_disk:
+                self._spill(key, item)
+            elif key != keep:
+                self._drop(key)
+                self.stats['evicted_capacity'] += 1
+
+    def _spill(self, key, item):
+        path = os.path.join(self.spill_dir, key)
+        with open(path, 'wb') as f:
+            f.write(item['data'])
+        item['data'] = None
+        item['path'] = path
+        self.memory_bytes -= item['size']
+        self.disk_bytes += item['size']
+        self.stats['spills'] += 1
+
+    def _drop(self, key):
+        item = self._items.pop(key)
+        if item['data'] is not None:
+            self.memory_bytes -= item['size']
+        else:
+            self.disk_bytes -= item['size']
+            if not self._remove_file(item['path']):
+                self._pending_delete.append(item['path'])
+
+    @staticmethod
+    def _remove_file(path):
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
+
+    def metrics(self):
+        with self._lock:
+            self._sweep()
+            return {
+                'items': len(self._items),
+                'resident_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes,
+                'max_bytes': self.max_bytes,
+                'max_memory_bytes': self.max_memory_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                **self.stats,
+            }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+异步翻译阶段
+语言检测与翻译合并为一次请求（googletrans 的 translate 会返回检测到的源语言），
+在线程池中执行，调用方按截止时间等待，超时直接返回原文，不再阻塞推理线程。
+defer / collect 用于把翻译挪到响应之外：响应先返回原文和翻译编号，译文由后续请求取回，
+推理线程不必等待翻译即可处理下一个请求
+"""
+
+import os
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+TRANSLATION_TIMEOUT = float(os.environ.get('TRANSLATION_TIMEOUT', 2.0))  # 翻译硬截止时间（秒）
+MAX_WORKERS = int(os.environ.get('TRANSLATION_WORKERS', 4))              # 翻译线程数
+PENDING_LIMIT = int(os.environ.get('TRANSLATION_PENDING_LIMIT', 256))    # 等待取回的翻译数上限，超出时丢弃最早的
+
+CHINESE_LANGS = ('zh-cn', 'zh-tw', 'zh')
+
+try:
+    from googletrans import Translator
+    TRANSLATOR_AVAILABLE = True
+except ImportError:
+    Translator = None
+    TRANSLATOR_AVAILABLE = False
+
+class AsyncTranslator:
+    """线程池翻译器：submit 立即返回 Future，wait 在截止时间内取结果，超时返回原文"""
+
+    def __init__(self, max_workers=MAX_WORKERS, timeout=TRANSLATION_TIMEOUT, pending_limit=PENDING_LIMIT):
+        self.timeout = timeout
+        self.available = TRANSLATOR_AVAILABLE
+        self.pending_limit = pending_limit
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='translate')
+        self._pending = OrderedDict()     # 翻译编号 -> (Future, 原文)
+        self._pending_lock = threading.Lock()
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self.stats = {'requests': 0, 'translated': 0, 'skipped': 0, 'timeouts': 0, 'failures': 0}
+
+    def _translator(self):
+        # googletrans 的 Translator 内部持有 HTTP 客户端，每个线程单独一个
+        if not hasattr(self._local, 'translator'):
+            self._local.translator = Translator()
+        return self._local.translator
+
+    def _count(self, key):
+        with self._stats_lock:
+            self.stats[key] += 1
+
+    def _run(self, text, dest, src, skip_langs):
+        start_time = time.time()
+        result = self._translator().translate(text, src=src, dest=dest)
+        detected = (result.src or '').lower()
+        if detected in skip_langs or detected == dest:
+            self._count('skipped')
+            return {'text': text, 'src': detected, 'translated': False}
+        self._count('translated')
+        print(f"翻译 [{detected}->{dest}] {time.time() - start_time:.2f}s: {text} -> {result.text}")
+        return {'text': result.text, 'src': detected, 'translated': True}
+
+    def submit(self, text, dest='zh-cn', src='auto', skip_langs=CHINESE_LANGS):
+        """提交翻译任务；检测到的源语言在 skip_langs 中时保留原文。翻译器不可用时返回 None"""
+        if not self.available or not text:
+            return None
+        self._count('requests')
+        return self._executor.submit(self._run, text, dest, src, tuple(skip_langs))
+
+    def wait(self, future, text, timeout=None):
+        """在截止时间内等待翻译结果；超时或失败时返回原文"""
+        fallback = {'text': text, 'src': None, 'translated': False}
+        if future is None:
+            return fallback
+        try:
+            return future.result(timeout=self.timeout if timeout is None else timeout)
+        except FutureTimeoutError:
+            # 线程池中的请求会自行结束，这里只是不再等待
+            self._count('timeouts')
+            print(f"翻译超时（>{self.timeout}s），返回原文: {text}")
+            return {**fallback, 'timed_out': True}
+        except Exception as e:
+            self._count('failures')
+            print(f"翻译失败: {e}")
+            return fallback
+
+    def translate(self, text, dest='zh-cn', src='auto', skip_langs=CHINESE_LANGS, timeout=None):
+        """提交并等待，等价于 wait(submit(...))"""
+        return self.wait(self.submit(text, dest, src, skip_langs), text, timeout)
+
+    def defer(self, text, dest='zh-cn', src='auto', skip_langs=CHINESE_LANGS):
+        """提交翻译并登记，返回翻译编号（翻译器不可用时返回 None），译文稍后用 collect 取回"""
+        future = self.submit(text, dest, src, skip_langs)
+        if future is None:
+            return None
+        translation_id = uuid.uuid4().hex
+        with self._pending_lock:
+            self._pending[translation_id] = (future, text)
+            while len(self._pending) > self.pending_limit:
+                self._pending.popitem(last=False)
+        return translation_id
+
+    def collect(self, translation_id, timeout=None):
+        """取回 defer 登记的译文（在截止时间内等待，超时返回原文）；编号未知或已被取回时返回 None"""
+        with self._pending_lock:
+            entry = self._pending.pop(translation_id, None)
+        if entry is None:
+            return None
+        future, text = entry
+        return self.wait(future, text, timeout)
+
+    def info(self):
+        with self._stats_lock:
+            return {'timeout': self.timeout, 'pending': len(self._pending), **self.stats}
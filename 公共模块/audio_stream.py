@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式音频输出
+把模型边生成边产出的波形片段编码为分块 HTTP 响应（WAV 或裸 PCM），
+浏览器 <audio> 拿到第一个片段即可开始播放。
+生成由 StreamJobs 在后台执行且只执行一次：POST 启动生成、返回服务端生成的编号，
+GET 只读取该编号已生成的片段，浏览器重复请求（Range、重播）不会再次触发生成
+"""
+
+import io
+import os
+import re
+import time
+import uuid
+import struct
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import scipy.io.wavfile as wavfile
+from flask import Response, stream_with_context
+
+# 流式 WAV 头里的长度字段填最大值，播放器会一直读到连接关闭
+STREAM_DATA_SIZE = 0xFFFFFFFF - 36
+
+MAX_STREAM_JOBS = int(os.environ.get('AUDIO_STREAM_MAX_JOBS', 8))            # 同时保留的生成任务数上限
+FINISHED_JOB_TTL = int(os.environ.get('AUDIO_STREAM_FINISHED_TTL', 60))      # 生成结束后任务保留的秒数
+
+def wav_header(sample_rate, channels=1, bits_per_sample=16, data_size=STREAM_DATA_SIZE):
+    """生成 44 字节的 PCM WAV 文件头"""
+    byte_rate = sample_rate * channels * bits_per_sample // 8
+    block_align = channels * bits_per_sample // 8
+    return (
+        b'RIFF' + struct.pack('<I', min(data_size + 36, 0xFFFFFFFF)) + b'WAVE'
+        + b'fmt ' + struct.pack('<IHHIIHH', 16, 1, channels, sample_rate, byte_rate, block_align, bits_per_sample)
+        + b'data' + struct.pack('<I', data_size)
+    )
+
+def to_pcm16(audio):
+    """浮点波形（[-1, 1]）转为 16 位整数 PCM"""
+    if hasattr(audio, 'cpu'):
+        audio = audio.cpu().float().numpy()
+    audio = np.asarray(audio).squeeze()
+    if audio.dtype == np.int16:
+        return audio
+    return (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16)
+
+def encode_wav(pcm, sample_rate):
+    """完整的 16 位 PCM 数组编码为 WAV 字节"""
+    buffer = io.BytesIO()
+    wavfile.write(buffer, sample_rate, pcm)
+    return buffer.getvalue()
+
+def split_sentences(text, max_chars=120):
+    """按中英文句末标点切分文本，过长的句子按逗号继续切，用于逐句合成"""
+    sentences = []
+    for sentence in re.split(r'(?<=[。！？!?；;\n])|(?<=\.)\s+', text):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            cut = max(sentence.rfind(sep, 0, max_chars) for sep in '，,、 ')
+            cut = cut + 1 if cut > 0 else max_chars
+            sentences.append(sentence[:cut].strip())
+            sentence = sentence[cut:].strip()
+        if sentence:
+            sentences.append(sentence)
+    return sentences
+
+def stream_audio_response(chunks, sample_rate, audio_format='wav', on_complete=None, headers=None):
+    """
+    把波形片段迭代器包装成分块 HTTP 响应
+    audio_format: 'wav'（带流式文件头）或 'pcm'（裸 16 位小端 PCM）
+    on_complete: 生成结束后以完整 PCM 数组回调，用于保存产物
+    """
+    def generate():
+        pieces = []
+        if audio_format == 'wav':
+            yield wav_header(sample_rate)
+        for chunk in chunks:
+            pcm = to_pcm16(chunk)
+            if pcm.size == 0:
+                continue
+            pieces.append(pcm)
+            yield pcm.astype('<i2').tobytes()
+        if on_complete is not None and pieces:
+            on_complete(np.concatenate(pieces))
+
+    mimetype = 'audio/wav' if audio_format == 'wav' else f'audio/L16;rate={sample_rate};channels=1'
+    response_headers = {'X-Sample-Rate': str(sample_rate), 'Cache-Control': 'no-cache'}
+    response_headers.update(headers or {})
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers=response_headers,
+                    direct_passthrough=True)
+
+# ============================================================================
+# 流式生成任务
+# ============================================================================
+
+class StreamJob:
+    """一次流式生成：后台线程消费波形片段并缓存为 PCM，任意多个读者都从头读取，生成只执行一次"""
+
+    def __init__(self, job_id, chunks, sample_rate, on_complete=None):
+        self.id = job_id
+        self.sample_rate = sample_rate
+        self.pieces = []
+        self.done = False
+        self.error = None
+        self.finished_at = None
+        self._cond = threading.Condition()
+        threading.Thread(target=self._run, args=(chunks, on_complete), name=f'audio-stream-{job_id}',
+                         daemon=True).start()
+
+    def _run(self, chunks, on_complete):
+        try:
+            for chunk in chunks:
+                pcm = to_pcm16(chunk)
+                if pcm.size == 0:
+                    continue
+                with self._cond:
+                    self.pieces.append(pcm)
+                    self._cond.notify_all()
+            if on_complete is not None and self.pieces:
+                on_complete(np.concatenate(self.pieces))
+        except Exception as e:
+            self.error = str(e)
+            print(f"⚠️ 流式生成失败 [{self.id}]: {e}")
+        finally:
+            with self._cond:
+                self.done = True
+                self.finished_at = time.time()
+                self._cond.notify_all()
+
+    def iter_pieces(self):
+        """按顺序返回已生成的 PCM 片段，尚未生成的片段阻塞等待，生成结束后返回"""
+        index = 0
+        while True:
+            with self._cond:
+                while index >= len(self.pieces) and not self.done:
+                    self._cond.wait()
+                if index >= len(self.pieces):
+                    return
+                piece = self.pieces[index]
+            index += 1
+            yield piece
+
+class StreamJobs:
+    """流式生成任务表：任务编号只由服务端生成；生成结束超过 FINISHED_JOB_TTL 的任务被移除（完整音频应由 on_complete 另行保存）"""
+
+    def __init__(self, max_jobs=MAX_STREAM_JOBS, finished_ttl=FINISHED_JOB_TTL):
+        self.max_jobs = max_jobs
+        self.finished_ttl = finished_ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sweep(self):
+        deadline = time.time() - self.finished_ttl
+        for job_id in [job_id for job_id, job in self._jobs.items()
+                       if job.done and job.finished_at < deadline]:
+            del self._jobs[job_id]
+
+    def start(self, chunks, sample_rate, on_complete=None, job_id=None):
+        """启动一次生成并返回任务编号；任务数已达上限（均在生成中）时返回 None"""
+        with self._lock:
+            self._sweep()
+            if len(self._jobs) >= self.max_jobs:
+                finished = [key for key, job in self._jobs.items() if job.done]
+                if not finished:
+                    return None
+                del self._jobs[finished[0]]
+            job_id = job_id or uuid.uuid4().hex
+            self._jobs[job_id] = StreamJob(job_id, chunks, sample_rate, on_complete)
+            return job_id
+
+    def get(self, job_id):
+        with self._lock:
+            self._sweep()
+            return self._jobs.get(job_id)
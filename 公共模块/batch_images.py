@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+批量图片推理
+从一次上传中收集多张图片（multipart 多文件或 zip/tar 压缩包），按块并行解码，
+以列表形式送入 HF pipeline 并设置 batch_size，按上传顺序返回每张图片的结果。
+下一块图片的解码与当前块的推理重叠进行，内存中最多同时保留两块解码后的图片
+"""
+
+import io
+import os
+import time
+import tarfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+BATCH_SIZE = int(os.environ.get('PIPELINE_BATCH_SIZE', 8))                          # 默认推理批大小
+MAX_BATCH_SIZE = 64                                                                  # 请求可指定的批大小上限
+MAX_IMAGES = int(os.environ.get('BATCH_MAX_IMAGES', 1000))                           # 单次请求图片数上限
+MAX_ARCHIVE_BYTES = int(os.environ.get('BATCH_MAX_ARCHIVE_MB', 2048)) * 1024 * 1024  # 压缩包解压后总大小上限
+DECODE_WORKERS = int(os.environ.get('BATCH_DECODE_WORKERS', min(8, os.cpu_count() or 1)))
+CHUNK_BATCHES = 4                                                                    # 每块包含的推理批数
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz')
+
+_decode_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='image-decode')
+_prefetch_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='image-prefetch')
+
+class BatchUploadError(ValueError):
+    """上传内容不合法（没有图片、数量或大小超限、压缩包损坏等）"""
+
+# ============================================================================
+# 收集上传的图片
+# ============================================================================
+
+def _is_image_name(name):
+    base = os.path.basename(name)
+    return (not base.startswith('.') and '__MACOSX' not in name
+            and os.path.splitext(base)[1].lower() in IMAGE_EXTENSIONS)
+
+def _read_archive(name, data, budget):
+    """展开压缩包中的图片，按包内顺序返回 [(文件名, 字节)]；budget 为剩余可解压字节数"""
+    items = []
+    try:
+        if name.lower().endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or not _is_image_name(info.filename):
+                        continue
+                    budget -= info.file_size
+                    if budget < 0:
+                        raise BatchUploadError('压缩包解压后超过大小上限')
+                    items.append((info.filename, archive.read(info)))
+        else:
+            with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+                for member in archive:
+                    if not member.isfile() or not _is_image_name(member.name):
+                        continue
+                    budget -= member.size
+                    if budget < 0:
+                        raise BatchUploadError('压缩包解压后超过大小上限')
+                    items.append((member.name, archive.extractfile(member).read()))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise BatchUploadError(f'无法读取压缩包 {name}: {e}')
+    return items
+
+def read_uploads(files, fields=('images', 'image', 'archive')):
+    """
+    从 request.files 收集 [(文件名, 字节)]
+    同一字段可以上传多个文件；扩展名为 zip/tar 的文件会被展开为其中的图片
+    """
+    items = []
+    budget = MAX_ARCHIVE_BYTES
+    for field in fields:
+        for storage in files.getlist(field):
+            name = storage.filename or f'{field}_{len(items)}'
+            data = storage.read()
+            if name.lower().endswith(ARCHIVE_EXTENSIONS):
+                extracted = _read_archive(name, data, budget)
+                budget -= sum(len(item[1]) for item in extracted)
+                items.extend(extracted)
+            elif data:
+                items.append((name, data))
+            if len(items) > MAX_IMAGES:
+                raise BatchUploadError(f'图片数量超过上限 {MAX_IMAGES}')
+    if not items:
+        raise BatchUploadError('没有上传图片')
+    return items
+
+def parse_batch_size(value, default=BATCH_SIZE):
+    """解析请求中的 batch_size，限制在 [1, MAX_BATCH_SIZE]"""
+    try:
+        return max(1, min(int(value), MAX_BATCH_SIZE))
+    except (TypeError, ValueError):
+        return default
+
+# ============================================================================
+# 解码与推理
+# ============================================================================
+
+def _decode(data):
+    try:
+        return Image.open(io.BytesIO(data)).convert('RGB')
+    except Exception as e:
+        return e
+
+def decode_images(datas):
+    """并行解码为 RGB PIL 图像，返回等长列表，解码失败的位置为异常对象"""
+    return list(_decode_pool.map(_decode, datas))
+
+def run_batch(pipe, items, format_result, batch_size=BATCH_SIZE, **pipe_kwargs):
+    """
+    批量推理，返回 (按上传顺序排列的结果列表, 统计信息)
+    format_result(image, output) 把单张图片的 pipeline 输出转为可序列化的 dict
+    """
+    chunk_size = batch_size * CHUNK_BATCHES
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    results = []
+    stats = {'images': len(items), 'failed': 0, 'batch_size': batch_size,
+             'decode_wait_time': 0.0, 'inference_time': 0.0}
+
+    pending = _prefetch_pool.submit(decode_images, [data for _, data in chunks[0]]) if chunks else None
+    for chunk_index, chunk in enumerate(chunks):
+        wait_start = time.time()
+        images = pending.result()
+        stats['decode_wait_time'] += time.time() - wait_start
+        # 当前块推理期间，后台解码下一块
+        if chunk_index + 1 < len(chunks):
+            pending = _prefetch_pool.submit(decode_images, [data for _, data in chunks[chunk_index + 1]])
+
+        entries = [{'index': len(results) + i, 'name': name} for i, (name, _) in enumerate(chunk)]
+        valid = [i for i, image in enumerate(images) if not isinstance(image, Exception)]
+        for i, image in enumerate(images):
+            if isinstance(image, Exception):
+                entries[i]['error'] = f'图片解码失败: {image}'
+
+        if valid:
+            infer_start = time.time()
+            outputs = pipe([images[i] for i in valid], batch_size=batch_size, **pipe_kwargs)
+            stats['inference_time'] += time.time() - infer_start
+            for i, output in zip(valid, outputs):
+                try:
+                    entries[i].update(format_result(images[i], output))
+                except Exception as e:
+                    entries[i]['error'] = str(e)
+
+        stats['failed'] += sum(1 for entry in entries if 'error' in entry)
+        results.extend(entries)
+
+    stats['decode_wait_time'] = round(stats['decode_wait_time'], 3)
+    stats['inference_time'] = round(stats['inference_time'], 3)
+    return results, stats
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CLIP 图像嵌入检索索引
+图片库按批编码为归一化的 CLIP 图像嵌入，存入内存映射的 float16 矩阵（vectors.f16），
+条目信息逐行追加到 items.jsonl；以文本或图片为查询做 top-k 检索（内积即余弦相似度）。
+默认分块暴力检索（百万张图片约 1GB，CPU 上按块矩阵乘法）；图片库较大时可构建 IVF 倒排索引，
+只扫描与查询最接近的若干个聚类，构建之后新增的条目仍按暴力方式扫描
+"""
+
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.environ.get('CLIP_IMAGE_INDEX_DIR', os.path.join(CURRENT_DIR, '.cache', 'clip_image_index'))
+
+GROW_ROWS = 65536                                                   # 矩阵文件每次扩容的行数
+SEARCH_BLOCK_ROWS = 65536                                           # 暴力检索每块的行数（float32 临时矩阵约 128MB）
+MAX_TOP_K = 1000
+IVF_NPROBE = int(os.environ.get('CLIP_IVF_NPROBE', 16))            # IVF 检索时扫描的聚类数
+IVF_TRAIN_SAMPLE = 100000                                           # k-means 训练样本数上限
+LOAD_WORKERS = int(os.environ.get('CLIP_INDEX_LOAD_WORKERS', min(8, os.cpu_count() or 1)))
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.webp', '.tif', '.tiff'}
+
+def _top_k(scores, k):
+    """scores: (Q, N)，返回每行分数最高的 k 个下标（降序）"""
+    k = min(k, scores.shape[1])
+    part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=1), axis=1)
+    return np.take_along_axis(part, order, axis=1)
+
+class ImageEmbeddingIndex:
+    """内存映射的图像嵌入矩阵 + 条目列表，可选 IVF；线程安全，其他进程写入后 refresh 即可看到新条目"""
+
+    def __init__(self, directory=INDEX_DIR, dim=None, model_name=None):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.vectors_path = os.path.join(directory, 'vectors.f16')
+        self.items_path = os.path.join(directory, 'items.jsonl')
+        self.ivf_path = os.path.join(directory, 'ivf.npz')
+        self._lock = threading.RLock()
+        self._meta_mtime = None
+        self._vectors = None
+        self._items_offset = 0      # items.jsonl 中已计入条目的字节位置
+        self.items = []
+        self.ivf = None
+
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.meta_path):
+            self.refresh()
+            if dim is not None and dim != self.dim:
+                raise ValueError(f"索引维度 {self.dim} 与模型嵌入维度 {dim} 不一致")
+            if model_name and self.model_name and model_name != self.model_name:
+                print(f"⚠️ 索引由 {self.model_name} 构建，当前模型为 {model_name}")
+        else:
+            if dim is None:
+                raise ValueError(f"索引不存在: {directory}")
+            self.dim, self.count, self.capacity, self.model_name = dim, 0, 0, model_name
+            open(self.items_path, 'a').close()
+            self._write_meta()
+
+    def __len__(self):
+        return self.count
+
+    # ========================================================================
+    # 存储
+    # ========================================================================
+
+    def _write_meta(self):
+        tmp_path = self.meta_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'dim': self.dim, 'count': self.count, 'capacity': self.capacity,
+                       'model': self.model_name}, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = os.path.getmtime(self.meta_path)
+
+    def _open_vectors(self):
+        self._vectors = None
+        if self.capacity:
+            self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode='r+',
+                                      shape=(self.capacity, self.dim))
+
+    def refresh(self):
+        """meta.json 有变化时（例如构建脚本追加了条目）重新映射矩阵并读取新增条目"""
+        with self._lock:
+            mtime = os.path.getmtime(self.meta_path)
+            if mtime == self._meta_mtime:
+                return False
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            self.dim, self.count = meta['dim'], meta['count']
+            self.capacity, self.model_name = meta['capacity'], meta.get('model')
+            self._meta_mtime = mtime
+            self._open_vectors()
+
+            # 只读取新增的条目；meta 之外多出的行（写入中或上次中断遗留）不计入
+            if len(self.items) > self.count:
+                self.items, self._items_offset = [], 0
+            with open(self.items_path, 'rb') as f:
+                f.seek(self._items_offset)
+                while len(self.items) < self.count:
+                    line = f.readline()
+                    if not line.endswith(b'\n'):
+                        break
+                    self.items.append(json.loads(line))
+                    self._items_offset = f.tell()
+            if os.path.exists(self.ivf_path):
+                ivf = np.load(self.ivf_path)
+                self.ivf = {key: ivf[key] for key in ivf.files} if int(ivf['count']) <= self.count else None
+            else:
+                self.ivf = None
+            return True
+
+    def _grow(self, rows):
+        capacity = self.capacity + max(GROW_ROWS, rows)
+        self._vectors = None
+        with open(self.vectors_path, 'ab') as f:
+            f.truncate(capacity * self.dim * 2)
+        self.capacity = capacity
+        self._open_vectors()
+
+    def add(self, vectors, items):
+        """
+        追加嵌入与条目
+        vectors: (N, dim) 已归一化的嵌入；items: 等长的 dict 列表（至少包含 path 或 name）
+        矩阵先落盘，最后更新 meta.json，中途中断时已写入的条目不会被计入
+        """
+        vectors = np.asarray(vectors, dtype=np.float16)
+        if len(vectors) != len(items):
+            raise ValueError("嵌入与条目数量不一致")
+        with self._lock:
+            if self.count + len(vectors) > self.capacity:
+                self._grow(self.count + len(vectors) - self.capacity)
+            self._vectors[self.count:self.count + len(vectors)] = vectors
+            self._vectors.flush()
+            with open(self.items_path, 'r+b') as f:
+                f.seek(self._items_offset)
+                for item in items:
+                    f.write(json.dumps(item, ensure_ascii=False).encode('utf-8') + b'\n')
+                f.truncate()
+                self._items_offset = f.tell()
+            self.items.extend(items)
+            self.count += len(vectors)
+            self._write_meta()
+
+    def known_paths(self):
+        with self._lock:
+            return {item['path'] for item in self.items if 'path' in item}
+
+    # ========================================================================
+    # 检索
+    # ========================================================================
+
+    def _scan(self, queries, rows, k):
+        """对给定行（None 表示全部）分块打分，返回 (Q, k') 的行号与分数"""
+        total = self.count if rows is None else len(rows)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, total, SEARCH_BLOCK_ROWS):
+            if rows is None:
+                ids = np.arange(start, min(start + SEARCH_BLOCK_ROWS, total))
+                block = self._vectors[start:start + len(ids)]
+            else:
+                ids = np.sort(rows[start:start + SEARCH_BLOCK_ROWS])
+                block = self._vectors[ids]
+            scores = queries @ block.astype(np.float32).T
+            top = _top_k(scores, k)
+            best_ids = np.concatenate([best_ids, ids[top]], axis=1)
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+            if best_ids.shape[1] > k:
+                top = _top_k(best_scores, k)
+                best_ids = np.take_along_axis(best_ids, top, axis=1)
+                best_scores = np.take_along_axis(best_scores, top, axis=1)
+        return best_ids, best_scores
+
+    def search(self, queries, k=10, nprobe=IVF_NPROBE, exact=False):
+        """
+        queries: (Q, dim) 或 (dim,) 的归一化查询向量
+        返回每个查询的 [{'id', 'score', **条目}]，按分数降序
+        有 IVF 且 exact=False 时只扫描最近的 nprobe 个聚类与 IVF 构建后新增的条目
+        """
+        self.refresh()
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        k = max(1, min(int(k), MAX_TOP_K))
+        with self._lock:
+            if self.count == 0:
+                return [[] for _ in queries]
+            if self.ivf is None or exact:
+                ids, scores = self._scan(queries, None, k)
+            else:
+                ids, scores = self._ivf_search(queries, k, nprobe)
+            items = self.items
+        return [
+            [{'id': int(i), 'score': round(float(s), 4), **items[i]} for i, s in zip(row_ids, row_scores)]
+            for row_ids, row_scores in zip(ids, scores)
+        ]
+
+    def _ivf_search(self, queries, k, nprobe):
+        ivf = self.ivf
+        centroids, order, offsets = ivf['centroids'], ivf['order'], ivf['offsets']
+        tail = np.arange(int(ivf['count']), self.count)
+        probes = _top_k(queries @ centroids.T, max(1, min(nprobe, len(centroids))))
+        results_ids, results_scores = [], []
+        for query, lists in zip(queries, probes):
+            rows = np.concatenate([order[offsets[c]:offsets[c + 1]] for c in lists] + [tail])
+            if len(rows) == 0:
+                results_ids.append(np.empty(0, dtype=np.int64))
+                results_scores.append(np.empty(0, dtype=np.float32))
+                continue
+            ids, scores = self._scan(query[None], rows, k)
+            results_ids.append(ids[0])
+            results_scores.append(scores[0])
+        return results_ids, results_scores
+
+    def build_ivf(self, nlist=None, iterations=10, seed=0):
+        """
+        球面 k-means 构建 IVF（聚类数默认约 4*sqrt(N)），结果保存为 ivf.npz
+        聚类中心在采样上训练，然后分块把全部向量分配到最近的中心
+        """
+        with self._lock:
+            count = self.count
+            if count == 0:
+                raise ValueError("索引为空")
+            nlist = max(1, min(nlist or int(4 * np.sqrt(count)), count))
+            rng = np.random.default_rng(seed)
+            sample = np.sort(rng.choice(count, size=min(count, max(IVF_TRAIN_SAMPLE, nlist)), replace=False))
+            data = self._vectors[sample].astype(np.float32)
+
+            centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+            for _ in range(iterations):
+                assign = np.argmax(data @ centroids.T, axis=1)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assign, data)
+                empty = np.bincount(assign, minlength=nlist) == 0
+                sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+                centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+
+            assign = np.empty(count, dtype=np.int64)
+            for start in range(0, count, SEARCH_BLOCK_ROWS):
+                block = self._vectors[start:min(start + SEARCH_BLOCK_ROWS, count)].astype(np.float32)
+                assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            order = np.argsort(assign, kind='stable')
+            offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))])
+
+            np.savez(self.ivf_path, centroids=centroids.astype(np.float32), order=order,
+                     offsets=offsets, count=np.int64(count))
+            self.ivf = {'centroids': centroids.astype(np.float32), 'order': order,
+                        'offsets': offsets, 'count': np.int64(count)}
+            return nlist
+
+    def info(self):
+        self.refresh()
+        with self._lock:
+            return {
+                'directory': self.directory,
+                'model': self.model_name,
+                'dim': self.dim,
+                'count': self.count,
+                'size_mb': round(self.count * self.dim * 2 / 1024 / 1024, 2),
+                'ivf_lists': len(self.ivf['centroids']) if self.ivf is not None else None,
+                'ivf_unindexed': self.count - int(self.ivf['count']) if self.ivf is not None else None,
+            }
+
+# ============================================================================
+# 批量建索引
+# ============================================================================
+
+def list_images(directory):
+    """递归列出目录下的图片文件（排序后返回，保证重复运行时顺序一致）"""
+    paths = []
+    for root, _, files in os.walk(directory):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS:
+                paths.append(os.path.abspath(os.path.join(root, name)))
+    return sorted(paths)
+
+def _load(path):
+    try:
+        with Image.open(path) as image:
+            return image.convert('RGB')
+    except Exception as e:
+        return e
+
+def index_images(index, encode, paths, batch_size=64):
+    """
+    把图片编码后追加到索引，已索引的路径自动跳过（中断后重新运行即可续建）
+    encode(images) -> (N, dim) 归一化嵌入；下一批图片的读取与当前批的编码重叠进行
+    返回 (新增条目数, 读取失败数)
+    """
+    known = index.known_paths()
+    paths = [path for path in paths if path not in known]
+    batches = [paths[i:i + batch_size] for i in range(0, len(paths), batch_size)]
+    added = failed = 0
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        pending = [pool.submit(_load, path) for path in batches[0]] if batches else []
+        for batch_index, batch in enumerate(batches):
+            images = [future.result() for future in pending]
+            if batch_index + 1 < len(batches):
+                pending = [pool.submit(_load, path) for path in batches[batch_index + 1]]
+            valid = [(path, image) for path, image in zip(batch, images) if not isinstance(image, Exception)]
+            failed += len(batch) - len(valid)
+            if valid:
+                vectors = encode([image for _, image in valid])
+                index.add(vectors, [{'path': path} for path, _ in valid])
+                added += len(valid)
+            elapsed = time.time() - start_time
+            print(f"  已索引 {added}/{len(paths)} 张（{added / max(elapsed, 1e-6):.1f} 张/秒）", end='\r')
+    if paths:
+        print()
+    return added, failed
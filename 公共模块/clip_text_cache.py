@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+CLIP 文本嵌入缓存
+按 (提示词模板, 标签) 缓存归一化后的文本嵌入：内存 LRU + SQLite 持久化，重启后无需重新编码。
+常用标签集合预先拼成矩阵（可按名字注册），打分时只需编码图片，再与标签矩阵做一次矩阵乘法，
+结果与 zero-shot-image-classification pipeline 一致（logit_scale * 余弦相似度后 softmax）
+"""
+
+import os
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.environ.get(
+    'CLIP_TEXT_CACHE_PATH',
+    os.path.join(CURRENT_DIR, '.cache', 'clip_text_embeddings.sqlite3')
+)
+
+DEFAULT_TEMPLATE = 'This is a photo of {}.'                             # 与 pipeline 默认的 hypothesis_template 相同
+MAX_MEMORY_ITEMS = int(os.environ.get('CLIP_TEXT_CACHE_ITEMS', 20000))  # 内存 LRU 中的嵌入条数上限
+MAX_LABEL_SETS = 256                                                    # 未命名标签集合矩阵的 LRU 上限
+MAX_NAMED_SETS = int(os.environ.get('CLIP_MAX_NAMED_SETS', 32))         # 通过接口注册的命名集合数上限（矩阵常驻）
+MAX_SET_LABELS = int(os.environ.get('CLIP_MAX_SET_LABELS', 1000))       # 通过接口注册的单个集合的标签数上限
+ENCODE_BATCH_SIZE = 256                                                 # 单次送入文本塔的标签数
+
+class ClipTextCache:
+    """CLIP 文本嵌入缓存与标签集合打分，线程安全"""
+
+    def __init__(self, model, tokenizer, image_processor, db_path=DEFAULT_DB_PATH,
+                 max_memory_items=MAX_MEMORY_ITEMS, max_label_sets=MAX_LABEL_SETS,
+                 max_named_sets=MAX_NAMED_SETS, max_set_labels=MAX_SET_LABELS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.image_processor = image_processor
+        self.device = model.device
+        self.model_name = getattr(model.config, '_name_or_path', '') or model.config.model_type
+        self.max_memory_items = max_memory_items
+        self.max_label_sets = max_label_sets
+        self.max_named_sets = max_named_sets
+        self.max_set_labels = max_set_labels
+        self._memory = OrderedDict()       # (template, label) -> 归一化嵌入（CPU float32）
+        self._label_sets = OrderedDict()   # (template, labels) -> 设备上的 (N, D) 矩阵
+        self._named_sets = {}              # 名字 -> (template, labels)
+        self._config_names = set()         # 来自配置文件的命名集合，不计入上限、不可被接口覆盖
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'encoded': 0, 'matrix_hits': 0, 'matrix_builds': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS embeddings ('
+            'model TEXT, template TEXT, label TEXT, dim INTEGER, vector BLOB, '
+            'PRIMARY KEY (model, template, label))'
+        )
+        self._db.commit()
+
+    # ========================================================================
+    # 文本嵌入
+    # ========================================================================
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, template, labels):
+        """只查缓存（内存 -> 磁盘），返回 {label: 向量}，调用方需持有锁"""
+        found = {}
+        for label in labels:
+            vector = self._memory.get((template, label))
+            if vector is not None:
+                self._memory.move_to_end((template, label))
+                found[label] = vector
+                self.stats['memory_hits'] += 1
+
+        missing = [label for label in labels if label not in found]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            rows = self._db.execute(
+                f'SELECT label, vector FROM embeddings WHERE model=? AND template=? '
+                f'AND label IN ({",".join("?" * len(chunk))})',
+                (self.model_name, template, *chunk)
+            ).fetchall()
+            for label, blob in rows:
+                vector = torch.from_numpy(np.frombuffer(blob, dtype=np.float32).copy())
+                self._remember((template, label), vector)
+                found[label] = vector
+                self.stats['disk_hits'] += 1
+        return found
+
+    def encode_texts(self, texts):
+        """文本塔批量编码（不经过缓存），返回 L2 归一化后的 CPU float32 向量"""
+        vectors = []
+        with torch.no_grad():
+            for start in range(0, len(texts), ENCODE_BATCH_SIZE):
+                inputs = self.tokenizer(texts[start:start + ENCODE_BATCH_SIZE], padding=True,
+                                        truncation=True, return_tensors='pt').to(self.device)
+                features = self.model.get_text_features(**inputs)
+                features = features / features.norm(dim=-1, keepdim=True)
+                vectors.append(features.float().cpu())
+        return torch.cat(vectors)
+
+    def text_embeddings(self, labels, template=DEFAULT_TEMPLATE):
+        """返回 (len(labels), D) 的归一化文本嵌入（CPU），未缓存的标签合并为一批编码并写入缓存"""
+        unique = list(dict.fromkeys(labels))
+        with self._lock:
+            found = self._lookup(template, unique)
+            missing = [label for label in unique if label not in found]
+            if missing:
+                encoded = self.encode_texts([template.format(label) for label in missing])
+                rows = []
+                for label, vector in zip(missing, encoded):
+                    self._remember((template, label), vector)
+                    found[label] = vector
+                    rows.append((self.model_name, template, label, vector.numel(), vector.numpy().tobytes()))
+                self._db.executemany('INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?)', rows)
+                self._db.commit()
+                self.stats['encoded'] += len(missing)
+            return torch.stack([found[label] for label in labels])
+
+    # ========================================================================
+    # 标签集合矩阵
+    # ========================================================================
+
+    def label_matrix(self, labels, template=DEFAULT_TEMPLATE):
+        """标签集合对应的 (N, D) 设备端矩阵，按 (模板, 标签序列) 缓存"""
+        key = (template, tuple(labels))
+        with self._lock:
+            matrix = self._label_sets.get(key)
+            if matrix is not None:
+                self._label_sets.move_to_end(key)
+                self.stats['matrix_hits'] += 1
+                return matrix
+
+        matrix = self.text_embeddings(labels, template).to(self.device, dtype=self.model.dtype)
+        named = {(t, tuple(l)) for t, l in self._named_sets.values()}
+        with self._lock:
+            self._label_sets[key] = matrix
+            self.stats['matrix_builds'] += 1
+            # 命名集合常驻，其余按 LRU 淘汰
+            for old_key in list(self._label_sets):
+                if len(self._label_sets) <= self.max_label_sets + len(named):
+                    break
+                if old_key not in named:
+                    del self._label_sets[old_key]
+        return matrix
+
+    def register(self, name, labels, template=DEFAULT_TEMPLATE, from_config=False):
+        """
+        注册命名标签集合并立即构建矩阵
+        接口注册的集合受 max_named_sets / max_set_labels 限制，超出或试图覆盖配置文件中的集合时抛出 ValueError
+        """
+        labels = list(labels)
+        with self._lock:
+            if from_config:
+                self._config_names.add(name)
+            else:
+                if name in self._config_names:
+                    raise ValueError(f'标签集合 {name} 来自配置文件，不能覆盖')
+                if len(labels) > self.max_set_labels:
+                    raise ValueError(f'标签数 {len(labels)} 超出上限 {self.max_set_labels}')
+                registered = len(self._named_sets) - len(self._config_names)
+                if name not in self._named_sets and registered >= self.max_named_sets:
+                    raise ValueError(f'命名标签集合已达上限 {self.max_named_sets}')
+            self._named_sets[name] = (template, labels)
+        self.label_matrix(labels, template)
+        return len(labels)
+
+    def named(self, name):
+        """返回命名集合的 (template, labels)，不存在时返回 None"""
+        return self._named_sets.get(name)
+
+    def load_label_sets(self, path):
+        """从 JSON 文件注册标签集合：{名字: [标签...]} 或 {名字: {"labels": [...], "template": "..."}}"""
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path, 'r', encoding='utf-8') as f:
+            label_sets = json.load(f)
+        for name, spec in label_sets.items():
+            if isinstance(spec, dict):
+                self.register(name, spec['labels'], spec.get('template', DEFAULT_TEMPLATE), from_config=True)
+            else:
+                self.register(name, spec, from_config=True)
+        return len(label_sets)
+
+    # ========================================================================
+    # 打分
+    # ========================================================================
+
+    def image_embeddings(self, images):
+        """图片塔批量编码，返回设备上 L2 归一化后的 (N, D) 矩阵"""
+        inputs = self.image_processor(images=images, return_tensors='pt')
+        pixel_values = inputs['pixel_values'].to(self.device, dtype=self.model.dtype)
+        with torch.no_grad():
+            features = self.model.get_image_features(pixel_values=pixel_values)
+        return features / features.norm(dim=-1, keepdim=True)
+
+    def classify(self, images, labels, template=DEFAULT_TEMPLATE):
+        """
+        多张图片对同一标签集合打分：一次图片编码 + 一次矩阵乘法
+        返回每张图片按分数降序的 [{'label', 'score'}]
+        """
+        matrix = self.label_matrix(labels, template)
+        image_features = self.image_embeddings(images)
+        with torch.no_grad():
+            logits = self.model.logit_scale.exp() * image_features @ matrix.T
+            probs = logits.float().softmax(dim=-1).cpu()
+
+        results = []
+        for row in probs:
+            order = torch.argsort(row, descending=True).tolist()
+            results.append([{'label': labels[i], 'score': float(row[i])} for i in order])
+        return results
+
+    def info(self):
+        with self._lock:
+            disk_items = self._db.execute(
+                'SELECT COUNT(*) FROM embeddings WHERE model=?', (self.model_name,)
+            ).fetchone()[0]
+            return {
+                'model': self.model_name,
+                'memory_items': len(self._memory),
+                'disk_items': disk_items,
+                'label_sets': len(self._label_sets),
+                'named_sets': sorted(self._named_sets),
+                **self.stats,
+            }
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+深度图输出格式
+png8（归一化到 0-255 的可视化图，原有格式）、png16（归一化到 0-65535 的 16 位 PNG，附带 min/max 可还原数值）、
+npy / npz（float16 原始数值，npz 为 zlib 压缩）、raw（float16 小端字节流，形状通过元数据给出）、
+preview（长边缩小到 PREVIEW_MAX_SIDE 的 8 位预览图）
+"""
+
+import io
+import os
+
+import numpy as np
+from PIL import Image
+
+FORMATS = ('png8', 'png16', 'npy', 'npz', 'raw', 'preview')
+PREVIEW_MAX_SIDE = int(os.environ.get('DEPTH_PREVIEW_SIDE', 256))              # 预览图长边
+PNG_COMPRESS_LEVEL = int(os.environ.get('DEPTH_PNG_COMPRESS_LEVEL', 6))        # PNG 压缩级别 0-9（越大越小、越慢）
+
+MIMETYPES = {
+    'png8': 'image/png',
+    'png16': 'image/png',
+    'preview': 'image/png',
+    'npy': 'application/octet-stream',
+    'npz': 'application/octet-stream',
+    'raw': 'application/octet-stream',
+}
+EXTENSIONS = {'png8': 'png', 'png16': 'png', 'preview': 'png', 'npy': 'npy', 'npz': 'npz', 'raw': 'bin'}
+
+def _normalize(depth, max_value, depth_min, depth_max):
+    """把 [depth_min, depth_max] 线性映射到 [0, max_value]，返回 float32 数组"""
+    span = depth_max - depth_min
+    scaled = (depth - depth_min) * (max_value / span) if span > 0 else np.zeros_like(depth)
+    return np.nan_to_num(scaled, nan=0.0)
+
+def _preview_size(shape, preview_max_side):
+    """预览图尺寸 (宽, 高)：长边缩小到 preview_max_side，不放大"""
+    height, width = shape[:2]
+    scale = min(1.0, preview_max_side / max(height, width))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+def _png(pixels, compress_level):
+    buffered = io.BytesIO()
+    Image.fromarray(pixels).save(buffered, format="PNG", compress_level=compress_level)
+    return buffered.getvalue()
+
+def describe(depth, fmt='png8', preview_max_side=PREVIEW_MAX_SIDE):
+    """不做编码，只返回 encode 给出的元数据（不含 bytes）：format、shape、dtype、min、max"""
+    if fmt not in FORMATS:
+        raise ValueError(f"不支持的格式: {fmt}")
+    depth = np.asarray(depth, dtype=np.float32)
+    shape = list(depth.shape)
+    if fmt == 'preview':
+        width, height = _preview_size(depth.shape, preview_max_side)
+        shape = [height, width]
+    return {
+        'format': fmt,
+        'shape': shape,
+        'dtype': {'png8': 'uint8', 'preview': 'uint8', 'png16': 'uint16'}.get(fmt, 'float16'),
+        'min': float(np.nanmin(depth)),
+        'max': float(np.nanmax(depth)),
+    }
+
+def encode(depth, fmt='png8', compress_level=PNG_COMPRESS_LEVEL, preview_max_side=PREVIEW_MAX_SIDE):
+    """
+    depth: (高, 宽) 浮点深度
+    返回 (字节, mimetype, 元数据)；元数据为 describe 的结果加上 bytes
+    png 类格式的像素值 p 可还原为 min + p / 最大像素值 * (max - min)
+    """
+    meta = describe(depth, fmt, preview_max_side)
+    depth = np.asarray(depth, dtype=np.float32)
+
+    if fmt in ('png8', 'preview'):
+        pixels = _normalize(depth, 255, meta['min'], meta['max']).round().astype(np.uint8)
+        if fmt == 'preview' and max(depth.shape) > preview_max_side:
+            size = _preview_size(depth.shape, preview_max_side)
+            pixels = np.asarray(Image.fromarray(pixels).resize(size, Image.BILINEAR))
+        data = _png(pixels, compress_level)
+    elif fmt == 'png16':
+        pixels = _normalize(depth, 65535, meta['min'], meta['max'])
+        data = _png(pixels.round().astype('<u2'), compress_level)
+    else:
+        values = depth.astype('<f2')
+        buffered = io.BytesIO()
+        if fmt == 'npy':
+            np.save(buffered, values)
+            data = buffered.getvalue()
+        elif fmt == 'npz':
+            np.savez_compressed(buffered, depth=values)
+            data = buffered.getvalue()
+        else:
+            data = values.tobytes()
+
+    meta['bytes'] = len(data)
+    return data, MIMETYPES[fmt], meta
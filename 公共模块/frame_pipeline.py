@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+实时视频流水线
+采集、检测、编码/发送分别在独立线程中运行，线程之间用有界的丢弃最旧队列连接：
+任何一级变慢只会丢掉过时的帧，不会拖慢摄像头读取。检测结果单独保存，编码线程把每一帧
+与最新的检测结果配对发送。按实测的检测延迟与采集间隔自动调整送检间隔（每 skip 帧送检一次），
+并统计各级的 FPS、延迟与丢帧数
+"""
+
+import os
+import math
+import time
+import threading
+from collections import deque
+
+QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', 2))     # 每级队列长度，满时丢弃最旧的帧
+MAX_SKIP = int(os.environ.get('PIPELINE_MAX_SKIP', 8))          # 自适应送检间隔上限
+EMA_ALPHA = 0.2                                                 # 延迟 / 间隔的指数滑动平均系数
+STATS_INTERVAL = 1.0                                            # 统计信息的发布间隔（秒）
+
+class LatestQueue:
+    """有界队列，满时丢弃最旧的元素；get 超时返回 None"""
+
+    def __init__(self, maxsize=QUEUE_SIZE):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=0.1):
+        with self._cond:
+            if not self._items:
+                self._cond.wait(timeout)
+            return self._items.popleft() if self._items else None
+
+    def __len__(self):
+        return len(self._items)
+
+class StageStats:
+    """单级统计：处理帧数、FPS（按统计间隔计算）、平均延迟（EMA）"""
+
+    def __init__(self):
+        self.count = 0
+        self.latency = None
+        self.fps = 0.0
+        self._window_start = time.time()
+        self._window_count = 0
+        self._lock = threading.Lock()
+
+    def record(self, latency):
+        with self._lock:
+            self.count += 1
+            self._window_count += 1
+            self.latency = latency if self.latency is None else self.latency + EMA_ALPHA * (latency - self.latency)
+            elapsed = time.time() - self._window_start
+            if elapsed >= STATS_INTERVAL:
+                self.fps = self._window_count / elapsed
+                self._window_start = time.time()
+                self._window_count = 0
+
+    def info(self):
+        with self._lock:
+            return {
+                'frames': self.count,
+                'fps': round(self.fps, 1),
+                'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+            }
+
+class FramePipeline:
+    """
+    三级流水线
+    read_frame() -> 帧，返回 None 表示源已结束或读取失败
+    detect(frame) -> 检测结果
+    publish(frame, result, info) 编码并发送；result 为最新的检测结果（尚无结果时为 None），
+    info 包含 seq、result_seq、skip，以及每 STATS_INTERVAL 秒一次的 stats
+    """
+
+    def __init__(self, read_frame, detect, publish, max_skip=MAX_SKIP, queue_size=QUEUE_SIZE, name='pipeline'):
+        self.read_frame = read_frame
+        self.detect = detect
+        self.publish = publish
+        self.max_skip = max_skip
+        self.name = name
+        self.skip = 1
+        self.running = False
+        self.detect_queue = LatestQueue(1)          # 检测只需要最新的一帧
+        self.publish_queue = LatestQueue(queue_size)
+        self.stages = {'capture': StageStats(), 'detect': StageStats(), 'publish': StageStats()}
+        self.end_to_end = StageStats()
+        self._result = None                         # (帧序号, 检测结果)
+        self._result_lock = threading.Lock()
+        self._frame_interval = None
+        self._last_stats = 0.0
+        self._threads = []
+
+    def start(self):
+        self.running = True
+        self._threads = [
+            threading.Thread(target=target, name=f'{self.name}-{stage}', daemon=True)
+            for stage, target in (('capture', self._capture_loop), ('detect', self._detect_loop),
+                                  ('publish', self._publish_loop))
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def join(self, timeout=2.0):
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+    def _adapt_skip(self):
+        """送检间隔 = ceil(检测延迟 / 采集间隔)，检测跟得上时每帧都送检"""
+        detect_latency = self.stages['detect'].latency
+        if detect_latency is None or not self._frame_interval:
+            return
+        self.skip = max(1, min(self.max_skip, math.ceil(detect_latency / self._frame_interval)))
+
+    def _capture_loop(self):
+        seq = 0
+        last_time = None
+        while self.running:
+            start = time.time()
+            frame = self.read_frame()
+            if frame is None:
+                print(f"❌ [{self.name}] 无法读取画面，流水线停止")
+                self.running = False
+                break
+            now = time.time()
+            self.stages['capture'].record(now - start)
+            if last_time is not None:
+                interval = now - last_time
+                self._frame_interval = interval if self._frame_interval is None else \
+                    self._frame_interval + EMA_ALPHA * (interval - self._frame_interval)
+            last_time = now
+
+            seq += 1
+            if seq % self.skip == 0 or self._result is None:
+                self.detect_queue.put((seq, now, frame))
+            self.publish_queue.put((seq, now, frame))
+
+    def _detect_loop(self):
+        while self.running:
+            item = self.detect_queue.get()
+            if item is None:
+                continue
+            seq, captured_at, frame = item
+            start = time.time()
+            try:
+                result = self.detect(frame)
+            except Exception as e:
+                print(f"⚠️ [{self.name}] 检测失败: {e}")
+                continue
+            self.stages['detect'].record(time.time() - start)
+            with self._result_lock:
+                self._result = (seq, result)
+            self._adapt_skip()
+
+    def _publish_loop(self):
+        while self.running:
+            item = self.publish_queue.get()
+            if item is None:
+                continue
+            seq, captured_at, frame = item
+            with self._result_lock:
+                result_seq, result = self._result if self._result is not None else (None, None)
+            info = {'seq': seq, 'result_seq': result_seq, 'skip': self.skip}
+            now = time.time()
+            if now - self._last_stats >= STATS_INTERVAL:
+                self._last_stats = now
+                info['stats'] = self.info()
+
+            start = time.time()
+            try:
+                self.publish(frame, result, info)
+            except Exception as e:
+                print(f"⚠️ [{self.name}] 发送失败: {e}")
+                continue
+            finished = time.time()
+            self.stages['publish'].record(finished - start)
+            self.end_to_end.record(finished - captured_at)
+
+    def info(self):
+        return {
+            'skip': self.skip,
+            'camera_fps': round(1.0 / self._frame_interval, 1) if self._frame_interval else None,
+            'end_to_end_ms': self.end_to_end.info()['latency_ms'],
+            'dropped': {'detect': self.detect_queue.dropped, 'publish': self.publish_queue.dropped},
+            **{stage: stats.info() for stage, stats in self.stages.items()},
+        }
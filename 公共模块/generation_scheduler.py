@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连续批处理生成调度器
+多个对话在 token 级别交错解码：每一步把所有在途请求的下一个 token 拼成一个批次前向一次，
+新请求随时单独预填充后并入批次的 KV 缓存（左侧填充对齐），每个请求独立判断停止，
+生成的增量文本逐 token 放入请求自己的事件队列，供 SSE 流式推送。
+配置了前缀缓存时，预填充从命中的最长前缀的 KV 续算，只计算剩余的 token；
+多轮会话可传入上一轮结束时的 KV（past），并要求结束时导出本轮的 KV（keep_cache）；
+配置了推测解码器时，只有一个在途请求的空闲时段改用草稿模型推测 + 目标模型验证
+"""
+
+import os
+import time
+import queue
+import threading
+
+import torch
+from transformers import (
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+try:
+    from transformers import DynamicCache
+except ImportError:  # transformers < 4.36 只支持元组格式的 past_key_values
+    DynamicCache = None
+
+from prefix_cache import PrefixKVCache
+
+MAX_BATCH_SIZE = int(os.environ.get('GENERATION_MAX_BATCH_SIZE', 8))  # 同时解码的最大请求数
+MAX_WAITING = int(os.environ.get('GENERATION_MAX_WAITING', 64))       # 排队等待的请求上限
+IDLE_EXIT_SECONDS = 30                                                # 调度线程空闲多久后退出，有新请求时自动重启
+
+# ============================================================================
+# KV 缓存工具
+# ============================================================================
+
+def cache_to_layers(past_key_values):
+    """past_key_values（Cache 对象或元组）转为 [(key, value), ...]，张量形状 (batch, heads, seq, dim)"""
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        past_key_values = past_key_values.to_legacy_cache()
+    return [(layer[0], layer[1]) for layer in past_key_values]
+
+def layers_to_cache(layers):
+    """[(key, value), ...] 转为模型可接受的 past_key_values"""
+    if DynamicCache is not None and hasattr(DynamicCache, 'from_legacy_cache'):
+        return DynamicCache.from_legacy_cache(tuple(layers))
+    return tuple(layers)
+
+def left_pad(tensor, length, dim):
+    """在 dim 维左侧补零到 length"""
+    pad = length - tensor.shape[dim]
+    if pad <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[dim] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=dim)
+
+# ============================================================================
+# 采样工具
+# ============================================================================
+
+def build_processors(temperature=0.7, top_p=0.8, top_k=None, repetition_penalty=None, do_sample=True):
+    """按采样参数构建 logits 处理链，与 model.generate 的同名参数含义一致"""
+    processors = []
+    if repetition_penalty and repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+    if do_sample:
+        if temperature and temperature != 1.0:
+            processors.append(TemperatureLogitsWarper(temperature))
+        if top_k:
+            processors.append(TopKLogitsWarper(top_k))
+        if top_p is not None and top_p < 1.0:
+            processors.append(TopPLogitsWarper(top_p))
+    return LogitsProcessorList(processors)
+
+def token_probs(processors, do_sample, history_ids, logits):
+    """单个位置的 logits 经处理链后转为概率分布；贪心解码时为 argmax 的 one-hot"""
+    scores = logits.float().unsqueeze(0)
+    if processors:
+        scores = processors(torch.tensor([history_ids], device=scores.device), scores)
+    if do_sample:
+        return torch.softmax(scores, dim=-1)[0]
+    probs = torch.zeros_like(scores[0])
+    probs[scores[0].argmax()] = 1.0
+    return probs
+
+def sample_token(probs):
+    return int(torch.multinomial(probs, num_samples=1)[0])
+
+# ============================================================================
+# 生成请求
+# ============================================================================
+
+class GenerationRequest:
+    """一次生成请求：输入 token、采样参数，以及输出事件队列（('delta', 文本) / ('done', 原因) / ('error', 信息)）"""
+
+    def __init__(self, prompt_ids, max_new_tokens=512, temperature=0.7, top_p=0.8, top_k=None,
+                 repetition_penalty=None, do_sample=True, stop_token_ids=(), past=None, keep_cache=False):
+        self.prompt_ids = list(prompt_ids)
+        self.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.stop_token_ids = set(stop_token_ids)
+
+        self.processors = build_processors(temperature, top_p, top_k, repetition_penalty, do_sample)
+
+        # past: (token_ids, layers)，token_ids 须是 prompt_ids 的前缀；
+        # keep_cache: 正常结束时把本请求的 KV 导出到 self.cache，格式同 past
+        self.past = past
+        self.keep_cache = keep_cache
+        self.cache = None
+
+        self.generated = []
+        self.text = ''
+        self.events = queue.Queue()
+        self.cancelled = False
+        self.done = False
+        self.finish_reason = None
+        self.submitted_at = time.time()
+        self.first_token_at = None
+        self.finished_at = None
+
+        # 批次内状态：前缀缓存命中的 token 数、下一步要送入模型的 token 及其位置
+        self.cached_tokens = 0
+        self.draft = None
+        self.pending_token = None
+        self.position = 0
+
+    def probs(self, history_ids, logits):
+        """按本请求的采样参数计算下一个 token 的概率分布"""
+        return token_probs(self.processors, self.do_sample, history_ids, logits)
+
+    def cancel(self):
+        """客户端断开时调用，调度器会在下一步把该请求移出批次"""
+        self.cancelled = True
+
+    def stream(self, timeout=None):
+        """逐段产出增量文本，生成结束时返回"""
+        while True:
+            kind, value = self.events.get(timeout=timeout)
+            if kind == 'delta':
+                yield value
+            elif kind == 'error':
+                raise RuntimeError(value)
+            else:
+                return
+
+    def result(self, timeout=None):
+        """阻塞等待完整回复"""
+        return ''.join(self.stream(timeout))
+
+    @property
+    def ttft(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.submitted_at
+
+# ============================================================================
+# 调度器
+# ============================================================================
+
+class ContinuousBatchScheduler:
+    """迭代级（连续）批处理：模型只在调度线程中使用，HTTP 线程通过 submit 提交请求"""
+
+    def __init__(self, model, tokenizer, max_batch_size=MAX_BATCH_SIZE, max_waiting=MAX_WAITING,
+                 prefix_cache=None, speculative=None):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_batch_size = max_batch_size
+        self.device = model.device
+        self.prefix_cache = prefix_cache if prefix_cache is not None else PrefixKVCache()
+        self.speculative = speculative
+
+        # 默认停止符与采样参数取自模型的 generation_config，与 model.generate 的行为保持一致
+        gen_config = getattr(model, 'generation_config', None)
+        eos = getattr(gen_config, 'eos_token_id', None)
+        if eos is None:
+            eos = tokenizer.eos_token_id
+        self.eos_token_ids = set(eos if isinstance(eos, (list, tuple)) else [eos])
+        self.default_top_k = getattr(gen_config, 'top_k', None)
+        self.default_repetition_penalty = getattr(gen_config, 'repetition_penalty', None)
+
+        self._waiting = queue.Queue(maxsize=max_waiting)
+        self._lock = threading.Lock()
+        self._thread = None
+
+        # 批次状态：_rows 的顺序与 KV 缓存的 batch 维一致
+        self._rows = []
+        self._cache = None
+        self._mask = None
+
+        self.stats = {
+            'submitted': 0, 'completed': 0, 'cancelled': 0, 'failed': 0, 'rejected': 0,
+            'prefill_tokens': 0, 'prefill_reused_tokens': 0, 'prefill_time': 0.0,
+            'decode_steps': 0, 'decode_tokens': 0, 'decode_time': 0.0,
+            'first_tokens': 0, 'ttft_total': 0.0, 'max_active': 0,
+        }
+
+    def submit(self, prompt_ids, **params):
+        """提交一个请求，立即返回 GenerationRequest；队列已满时抛出 RuntimeError"""
+        params.setdefault('top_k', self.default_top_k)
+        params.setdefault('repetition_penalty', self.default_repetition_penalty)
+        request = GenerationRequest(prompt_ids, stop_token_ids=self.eos_token_ids, **params)
+        try:
+            self._waiting.put_nowait(request)
+        except queue.Full:
+            with self._lock:
+                self.stats['rejected'] += 1
+            raise RuntimeError('生成队列已满，请稍后重试')
+
+        with self._lock:
+            self.stats['submitted'] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, daemon=True, name='generation-scheduler')
+                self._thread.start()
+        return request
+
+    def pin_prefix(self, prefix_ids):
+        """预计算一段共享前缀（如系统提示词）的 KV 并固定在前缀缓存中；需在开始接收请求前调用"""
+        prefix_ids = list(prefix_ids)
+        if not prefix_ids:
+            return False
+        input_ids = torch.tensor([prefix_ids], device=self.device)
+        with torch.no_grad():
+            outputs = self.model(input_ids=input_ids, use_cache=True)
+        return self.prefix_cache.put(prefix_ids, cache_to_layers(outputs.past_key_values), pinned=True)
+
+    # ------------------------------------------------------------------
+    # 调度循环
+    # ------------------------------------------------------------------
+
+    def _loop(self):
+        while True:
+            if not self._rows:
+                try:
+                    request = self._waiting.get(timeout=IDLE_EXIT_SECONDS)
+                except queue.Empty:
+                    with self._lock:
+                        if self._waiting.empty():
+                            self._thread = None
+                            return
+                    continue
+                self._admit(request)
+
+            # 批次有空位就把排队的请求全部接入，尽量压低首 token 延迟
+            while len(self._rows) < self.max_batch_size:
+                try:
+                    request = self._waiting.get_nowait()
+                except queue.Empty:
+                    break
+                self._admit(request)
+
+            try:
+                self._step()
+            except Exception as e:
+                print(f"❌ 批量解码失败: {e}")
+                for request in self._rows:
+                    self._fail(request, e)
+                self._reset()
+
+    def _admit(self, request):
+        """预填充新请求并把它的 KV 缓存并入批次"""
+        if request.cancelled:
+            self._finish(request, 'cancelled')
+            return
+        try:
+            start_time = time.time()
+            layers, logits = self._prefill(request)
+            self.stats['prefill_tokens'] += len(request.prompt_ids) - request.cached_tokens
+            self.stats['prefill_reused_tokens'] += request.cached_tokens
+            self.stats['prefill_time'] += time.time() - start_time
+            request.position = len(request.prompt_ids)
+            self._merge(request, layers)
+        except Exception as e:
+            print(f"❌ 预填充失败: {e}")
+            self._fail(request, e)
+            return
+        self._on_token(request, self._sample(request, logits))
+
+    def _prefill(self, request):
+        """对单个请求做预填充，返回 (每层 KV, 最后一个位置的 logits)"""
+        # 至少留一个 token 现算，才能拿到下一个 token 的 logits
+        limit = len(request.prompt_ids) - 1
+        cached, past = self.prefix_cache.lookup(request.prompt_ids, max_length=limit)
+        if request.past is not None:
+            past_ids, past_layers = request.past
+            if cached < len(past_ids) <= limit and request.prompt_ids[:len(past_ids)] == list(past_ids):
+                cached, past = len(past_ids), past_layers
+            request.past = None
+        request.cached_tokens = cached
+        input_ids = torch.tensor([request.prompt_ids[cached:]], device=self.device)
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                past_key_values=layers_to_cache(past) if past is not None else None,
+                use_cache=True,
+            )
+        return cache_to_layers(outputs.past_key_values), outputs.logits[0, -1]
+
+    def _merge(self, request, layers):
+        """左侧补零对齐序列长度后在 batch 维拼接"""
+        length = layers[0][0].shape[2]
+        mask = torch.ones((1, length), dtype=torch.long, device=self.device)
+        if self._cache is None:
+            merged = layers
+        else:
+            current = cache_to_layers(self._cache)
+            total = max(current[0][0].shape[2], length)
+            merged = [
+                (torch.cat([left_pad(k, total, 2), left_pad(nk, total, 2)]),
+                 torch.cat([left_pad(v, total, 2), left_pad(nv, total, 2)]))
+                for (k, v), (nk, nv) in zip(current, layers)
+            ]
+            mask = torch.cat([left_pad(self._mask, total, 1), left_pad(mask, total, 1)])
+        self._cache = layers_to_cache(merged)
+        self._mask = mask
+        self._rows.append(request)
+        self.stats['max_active'] = max(self.stats['max_active'], len(self._rows))
+
+    def _step(self):
+        """所有在途请求一起前向一步"""
+        self._drop_finished()
+        if not self._rows:
+            return
+        if (self.speculative is not None and self.speculative.active
+                and len(self._rows) == 1 and self._waiting.empty()):
+            self._speculative_step(self._rows[0])
+            return
+
+        start_time = time.time()
+        batch_size = len(self._rows)
+        input_ids = torch.tensor([[request.pending_token] for request in self._rows], device=self.device)
+        position_ids = torch.tensor([[request.position] for request in self._rows], device=self.device)
+        mask = torch.cat([self._mask, self._mask.new_ones((batch_size, 1))], dim=1)
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=input_ids,
+                attention_mask=mask,
+                position_ids=position_ids,
+                past_key_values=self._cache,
+                use_cache=True,
+            )
+        self._cache = outputs.past_key_values
+        self._mask = mask
+
+        logits = outputs.logits[:, -1]
+        for row, request in enumerate(self._rows):
+            request.position += 1
+            self._on_token(request, self._sample(request, logits[row]))
+
+        self.stats['decode_steps'] += 1
+        self.stats['decode_tokens'] += batch_size
+        self.stats['decode_time'] += time.time() - start_time
+
+    def _speculative_step(self, request):
+        """单个在途请求时的一轮推测解码：一次目标模型前向可产出多个 token"""
+        start_time = time.time()
+        length = request.position
+        layers = cache_to_layers(self._cache)
+        start = layers[0][0].shape[2] - length
+        if start:
+            layers = [(k[:, :, start:], v[:, :, start:]) for k, v in layers]
+
+        tokens, layers, request.draft = self.speculative.round(
+            layers,
+            (request.prompt_ids + request.generated)[:length],
+            request.pending_token,
+            request.draft,
+            request.probs,
+            request.max_new_tokens - len(request.generated),
+        )
+        # 目标模型的 KV 现在覆盖 pending token 和被接受的草稿 token
+        fed = length + len(tokens)
+        self._cache = layers_to_cache(layers)
+        self._mask = torch.ones((1, fed), dtype=torch.long, device=self.device)
+
+        emitted = 0
+        for offset, token_id in enumerate(tokens):
+            request.position = length + 1 + offset
+            self._on_token(request, token_id)
+            emitted += 1
+            if request.done:
+                break
+
+        self.stats['decode_steps'] += 1
+        self.stats['decode_tokens'] += emitted
+        self.stats['decode_time'] += time.time() - start_time
+
+    def _drop_finished(self):
+        """移出已结束或已取消的请求，并裁掉所有行都是填充的左侧列"""
+        for request in self._rows:
+            if request.cancelled and not request.done:
+                self._finish(request, 'cancelled')
+        keep = [i for i, request in enumerate(self._rows) if not request.done]
+        if len(keep) == len(self._rows):
+            return
+        if not keep:
+            self._reset()
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        mask = self._mask.index_select(0, index)
+        start = int((mask.sum(dim=0) > 0).nonzero()[0])
+        self._cache = layers_to_cache([
+            (k.index_select(0, index)[:, :, start:], v.index_select(0, index)[:, :, start:])
+            for k, v in cache_to_layers(self._cache)
+        ])
+        self._mask = mask[:, start:]
+        self._rows = [self._rows[i] for i in keep]
+
+    def _reset(self):
+        self._rows = []
+        self._cache = None
+        self._mask = None
+
+    # ------------------------------------------------------------------
+    # 采样与输出
+    # ------------------------------------------------------------------
+
+    def _sample(self, request, logits):
+        return sample_token(request.probs(request.prompt_ids + request.generated, logits))
+
+    def _on_token(self, request, token_id):
+        if request.first_token_at is None:
+            request.first_token_at = time.time()
+            self.stats['first_tokens'] += 1
+            self.stats['ttft_total'] += request.ttft
+        if token_id in request.stop_token_ids:
+            self._finish(request, 'stop')
+            return
+        request.generated.append(token_id)
+        request.pending_token = token_id
+        self._emit(request)
+        if len(request.generated) >= request.max_new_tokens:
+            self._finish(request, 'length')
+
+    def _emit(self, request, final=False):
+        """解码已生成的 token，把新增的文本放入事件队列；多字节字符未完整时先不输出"""
+        text = self.tokenizer.decode(request.generated, skip_special_tokens=True)
+        if text.endswith('\ufffd') and not final:
+            return
+        delta = text[len(request.text):]
+        request.text = text
+        if delta:
+            request.events.put(('delta', delta))
+
+    def _snapshot(self, request):
+        """复制请求在批次中的 KV（去掉左侧填充），返回 (token_ids, layers)"""
+        row = next(i for i, r in enumerate(self._rows) if r is request)
+        length = request.position
+        start = int(self._mask[row].argmax())  # 第一个非填充列
+        layers = [
+            (k[row:row + 1, :, start:start + length].clone(), v[row:row + 1, :, start:start + length].clone())
+            for k, v in cache_to_layers(self._cache)
+        ]
+        return (request.prompt_ids + request.generated)[:length], layers
+
+    def _finish(self, request, reason):
+        if request.done:
+            return
+        if request.keep_cache and reason != 'cancelled' and any(r is request for r in self._rows):
+            try:
+                request.cache = self._snapshot(request)
+            except Exception as e:
+                print(f"⚠️ 导出 KV 失败: {e}")
+        self._emit(request, final=True)
+        request.draft = None
+        request.done = True
+        request.finish_reason = reason
+        request.finished_at = time.time()
+        request.events.put(('done', reason))
+        self.stats['cancelled' if reason == 'cancelled' else 'completed'] += 1
+
+    def _fail(self, request, error):
+        if request.done:
+            return
+        request.draft = None
+        request.done = True
+        request.finish_reason = 'error'
+        request.finished_at = time.time()
+        request.events.put(('error', str(error)))
+        self.stats['failed'] += 1
+
+    def info(self):
+        with self._lock:
+            stats = dict(self.stats)
+        steps = stats['decode_steps']
+        return {
+            'max_batch_size': self.max_batch_size,
+            'active': len(self._rows),
+            'waiting': self._waiting.qsize(),
+            'running': self._thread is not None,
+            'avg_batch_size': round(stats['decode_tokens'] / steps, 2) if steps else 0,
+            'avg_ttft_ms': round(stats['ttft_total'] / stats['first_tokens'] * 1000, 1) if stats['first_tokens'] else 0,
+            'decode_tokens_per_second': (
+                round(stats['decode_tokens'] / stats['decode_time'], 1) if stats['decode_time'] else 0
+            ),
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()},
+            'prefix_cache': self.prefix_cache.info(),
+            'speculative': self.speculative.info() if self.speculative is not None else None,
+        }
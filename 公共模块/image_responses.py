@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片类结果的响应协商
+返回渲染图（标注图、骨骼图、分割叠加图、深度图等）的接口统一经过这里，按请求选择返回方式：
+  inline    （默认，与原接口一致）图片编码后以 base64 放进 JSON
+  json      只返回 JSON，不渲染也不编码图片，适合机器客户端
+  multipart multipart/mixed：第一部分为 JSON，其后每张图片一个原始二进制部分（JPEG / WebP / PNG）
+  url       图片暂存在内存中，JSON 里给出可缓存的 GET 地址（/rendered/<token>）
+渲染图以无参函数传入，只有确实需要返回图片时才会调用。编码格式、质量与速度可用环境变量或请求参数调整
+"""
+
+import io
+import os
+import time
+import uuid
+import base64
+import threading
+from collections import OrderedDict
+
+from flask import Response, jsonify, json, request, url_for
+
+MODES = ('inline', 'json', 'multipart', 'url')
+FORMATS = {'png': 'image/png', 'jpeg': 'image/jpeg', 'webp': 'image/webp'}
+EXTENSIONS = {'image/png': 'png', 'image/jpeg': 'jpg', 'image/webp': 'webp'}
+
+INLINE_FORMAT = os.environ.get('IMAGE_RESPONSE_FORMAT', 'png')             # inline 模式的默认编码（前端按 PNG 显示）
+BINARY_FORMAT = os.environ.get('IMAGE_BINARY_FORMAT', 'jpeg')              # multipart / url 模式的默认编码
+JPEG_QUALITY = int(os.environ.get('IMAGE_JPEG_QUALITY', 85))
+WEBP_QUALITY = int(os.environ.get('IMAGE_WEBP_QUALITY', 80))
+WEBP_METHOD = int(os.environ.get('IMAGE_WEBP_METHOD', 2))                  # 0 最快 ~ 6 最小
+PNG_COMPRESS_LEVEL = int(os.environ.get('IMAGE_PNG_COMPRESS_LEVEL', 6))    # 0 不压缩 ~ 9 最小
+STORE_TTL = int(os.environ.get('RENDERED_IMAGE_TTL', 600))                 # url 模式下图片的保留时间（秒）
+STORE_MAX_BYTES = int(os.environ.get('RENDERED_IMAGE_CACHE_MB', 256)) * 1024 * 1024
+
+# ============================================================================
+# 编码
+# ============================================================================
+
+def encode_image(image, fmt='png', quality=None):
+    """PIL 图像编码为字节，返回 (字节, mimetype)"""
+    buffered = io.BytesIO()
+    if fmt == 'jpeg':
+        image.convert('RGB').save(buffered, format='JPEG', quality=quality or JPEG_QUALITY)
+    elif fmt == 'webp':
+        image.save(buffered, format='WEBP', quality=quality or WEBP_QUALITY, method=WEBP_METHOD)
+    else:
+        image.save(buffered, format='PNG', compress_level=PNG_COMPRESS_LEVEL)
+    return buffered.getvalue(), FORMATS.get(fmt, 'image/png')
+
+def to_base64(image, fmt='png', quality=None):
+    """编码为 base64 字符串（批量接口等仍需内联图片的场合）"""
+    return base64.b64encode(encode_image(image, fmt, quality)[0]).decode('utf-8')
+
+# ============================================================================
+# url 模式的图片暂存
+# ============================================================================
+
+class RenderedImageStore:
+    """token -> (字节, mimetype, 过期时间)；按 TTL 过期，总大小超限时按 LRU 淘汰，线程安全"""
+
+    def __init__(self, ttl=STORE_TTL, max_bytes=STORE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, data, mimetype):
+        token = uuid.uuid4().hex
+        with self._lock:
+            self._items[token] = (data, mimetype, time.time() + self.ttl)
+            self.total_bytes += len(data)
+            self._evict()
+        return token
+
+    def get(self, token):
+        with self._lock:
+            self._evict()
+            entry = self._items.get(token)
+            if entry is None:
+                return None
+            self._items.move_to_end(token)
+            return entry
+
+    def _evict(self):
+        now = time.time()
+        for token in [k for k, (_, _, expires) in self._items.items() if expires < now]:
+            self.total_bytes -= len(self._items.pop(token)[0])
+        while self.total_bytes > self.max_bytes and self._items:
+            self.total_bytes -= len(self._items.popitem(last=False)[1][0])
+
+rendered_images = RenderedImageStore()
+
+def serve_rendered(token):
+    entry = rendered_images.get(token)
+    if entry is None:
+        return '', 404
+    data, mimetype, expires = entry
+    if request.if_none_match.contains(token):
+        return Response(status=304)
+    response = Response(data, mimetype=mimetype)
+    # token 对应的内容不会变化，客户端和代理可以直接缓存到过期为止
+    response.headers['Cache-Control'] = f'private, max-age={max(0, int(expires - time.time()))}, immutable'
+    response.set_etag(token)
+    return response
+
+def install(app):
+    """注册 /rendered/<token> 路由（url 模式需要）"""
+    app.add_url_rule('/rendered/<token>', 'rendered_image', serve_rendered)
+
+# ============================================================================
+# 协商与响应
+# ============================================================================
+
+def negotiate():
+    """
+    从请求中确定 (模式, 编码格式, 质量)
+    参数 response / image_format / quality 可放在表单或查询串中；
+    未指定 response 时，Accept 首选 multipart/mixed 则使用 multipart，否则为 inline
+    """
+    values = request.values
+    mode = (values.get('response') or '').lower()
+    if mode not in MODES:
+        best = request.accept_mimetypes.best_match(['application/json', 'multipart/mixed'])
+        mode = 'multipart' if best == 'multipart/mixed' else 'inline'
+
+    fmt = (values.get('image_format') or (INLINE_FORMAT if mode == 'inline' else BINARY_FORMAT)).lower()
+    fmt = 'jpeg' if fmt == 'jpg' else fmt
+    if fmt not in FORMATS:
+        fmt = 'png'
+    try:
+        quality = max(1, min(int(values.get('quality')), 100)) if values.get('quality') else None
+    except ValueError:
+        quality = None
+    return mode, fmt, quality
+
+def _encoded(source, fmt, quality):
+    """source 为无参渲染函数、PIL 图像或已编码的 (字节, mimetype)"""
+    if callable(source):
+        source = source()
+    if isinstance(source, tuple):
+        return source
+    return encode_image(source, fmt, quality)
+
+def image_response(payload, images, status=200):
+    """
+    按协商结果返回 payload 与图片
+    images: {字段名: 渲染函数 / PIL 图像 / (字节, mimetype)}；值为 None 的字段忽略
+    inline 模式下图片以 base64 写入 payload[字段名]，并附带 payload[字段名 + '_mimetype']
+    url 模式下地址写入 payload[字段名 + '_url']
+    """
+    mode, fmt, quality = negotiate()
+    images = {name: source for name, source in images.items() if source is not None}
+    payload = dict(payload)
+
+    if mode == 'json' or not images:
+        return jsonify(payload), status
+
+    encoded = {name: _encoded(source, fmt, quality) for name, source in images.items()}
+
+    if mode == 'inline':
+        for name, (data, mimetype) in encoded.items():
+            payload[name] = base64.b64encode(data).decode('utf-8')
+            payload[name + '_mimetype'] = mimetype
+        return jsonify(payload), status
+
+    if mode == 'url':
+        for name, (data, mimetype) in encoded.items():
+            payload[name + '_url'] = url_for('rendered_image', token=rendered_images.put(data, mimetype))
+        return jsonify(payload), status
+
+    boundary = uuid.uuid4().hex
+    parts = [(
+        'Content-Type: application/json; charset=utf-8\r\n'
+        'Content-Disposition: inline; name="metadata"\r\n\r\n'
+    ).encode('utf-8') + json.dumps(payload).encode('utf-8')]
+    for name, (data, mimetype) in encoded.items():
+        parts.append((
+            f'Content-Type: {mimetype}\r\n'
+            f'Content-Disposition: inline; name="{name}"; filename="{name}.{EXTENSIONS.get(mimetype, "bin")}"\r\n'
+            f'Content-Length: {len(data)}\r\n\r\n'
+        ).encode('utf-8') + data)
+    body = b''.join(b'--' + boundary.encode() + b'\r\n' + part + b'\r\n' for part in parts)
+    body += b'--' + boundary.encode() + b'--\r\n'
+    return Response(body, status=status, content_type=f'multipart/mixed; boundary={boundary}')
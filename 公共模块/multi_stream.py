@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多路视频流管理
+每路视频源（摄像头编号、RTSP 地址、视频文件）在独立线程中采集，只保留最新一帧；
+调度线程每个节拍收集所有路的新帧，合成一批调用一次检测，再把结果分发回各路的发送回调。
+按延迟预算做准入：用最近的 (批大小, 节拍延迟) 拟合线性代价模型，预测加入新路后超出预算则拒绝；
+运行中节拍延迟持续超出预算时，丢弃最后加入的一路。
+通过网页接口添加的视频源须先经 source_allowed 白名单检查，避免访问者让服务打开任意本地文件或 URL
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from frame_pipeline import StageStats
+
+LATENCY_BUDGET_MS = float(os.environ.get('MULTI_STREAM_LATENCY_BUDGET_MS', 250))  # 单个节拍（整批检测）的延迟预算
+MAX_STREAMS = int(os.environ.get('MULTI_STREAM_MAX_STREAMS', 16))
+DROP_TOLERANCE = 1.2        # 节拍延迟超出预算的容忍倍数
+DROP_PATIENCE = 20          # 连续超出多少个节拍后丢弃一路
+RECONNECT_ATTEMPTS = 5      # 摄像头 / RTSP 读取失败后的重连次数（视频文件读完即结束）
+RECONNECT_DELAY = 2.0
+PUBLISH_WORKERS = int(os.environ.get('MULTI_STREAM_PUBLISH_WORKERS', 4))
+IDLE_SLEEP = 0.005
+# 接口允许添加的视频源前缀（逗号分隔），如 rtsp://192.168.1.10/,/data/videos；'*' 表示不限制（需显式开启）
+ALLOWED_SOURCES = [s.strip() for s in os.environ.get('MULTI_STREAM_ALLOWED_SOURCES', '').split(',') if s.strip()]
+
+class AdmissionError(Exception):
+    """视频源无法加入（超出路数 / 延迟预算，或无法打开）"""
+
+def parse_source(source):
+    """'0' 等数字为摄像头编号，其余（RTSP 地址、文件路径）原样交给 cv2.VideoCapture"""
+    source = str(source).strip()
+    return int(source) if source.isdigit() else source
+
+def source_allowed(source, allowed=None):
+    """
+    视频源白名单检查：摄像头编号始终允许；其余视频源须匹配 allowed（默认 ALLOWED_SOURCES）中的某一项。
+    URL 按字符串前缀匹配（前缀应以 / 结尾，避免匹配到其他主机）；本地路径按规范化后的绝对路径，
+    须位于某个允许的目录之内（或正是允许的文件）；allowed 含 '*' 时不做限制
+    """
+    allowed = ALLOWED_SOURCES if allowed is None else allowed
+    source = parse_source(source)
+    if isinstance(source, int) or '*' in allowed:
+        return True
+    if '://' in source:
+        return any('://' in prefix and source.startswith(prefix) for prefix in allowed)
+    path = os.path.realpath(source)
+    for prefix in allowed:
+        if '://' in prefix:
+            continue
+        root = os.path.realpath(prefix)
+        if path == root or path.startswith(os.path.join(root, '')):
+            return True
+    return False
+
+class VideoStream:
+    """单路视频源：独立采集线程，只保留最新一帧；视频文件按原始帧率播放"""
+
+    def __init__(self, stream_id, source, width=640, height=480):
+        self.id = stream_id
+        self.source = parse_source(source)
+        self.is_file = isinstance(self.source, str) and os.path.isfile(self.source)
+        self.width = width
+        self.height = height
+        self.capture = None
+        self.fps = None
+        self.running = False
+        self.ended = False
+        self.error = None
+        self.dropped = 0                # 发送未完成而跳过的帧
+        self.admitted_at = time.time()
+        self.capture_stats = StageStats()
+        self._frame = None
+        self._seq = 0
+        self._taken = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def open(self):
+        capture = cv2.VideoCapture(self.source)
+        if not capture.isOpened():
+            capture.release()
+            return False
+        if isinstance(self.source, int):
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, self.width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, self.height)
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        self.fps = capture.get(cv2.CAP_PROP_FPS) or None
+        self.capture = capture
+        return True
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name=f'stream-{self.id}', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+
+    def _reconnect(self):
+        self.capture.release()
+        for attempt in range(1, RECONNECT_ATTEMPTS + 1):
+            if not self.running:
+                return False
+            print(f"🔄 [{self.id}] 重新连接 ({attempt}/{RECONNECT_ATTEMPTS})")
+            time.sleep(RECONNECT_DELAY)
+            if self.open():
+                return True
+        return False
+
+    def _loop(self):
+        frame_interval = 1.0 / self.fps if self.is_file and self.fps else 0
+        next_time = time.time()
+        while self.running:
+            start = time.time()
+            ok, frame = self.capture.read()
+            if not ok:
+                if self.is_file:
+                    break
+                if not self._reconnect():
+                    self.error = '视频源读取失败'
+                    break
+                continue
+            self.capture_stats.record(time.time() - start)
+            with self._lock:
+                self._frame = frame
+                self._seq += 1
+            if frame_interval:
+                next_time += frame_interval
+                time.sleep(max(0.0, next_time - time.time()))
+        self.running = False
+        self.ended = True
+        if self.capture is not None:
+            self.capture.release()
+
+    def take(self):
+        """返回上次 take 之后的最新帧 (序号, 帧)，没有新帧时返回 None"""
+        with self._lock:
+            if self._seq == self._taken:
+                return None
+            self._taken = self._seq
+            return self._seq, self._frame
+
+    def info(self):
+        return {
+            'id': self.id,
+            'source': str(self.source),
+            'type': 'file' if self.is_file else ('device' if isinstance(self.source, int) else 'url'),
+            'running': self.running,
+            'error': self.error,
+            'capture': self.capture_stats.info(),
+            'dropped': self.dropped,
+        }
+
+class StreamManager:
+    """
+    多路视频的批量检测调度
+    estimate_batch(frames) -> 与 frames 一一对应的检测结果（一次批量调用）
+    publish(stream_id, frame, result, info) 在发送线程池中执行，同一路上一帧未发送完时跳过新帧
+    on_change(event, stream_id, reason) 在视频源加入（'added'）或移除（'removed'）时调用
+    """
+
+    def __init__(self, estimate_batch, publish, latency_budget_ms=LATENCY_BUDGET_MS, max_streams=MAX_STREAMS,
+                 on_change=None, width=640, height=480):
+        self.estimate_batch = estimate_batch
+        self.publish = publish
+        self.latency_budget = latency_budget_ms / 1000
+        self.max_streams = max_streams
+        self.on_change = on_change
+        self.width = width
+        self.height = height
+        self.streams = OrderedDict()            # 按加入顺序，超出预算时先丢弃最后加入的
+        self.tick_stats = StageStats()
+        self.batch_sizes = deque(maxlen=64)
+        self.running = False
+        self._observations = deque(maxlen=64)   # (批大小, 节拍延迟)
+        self._over_budget = 0
+        self._publishing = set()
+        self._reserved = 0                      # 已通过准入、正在打开的视频源数
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=PUBLISH_WORKERS, thread_name_prefix='stream-publish')
+        self._thread = None
+
+    # ------------------------------------------------------------------
+    # 延迟模型与准入
+    # ------------------------------------------------------------------
+
+    def predict_latency(self, batch_size):
+        """按 延迟 ≈ 固定开销 + 单帧代价 × 批大小 预测一个节拍的延迟（秒），尚无观测时返回 None"""
+        if not self._observations:
+            return None
+        sizes, latencies = np.array(self._observations, dtype=np.float64).T
+        if len(set(sizes)) < 2:
+            return float(latencies.mean() / sizes.mean() * batch_size)
+        per_frame, base = np.polyfit(sizes, latencies, 1)
+        return float(max(base, 0.0) + max(per_frame, 0.0) * batch_size)
+
+    def add(self, source):
+        """加入一路视频源，返回 stream_id；超出路数 / 延迟预算或无法打开时抛出 AdmissionError"""
+        # 准入检查与占位在同一次加锁中完成，打开视频源期间并发的 add 会把这一路计算在内
+        with self._lock:
+            pending = len(self.streams) + self._reserved
+            if pending >= self.max_streams:
+                raise AdmissionError(f'已达到最大路数 {self.max_streams}')
+            predicted = self.predict_latency(pending + 1)
+            if predicted is not None and predicted > self.latency_budget:
+                raise AdmissionError(f'预计节拍延迟 {predicted * 1000:.0f}ms 超出预算 {self.latency_budget * 1000:.0f}ms')
+            stream_id = f'cam{self._next_id}'
+            self._next_id += 1
+            self._reserved += 1
+
+        try:
+            stream = VideoStream(stream_id, source, self.width, self.height)
+            if not stream.open():
+                raise AdmissionError(f'无法打开视频源: {source}')
+            stream.start()
+            with self._lock:
+                self.streams[stream_id] = stream
+        finally:
+            with self._lock:
+                self._reserved -= 1
+        print(f"✅ [{stream_id}] 已加入: {source}")
+        if self.on_change:
+            self.on_change('added', stream_id, None)
+        return stream_id
+
+    def remove(self, stream_id, reason=None):
+        with self._lock:
+            stream = self.streams.pop(stream_id, None)
+        if stream is None:
+            return False
+        stream.stop()
+        print(f"⏹️ [{stream_id}] 已移除{'：' + reason if reason else ''}")
+        if self.on_change:
+            self.on_change('removed', stream_id, reason)
+        return True
+
+    def _enforce_budget(self):
+        latency = self.tick_stats.latency
+        if latency is not None and latency > self.latency_budget * DROP_TOLERANCE and len(self.streams) > 1:
+            self._over_budget += 1
+        else:
+            self._over_budget = 0
+        if self._over_budget >= DROP_PATIENCE:
+            self._over_budget = 0
+            newest = next(reversed(self.streams))
+            self.remove(newest, f'节拍延迟 {latency * 1000:.0f}ms 超出预算 {self.latency_budget * 1000:.0f}ms')
+
+    # ------------------------------------------------------------------
+    # 调度
+    # ------------------------------------------------------------------
+
+    def start(self):
+        self.running = True
+        self._thread = threading.Thread(target=self._loop, name='stream-manager', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.running = False
+        for stream_id in list(self.streams):
+            self.remove(stream_id, '服务停止')
+        self._executor.shutdown(wait=False)
+
+    def _publish(self, stream, seq, frame, result):
+        try:
+            self.publish(stream.id, frame, result, {'seq': seq, 'result_seq': seq, 'skip': 1})
+        except Exception as e:
+            print(f"⚠️ [{stream.id}] 发送失败: {e}")
+        finally:
+            self._publishing.discard(stream.id)
+
+    def _loop(self):
+        while self.running:
+            batch = []
+            for stream in list(self.streams.values()):
+                if stream.ended:
+                    self.remove(stream.id, stream.error or '视频源已结束')
+                    continue
+                item = stream.take()
+                if item is not None:
+                    batch.append((stream, *item))
+            if not batch:
+                time.sleep(IDLE_SLEEP)
+                continue
+
+            start = time.time()
+            try:
+                results = self.estimate_batch([frame for _, _, frame in batch])
+            except Exception as e:
+                print(f"⚠️ 批量检测失败: {e}")
+                results = [None] * len(batch)
+            latency = time.time() - start
+            self.tick_stats.record(latency)
+            self.batch_sizes.append(len(batch))
+            self._observations.append((len(batch), latency))
+
+            for (stream, seq, frame), result in zip(batch, results):
+                if stream.id in self._publishing:
+                    stream.dropped += 1
+                    continue
+                self._publishing.add(stream.id)
+                self._executor.submit(self._publish, stream, seq, frame, result)
+            self._enforce_budget()
+
+    def info(self):
+        with self._lock:
+            streams = list(self.streams.values())
+        predicted = self.predict_latency(len(streams) + 1)
+        return {
+            'latency_budget_ms': round(self.latency_budget * 1000, 1),
+            'max_streams': self.max_streams,
+            'tick': self.tick_stats.info(),
+            'mean_batch_size': round(float(np.mean(self.batch_sizes)), 2) if self.batch_sizes else None,
+            'predicted_ms_with_one_more': round(predicted * 1000, 1) if predicted is not None else None,
+            'streams': [stream.info() for stream in streams],
+        }
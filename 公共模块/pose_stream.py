@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+摄像头姿态流的传输
+检测只输出结构化关键点（topdown_pose 的 (人数, 18, 3) 数组，不渲染骨骼图），发送时压缩为 int16 数组由浏览器自行绘制。
+两种传输模式按观看者区分（连接时的 transport 参数）：
+  binary  画面以原始 JPEG / WebP 二进制附件发送（不做 base64），关键点仅在检测结果更新后发送一次，
+          骨骼图完全不传
+  legacy  原有格式：JSON 中的 base64 原始画面 + base64 骨骼图（只有存在 legacy 观看者时才渲染骨骼图）
+"""
+
+import os
+import base64
+import threading
+
+import cv2
+import numpy as np
+
+from topdown_pose import empty_keypoints, render_keypoints
+
+STREAM_IMAGE_FORMAT = os.environ.get('POSE_STREAM_IMAGE_FORMAT', 'jpeg')  # binary 模式的画面编码：jpeg / webp
+TRANSPORTS = ('binary', 'legacy')
+
+def quantize(keypoints):
+    """关键点数组 -> int16 小端字节：每人 18 个 (x, y, 千分制置信度)，缺失的关键点为 -1"""
+    packed = np.rint(keypoints * np.array([1, 1, 1000], dtype=np.float32))
+    packed[keypoints[..., 2] < 0] = -1
+    return packed.astype('<i2').tobytes()
+
+class PoseResult:
+    """一次检测的结果：关键点数组，以及按需渲染（并缓存）的 OpenPose 风格骨骼图"""
+
+    def __init__(self, frame, keypoints, num_people, latency):
+        self.height, self.width = frame.shape[:2]
+        self.keypoints = keypoints if keypoints is not None else empty_keypoints()
+        self.num_people = num_people
+        self.latency = latency
+        self._frame = frame if keypoints is None else None   # 没有姿态模型时骨骼图退化为原图
+        self._rendered = None
+        self._lock = threading.Lock()
+
+    def rendered(self):
+        """原尺寸 BGR 骨骼图（带人数标注），只在 legacy 观看者需要时生成"""
+        with self._lock:
+            if self._rendered is None:
+                if self._frame is not None:
+                    pose_frame = self._frame.copy()
+                else:
+                    canvas = render_keypoints(self.keypoints, self.width, self.height)
+                    pose_frame = cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR)
+                cv2.putText(pose_frame, f'People: {self.num_people}', (10, 30),
+                            cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+                self._rendered = pose_frame
+            return self._rendered
+
+class FrameBroadcaster:
+    """
+    按观看者的传输模式发送帧；socket.io 房间名即传输模式（多路视频时为 '<channel>:<传输模式>'，负载中附带 stream）
+    binary 房间收 'frame_bin' 事件，legacy 房间收原有的 'frame' 事件，没有观看者的模式不做任何编码
+    """
+
+    def __init__(self, socketio, jpeg_quality=70, image_format=STREAM_IMAGE_FORMAT, channel=None):
+        self.socketio = socketio
+        self.jpeg_quality = jpeg_quality
+        self.image_format = image_format
+        self.channel = channel
+        self.rooms = {transport: f'{channel}:{transport}' if channel else transport for transport in TRANSPORTS}
+        self.members = {transport: set() for transport in TRANSPORTS}
+        self._last_sent = None       # binary 房间最近一次发送关键点的检测序号
+        self._lock = threading.Lock()
+        self.stats = {'frames': 0, 'bytes': 0, 'keypoint_updates': 0}
+
+    def join(self, sid, transport):
+        from flask_socketio import join_room
+        transport = transport if transport in TRANSPORTS else 'legacy'
+        join_room(self.rooms[transport], sid=sid)
+        with self._lock:
+            self.members[transport].add(sid)
+            if transport == 'binary':
+                self._last_sent = None   # 新观看者需要一份完整的关键点
+        return transport
+
+    def leave(self, sid):
+        from flask_socketio import leave_room
+        with self._lock:
+            for transport, members in self.members.items():
+                if sid in members:
+                    members.discard(sid)
+                    leave_room(self.rooms[transport], sid=sid)
+
+    def has_viewers(self):
+        return any(self.members.values())
+
+    def _encode(self, frame, fmt):
+        if fmt == 'webp':
+            _, buffer = cv2.imencode('.webp', frame, [cv2.IMWRITE_WEBP_QUALITY, self.jpeg_quality])
+            return buffer.tobytes(), 'image/webp'
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, self.jpeg_quality])
+        return buffer.tobytes(), 'image/jpeg'
+
+    def publish(self, frame, result, info):
+        """frame: 原始 BGR 帧；result: 最新的 PoseResult（尚无结果时为 None）；info: 流水线附带的 seq / result_seq / skip / stats"""
+        with self._lock:
+            has_binary = bool(self.members['binary'])
+            has_legacy = bool(self.members['legacy'])
+            keypoints_changed = info.get('result_seq') != self._last_sent
+            if has_binary and keypoints_changed:
+                self._last_sent = info.get('result_seq')
+
+        num_people = result.num_people if result is not None else 0
+        latency = result.latency if result is not None else 0
+        common = {'num_people': num_people, 'latency': latency, 'skip': info.get('skip', 1)}
+        if 'stats' in info:
+            common['stats'] = info['stats']
+        if self.channel:
+            common['stream'] = self.channel
+
+        if has_binary:
+            image, mimetype = self._encode(frame, self.image_format)
+            payload = {'image': image, 'mimetype': mimetype, 'seq': info.get('seq'),
+                       'width': frame.shape[1], 'height': frame.shape[0], **common}
+            if keypoints_changed and result is not None:
+                payload['keypoints'] = quantize(result.keypoints)
+                payload['result_seq'] = info.get('result_seq')
+                self.stats['keypoint_updates'] += 1
+            self.socketio.emit('frame_bin', payload, to=self.rooms['binary'])
+            self.stats['bytes'] += len(image) + len(payload.get('keypoints', b''))
+
+        if has_legacy:
+            original, _ = self._encode(frame, 'jpeg')
+            pose, _ = self._encode(result.rendered() if result is not None else frame, 'jpeg')
+            self.socketio.emit('frame', {
+                'original': base64.b64encode(original).decode('utf-8'),
+                'pose': base64.b64encode(pose).decode('utf-8'),
+                **common
+            }, to=self.rooms['legacy'])
+        self.stats['frames'] += 1
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+前缀 KV 缓存
+以 token 前缀的哈希为键保存预填充得到的 past_key_values，新请求命中最长的已缓存前缀后
+只需预填充剩余的 token。固定的系统提示词可以固定（pin）在缓存中，其余条目按字节上限 LRU 淘汰
+"""
+
+import os
+import hashlib
+import threading
+from collections import OrderedDict, Counter
+
+MAX_BYTES = int(os.environ.get('PREFIX_CACHE_MAX_MB', 256)) * 1024 * 1024  # 缓存占用上限（含固定条目）
+
+def prefix_key(token_ids):
+    """token 前缀的哈希键"""
+    return hashlib.sha1(','.join(map(str, token_ids)).encode('ascii')).hexdigest()
+
+def layers_nbytes(layers):
+    """[(key, value), ...] 占用的字节数"""
+    return sum(t.numel() * t.element_size() for layer in layers for t in layer)
+
+class PrefixKVCache:
+    """按 token 前缀查找 KV 缓存，线程安全；缓存的张量只读，使用方续算时会生成新张量"""
+
+    def __init__(self, max_bytes=MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key -> {'ids', 'layers', 'bytes', 'pinned', 'hits'}
+        self._lengths = Counter()      # 已缓存的前缀长度 -> 条目数，查找时只需检查这些长度
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.stats = {'lookups': 0, 'hits': 0, 'reused_tokens': 0, 'inserts': 0, 'evictions': 0, 'rejected': 0}
+
+    def put(self, token_ids, layers, pinned=False):
+        """缓存一段前缀的 KV（batch 维为 1）；超出上限且无法腾出空间时返回 False"""
+        token_ids = tuple(token_ids)
+        key = prefix_key(token_ids)
+        size = layers_nbytes(layers)
+        with self._lock:
+            if key in self._entries:
+                entry = self._entries[key]
+                entry['pinned'] = entry['pinned'] or pinned
+                self._entries.move_to_end(key)
+                return True
+            if not self._make_room(size):
+                self.stats['rejected'] += 1
+                return False
+            self._entries[key] = {'ids': token_ids, 'layers': layers, 'bytes': size, 'pinned': pinned, 'hits': 0}
+            self._lengths[len(token_ids)] += 1
+            self.total_bytes += size
+            self.stats['inserts'] += 1
+            return True
+
+    def lookup(self, token_ids, max_length=None):
+        """返回 (命中的前缀长度, KV)；只匹配不超过 max_length 的前缀，未命中时返回 (0, None)"""
+        token_ids = tuple(token_ids)
+        limit = len(token_ids) if max_length is None else min(max_length, len(token_ids))
+        with self._lock:
+            self.stats['lookups'] += 1
+            for length in sorted((n for n in self._lengths if n <= limit), reverse=True):
+                key = prefix_key(token_ids[:length])
+                entry = self._entries.get(key)
+                if entry is None or entry['ids'] != token_ids[:length]:
+                    continue
+                self._entries.move_to_end(key)
+                entry['hits'] += 1
+                self.stats['hits'] += 1
+                self.stats['reused_tokens'] += length
+                return length, entry['layers']
+        return 0, None
+
+    def _make_room(self, size):
+        """按 LRU 淘汰未固定的条目，直到能放下 size 字节（调用方需持有锁）"""
+        for key in list(self._entries):
+            if self.total_bytes + size <= self.max_bytes:
+                break
+            if not self._entries[key]['pinned']:
+                self._drop(key)
+                self.stats['evictions'] += 1
+        return self.total_bytes + size <= self.max_bytes
+
+    def _drop(self, key):
+        entry = self._entries.pop(key)
+        self.total_bytes -= entry['bytes']
+        self._lengths[len(entry['ids'])] -= 1
+        if not self._lengths[len(entry['ids'])]:
+            del self._lengths[len(entry['ids'])]
+
+    def clear(self, include_pinned=False):
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if include_pinned or not e['pinned']]:
+                self._drop(key)
+
+    def info(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'pinned': sum(1 for e in self._entries.values() if e['pinned']),
+                'prefix_lengths': sorted(self._lengths),
+                'resident_mb': round(self.total_bytes / 1024 / 1024, 2),
+                'max_mb': round(self.max_bytes / 1024 / 1024, 2),
+                **self.stats,
+            }
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+语义分割后处理
+直接处理模型输出的类别图（每个像素一个类别 id），不再为每个类别生成整幅 PIL mask：
+一次 bincount 统计各类面积，查表把类别 id 压缩为连续的区域序号，叠加图用一次调色板查表 + 整数混合完成。
+mask 的返回格式可选：单张索引 PNG（调色板图，像素值为区域序号）、COCO 风格的逐区域 RLE、
+兼容旧接口的逐区域 PNG，或不返回
+"""
+
+import io
+import base64
+
+import numpy as np
+from PIL import Image
+
+# 为每个区域生成不同的颜色（RGB），叠加时的透明度为 OVERLAY_ALPHA
+PALETTE = np.array([
+    (255, 0, 0),      # 红色
+    (0, 255, 0),      # 绿色
+    (0, 0, 255),      # 蓝色
+    (255, 255, 0),    # 黄色
+    (255, 0, 255),    # 品红
+    (0, 255, 255),    # 青色
+    (255, 128, 0),    # 橙色
+    (128, 0, 255),    # 紫色
+    (255, 192, 203),  # 粉色
+    (128, 255, 0),    # 黄绿
+], dtype=np.uint16)
+OVERLAY_ALPHA = 100
+
+MASK_FORMATS = ('indexed', 'rle', 'png', 'none')
+
+def _png_base64(image):
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+def region_colors(num_regions):
+    """区域序号 i（从 0 开始）的颜色，按调色板循环"""
+    return PALETTE[np.arange(num_regions) % len(PALETTE)]
+
+def compact(label_map, num_classes):
+    """
+    统计类别图中出现的类别
+    返回 (类别 id 数组, 各类像素数, 区域图)；区域图中 0 为未出现的背景，i+1 为第 i 个出现的类别
+    """
+    label_map = np.asarray(label_map)
+    counts = np.bincount(label_map.ravel(), minlength=num_classes)
+    class_ids = np.flatnonzero(counts)
+    lut = np.zeros(len(counts), dtype=np.uint8 if len(class_ids) < 255 else np.uint16)
+    lut[class_ids] = np.arange(1, len(class_ids) + 1)
+    return class_ids, counts[class_ids], lut[label_map]
+
+def overlay(image, region_map):
+    """所有区域一次合成：按区域序号查表取颜色与透明度，与原图做整数 alpha 混合"""
+    num_regions = int(region_map.max()) if region_map.size else 0
+    color_lut = np.zeros((num_regions + 1, 3), dtype=np.uint16)
+    alpha_lut = np.zeros(num_regions + 1, dtype=np.uint16)
+    color_lut[1:] = region_colors(num_regions) * OVERLAY_ALPHA
+    alpha_lut[1:] = OVERLAY_ALPHA
+
+    pixels = np.asarray(image.convert('RGB'), dtype=np.uint16)
+    blended = pixels * (255 - alpha_lut[region_map])[..., None] + color_lut[region_map]
+    blended += 127
+    blended //= 255
+    return Image.fromarray(blended.astype(np.uint8))
+
+def indexed_png(region_map):
+    """区域图编码为单张调色板 PNG：像素值即区域序号（0 为背景），调色板与叠加颜色一致"""
+    num_regions = int(region_map.max()) if region_map.size else 0
+    if num_regions > 255:
+        raise ValueError("区域数超过 255，无法编码为索引 PNG")
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[1:num_regions + 1] = region_colors(num_regions)
+    image = Image.fromarray(region_map.astype(np.uint8), mode='P')
+    image.putpalette(palette.ravel().tolist())
+    return _png_base64(image)
+
+def rle_encode(region_map):
+    """
+    整幅区域图一次性游程编码，再拆分为每个区域的 COCO 未压缩 RLE
+    （列优先，counts 从 0 的游程开始交替），返回按区域序号排列的 [{'size': [h, w], 'counts': [...]}]
+    """
+    height, width = region_map.shape
+    flat = region_map.ravel(order='F')
+    total = flat.size
+    starts = np.concatenate([[0], np.flatnonzero(flat[1:] != flat[:-1]) + 1])
+    lengths = np.diff(np.concatenate([starts, [total]]))
+    values = flat[starts]
+
+    order = np.argsort(values, kind='stable')
+    boundaries = np.searchsorted(values[order], np.arange(1, int(flat.max(initial=0)) + 2))
+    encoded = []
+    for region in range(len(boundaries) - 1):
+        runs = order[boundaries[region]:boundaries[region + 1]]
+        run_starts, run_lengths = starts[runs], lengths[runs]
+        run_ends = run_starts + run_lengths
+        gaps = run_starts - np.concatenate([[0], run_ends[:-1]])
+        counts = np.stack([gaps, run_lengths], axis=1).ravel()
+        if run_ends.size and run_ends[-1] < total:
+            counts = np.append(counts, total - run_ends[-1])
+        encoded.append({'size': [height, width], 'counts': counts.tolist()})
+    return encoded
+
+def region_png(region_map, region):
+    """单个区域的黑白 PNG（兼容旧接口的逐区域 mask）"""
+    return _png_base64(Image.fromarray(((region_map == region) * 255).astype(np.uint8), mode='L'))
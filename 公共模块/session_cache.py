@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+多轮对话会话存储
+每个会话保存对话历史、已编码的 token 以及对应的 KV 缓存，下一轮只需预填充新增的 token。
+空闲超时的会话整体删除；KV 总占用超过上限时按 LRU 先释放最久未活跃会话的 KV（保留文字历史，
+下一轮退化为完整预填充）
+"""
+
+import os
+import time
+import threading
+from collections import OrderedDict
+
+from prefix_cache import layers_nbytes
+
+MAX_BYTES = int(os.environ.get('SESSION_CACHE_MAX_MB', 512)) * 1024 * 1024  # 所有会话 KV 的占用上限
+IDLE_TIMEOUT = int(os.environ.get('SESSION_IDLE_SECONDS', 1800))              # 会话空闲超时（秒）
+MAX_SESSIONS = 1000                                                            # 会话数上限
+
+class SessionStore:
+    """会话 ID -> {'messages', 'text', 'token_ids', 'cache', 'bytes', 'last_active'}，线程安全"""
+
+    def __init__(self, max_bytes=MAX_BYTES, idle_timeout=IDLE_TIMEOUT, max_sessions=MAX_SESSIONS):
+        self.max_bytes = max_bytes
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.stats = {'created': 0, 'turns': 0, 'expired': 0, 'evicted_sessions': 0, 'evicted_caches': 0}
+
+    def get(self, session_id):
+        """返回会话的浅拷贝，不存在或已过期时返回 None"""
+        with self._lock:
+            self._sweep()
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session['last_active'] = time.time()
+            self._sessions.move_to_end(session_id)
+            return dict(session, messages=list(session['messages']))
+
+    def save(self, session_id, messages, text, token_ids, cache=None):
+        """
+        保存一轮对话后的会话状态
+        messages: 不含系统提示词的历史消息
+        text / token_ids: 渲染后的完整对话文本及其 token，用于拼接下一轮的输入
+        cache: (token_ids, layers)，KV 覆盖的 token 与每层 KV；为 None 时只保存文字历史
+        """
+        size = layers_nbytes(cache[1]) if cache is not None else 0
+        with self._lock:
+            self._sweep()
+            old = self._sessions.pop(session_id, None)
+            if old is None:
+                self.stats['created'] += 1
+            else:
+                self.total_bytes -= old['bytes']
+            self._sessions[session_id] = {
+                'messages': list(messages), 'text': text, 'token_ids': list(token_ids),
+                'cache': cache, 'bytes': size, 'last_active': time.time(),
+            }
+            self.total_bytes += size
+            self.stats['turns'] += 1
+            self._enforce_limits(keep=session_id)
+
+    def drop(self, session_id):
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return False
+            self.total_bytes -= session['bytes']
+            return True
+
+    def _sweep(self):
+        """删除空闲超时的会话（调用方需持有锁）"""
+        deadline = time.time() - self.idle_timeout
+        for session_id in [k for k, s in self._sessions.items() if s['last_active'] < deadline]:
+            self.total_bytes -= self._sessions.pop(session_id)['bytes']
+            self.stats['expired'] += 1
+
+    def _enforce_limits(self, keep):
+        # 会话数超限：删除最久未活跃的会话
+        while len(self._sessions) > self.max_sessions:
+            session_id = next(iter(self._sessions))
+            if session_id == keep:
+                break
+            self.total_bytes -= self._sessions.pop(session_id)['bytes']
+            self.stats['evicted_sessions'] += 1
+
+        # KV 超限：按 LRU 释放 KV，保留文字历史；刚保存的会话放不下时也释放
+        for session_id, session in self._sessions.items():
+            if self.total_bytes <= self.max_bytes:
+                break
+            if session['cache'] is not None and (session_id != keep or session['bytes'] > self.max_bytes):
+                self.total_bytes -= session['bytes']
+                session['cache'] = None
+                session['bytes'] = 0
+                self.stats['evicted_caches'] += 1
+
+    def info(self):
+        with self._lock:
+            self._sweep()
+            return {
+                'sessions': len(self._sessions),
+                'cached_sessions': sum(1 for s in self._sessions.values() if s['cache'] is not None),
+                'resident_mb': round(self.total_bytes / 1024 / 1024, 2),
+                'max_mb': round(self.max_bytes / 1024 / 1024, 2),
+                'idle_timeout': self.idle_timeout,
+                **self.stats,
+            }
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+推测解码（Speculative Decoding）
+小草稿模型（默认 Qwen2.5-0.5B-Instruct，与 1.5B 共用词表）每轮连续提出若干 token，
+目标模型一次前向验证全部草稿，按推测采样规则接受或修正，输出分布与目标模型单独采样一致。
+统计接受率，最近若干轮的接受率低于阈值时暂停推测、回退到逐 token 解码，冷却后再试
+"""
+
+import os
+import time
+import threading
+from collections import deque
+
+import torch
+from transformers import AutoModelForCausalLM
+
+from generation_scheduler import cache_to_layers, layers_to_cache, sample_token
+
+ENABLED = os.environ.get('SPECULATIVE_DECODING', '0').lower() in ('1', 'true', 'yes', 'on')  # 总开关，默认关闭
+DRAFT_MODEL = os.environ.get('SPECULATIVE_DRAFT_MODEL', 'Qwen/Qwen2.5-0.5B-Instruct')         # 草稿模型
+NUM_DRAFT_TOKENS = int(os.environ.get('SPECULATIVE_NUM_TOKENS', 4))                          # 每轮草稿 token 数
+MIN_ACCEPTANCE = float(os.environ.get('SPECULATIVE_MIN_ACCEPTANCE', 0.4))                    # 回退阈值
+WINDOW_ROUNDS = 32          # 计算近期接受率的轮数
+COOLDOWN_SECONDS = 60       # 回退后多久重新尝试推测
+
+def load_draft_model(model, draft_model_name=DRAFT_MODEL):
+    """加载草稿模型，放到目标模型所在设备并使用相同精度"""
+    print(f"📥 加载推测解码草稿模型: {draft_model_name}")
+    draft_model = AutoModelForCausalLM.from_pretrained(draft_model_name, torch_dtype=model.dtype)
+    draft_model = draft_model.to(model.device).eval()
+    print("✅ 草稿模型加载成功")
+    return draft_model
+
+class SpeculativeDecoder:
+    """单序列推测解码；round 供连续批处理调度器调用，generate 用于独立的生成函数"""
+
+    def __init__(self, model, draft_model, num_draft_tokens=NUM_DRAFT_TOKENS, min_acceptance=MIN_ACCEPTANCE,
+                 window=WINDOW_ROUNDS, cooldown=COOLDOWN_SECONDS):
+        target_vocab = model.get_output_embeddings().weight.shape[0]
+        draft_vocab = draft_model.get_output_embeddings().weight.shape[0]
+        if target_vocab != draft_vocab:
+            raise ValueError(f"草稿模型词表大小 {draft_vocab} 与目标模型 {target_vocab} 不一致")
+
+        self.model = model
+        self.draft_model = draft_model
+        self.device = model.device
+        self.num_draft_tokens = num_draft_tokens
+        self.min_acceptance = min_acceptance
+        self.cooldown = cooldown
+        self.disabled_until = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.stats = {'rounds': 0, 'drafted': 0, 'accepted': 0, 'fallbacks': 0, 'plain_steps': 0}
+
+    @property
+    def active(self):
+        """当前是否使用推测解码（回退冷却期间为 False）"""
+        return time.time() >= self.disabled_until
+
+    def _forward(self, model, token_ids, layers):
+        outputs = model(
+            input_ids=torch.tensor([token_ids], device=self.device),
+            past_key_values=layers_to_cache(layers) if layers is not None else None,
+            use_cache=True,
+        )
+        return outputs.logits[0], cache_to_layers(outputs.past_key_values)
+
+    def round(self, layers, context_ids, pending, draft_state, probs_fn, max_tokens):
+        """
+        一轮推测：草稿模型连续提出 k 个 token，目标模型一次前向验证
+        layers: 目标模型覆盖 context_ids 的 KV（batch 维为 1）
+        pending: 已采样、尚未送入模型的 token
+        draft_state: 草稿模型的 (KV, 覆盖的 token 数)，首轮为 None
+        probs_fn(history_ids, logits): 按采样参数计算概率分布
+        返回 (本轮产出的 token, 目标模型覆盖 pending 与已接受草稿的 KV, 新的 draft_state)
+        """
+        sequence = list(context_ids) + [pending]
+        k = max(0, min(self.num_draft_tokens, max_tokens - 1))
+        draft_layers, draft_length = draft_state or (None, 0)
+        drafts, draft_probs = [], []
+
+        with torch.no_grad():
+            # 草稿模型先补齐落后的 token，再逐个提出草稿
+            feed = sequence[draft_length:]
+            for _ in range(k):
+                logits, draft_layers = self._forward(self.draft_model, feed, draft_layers)
+                draft_length += len(feed)
+                q = probs_fn(sequence + drafts, logits[-1])
+                token = sample_token(q)
+                drafts.append(token)
+                draft_probs.append(q)
+                feed = [token]
+
+            # 目标模型一次前向得到 pending 之后每个位置的分布
+            logits, layers = self._forward(self.model, [pending] + drafts, layers)
+
+        accepted = 0
+        next_token = None
+        for i, token in enumerate(drafts):
+            p = probs_fn(sequence + drafts[:i], logits[i])
+            q = draft_probs[i]
+            # 以 min(1, p/q) 的概率接受草稿，否则从 max(0, p - q) 归一化后的分布重新采样
+            if torch.rand(1).item() * q[token].item() < p[token].item():
+                accepted += 1
+                continue
+            residual = torch.clamp(p - q, min=0)
+            next_token = sample_token(residual / residual.sum() if residual.sum() > 0 else p)
+            break
+        if next_token is None:
+            next_token = sample_token(probs_fn(sequence + drafts, logits[len(drafts)]))
+
+        # 丢弃被拒绝草稿的 KV
+        keep = len(sequence) + accepted
+        layers = [(key[:, :, :keep], value[:, :, :keep]) for key, value in layers]
+        if draft_layers is not None and draft_length > keep:
+            draft_layers = [(key[:, :, :keep], value[:, :, :keep]) for key, value in draft_layers]
+            draft_length = keep
+
+        self._record(len(drafts), accepted)
+        return drafts[:accepted] + [next_token], layers, (draft_layers, draft_length)
+
+    def _record(self, drafted, accepted):
+        with self._lock:
+            self.stats['rounds'] += 1
+            self.stats['drafted'] += drafted
+            self.stats['accepted'] += accepted
+            if drafted:
+                self._recent.append((drafted, accepted))
+            if len(self._recent) == self._recent.maxlen:
+                rate = self._recent_rate()
+                if rate < self.min_acceptance:
+                    # 接受率过低时推测反而更慢：暂停推测，冷却后清空窗口重新评估
+                    self.disabled_until = time.time() + self.cooldown
+                    self.stats['fallbacks'] += 1
+                    self._recent.clear()
+                    print(f"⚠️ 推测解码接受率 {rate:.0%} 低于 {self.min_acceptance:.0%}，"
+                          f"回退到逐 token 解码 {self.cooldown}s")
+
+    def _recent_rate(self):
+        drafted = sum(d for d, _ in self._recent)
+        return sum(a for _, a in self._recent) / drafted if drafted else 0.0
+
+    def generate(self, input_ids, max_new_tokens, probs_fn, stop_token_ids):
+        """
+        单条序列生成，返回新生成的 token（不含停止符）
+        推测可用时按轮推测，回退期间逐 token 解码，两种方式共用同一份目标模型 KV
+        """
+        context = list(input_ids)
+        stop_token_ids = set(stop_token_ids)
+        with torch.no_grad():
+            logits, layers = self._forward(self.model, context, None)
+        generated = [sample_token(probs_fn(context, logits[-1]))]
+        draft_state = None
+
+        while generated[-1] not in stop_token_ids and len(generated) < max_new_tokens:
+            history = context + generated[:-1]
+            pending = generated[-1]
+            if self.active:
+                tokens, layers, draft_state = self.round(
+                    layers, history, pending, draft_state, probs_fn, max_new_tokens - len(generated))
+            else:
+                with torch.no_grad():
+                    logits, layers = self._forward(self.model, [pending], layers)
+                tokens = [sample_token(probs_fn(history + [pending], logits[-1]))]
+                with self._lock:
+                    self.stats['plain_steps'] += 1
+            for token in tokens:
+                generated.append(token)
+                if token in stop_token_ids or len(generated) >= max_new_tokens:
+                    break
+
+        if generated[-1] in stop_token_ids:
+            generated.pop()
+        return generated
+
+    def info(self):
+        with self._lock:
+            stats = dict(self.stats)
+            recent = self._recent_rate()
+        drafted = stats['drafted']
+        return {
+            'active': self.active,
+            'num_draft_tokens': self.num_draft_tokens,
+            'min_acceptance': self.min_acceptance,
+            'acceptance_rate': round(stats['accepted'] / drafted, 3) if drafted else None,
+            'recent_acceptance_rate': round(recent, 3),
+            'tokens_per_round': round((stats['accepted'] + stats['rounds']) / stats['rounds'], 2) if stats['rounds'] else None,
+            **stats,
+        }
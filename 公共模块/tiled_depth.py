@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分块高分辨率深度估计
+DPT 会把输入整体缩放到 384px，大图细节丢失。分块模式把原图切成互相重叠的小块，按批前向，
+每块输出先用最小二乘的尺度 + 偏移对齐到整图单次推理的结果（DPT 输出的是相对深度，各块的尺度不一致），
+再用在重叠区线性过渡的权重混合，消除接缝。长边不超过 tile_size * FAST_PATH_RATIO 的小图
+直接走单次推理（由模型自己缩放），不做分块
+"""
+
+import os
+
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+TILE_SIZE = int(os.environ.get('DEPTH_TILE_SIZE', 384))              # 分块边长（像素，DPT 的原生分辨率为 384）
+TILE_OVERLAP = int(os.environ.get('DEPTH_TILE_OVERLAP', 96))         # 相邻分块的重叠宽度
+TILE_BATCH_SIZE = int(os.environ.get('DEPTH_TILE_BATCH_SIZE', 4))    # 一次前向的分块数
+FAST_PATH_RATIO = 1.5                                                # 长边不超过 tile_size 的该倍数时直接单次推理
+ALIGN_SAMPLE_STRIDE = 4                                              # 拟合尺度/偏移时的像素采样间隔
+
+def _forward(pipe, images, size):
+    """一批图片前向，返回插值到 size=(高, 宽) 的 (批大小, 高, 宽) float32 数组"""
+    inputs = pipe.image_processor(images=images, return_tensors="pt").to(pipe.device)
+    with torch.no_grad():
+        predicted = pipe.model(**inputs).predicted_depth
+        predicted = F.interpolate(predicted.unsqueeze(1).float(), size=size, mode="bicubic", align_corners=False)
+    return predicted.squeeze(1).cpu().numpy()
+
+def estimate_single(pipe, image):
+    """整图单次推理，返回原图尺寸的 (高, 宽) float32 相对深度（与 pipeline 的 predicted_depth 一致）"""
+    return _forward(pipe, [image], image.size[::-1])[0]
+
+def _starts(length, tile, overlap):
+    """一维上的分块起点，最后一块与末端对齐"""
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile + 1, tile - overlap))
+    if starts[-1] != length - tile:
+        starts.append(length - tile)
+    return starts
+
+def _ramp(length, overlap):
+    """一维混合权重：两端 overlap 像素内线性上升，中间为 1"""
+    ramp = np.ones(length, dtype=np.float32)
+    if overlap > 0:
+        edge = (np.arange(overlap, dtype=np.float32) + 1) / (overlap + 1)
+        ramp[:overlap] = edge
+        ramp[-overlap:] = np.minimum(ramp[-overlap:], edge[::-1])
+    return ramp
+
+def _align(prediction, target):
+    """最小二乘求 scale、shift，使 prediction * scale + shift 逼近 target"""
+    x = prediction[::ALIGN_SAMPLE_STRIDE, ::ALIGN_SAMPLE_STRIDE].ravel().astype(np.float64)
+    y = target[::ALIGN_SAMPLE_STRIDE, ::ALIGN_SAMPLE_STRIDE].ravel().astype(np.float64)
+    variance = x.var()
+    if variance < 1e-12:
+        return 1.0, float(y.mean() - x.mean())
+    scale = float(((x - x.mean()) * (y - y.mean())).mean() / variance)
+    return scale, float(y.mean() - scale * x.mean())
+
+def estimate_tiled(pipe, image, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, batch_size=TILE_BATCH_SIZE):
+    """
+    分块深度估计，返回 (原图尺寸的 (高, 宽) float32 相对深度, 统计信息)
+    小图走快速路径，直接返回单次推理结果
+    """
+    width, height = image.size
+    guide = estimate_single(pipe, image)
+    if max(width, height) <= tile_size * FAST_PATH_RATIO:
+        return guide, {'mode': 'single', 'tiles': 0}
+
+    overlap = max(0, min(overlap, tile_size // 2))
+    tile_w, tile_h = min(tile_size, width), min(tile_size, height)
+    boxes = [(x, y, x + tile_w, y + tile_h)
+             for y in _starts(height, tile_h, overlap)
+             for x in _starts(width, tile_w, overlap)]
+    weight = np.outer(_ramp(tile_h, overlap), _ramp(tile_w, overlap))
+
+    depth = np.zeros((height, width), dtype=np.float32)
+    weight_sum = np.zeros((height, width), dtype=np.float32)
+    for start in range(0, len(boxes), batch_size):
+        batch = boxes[start:start + batch_size]
+        # 只裁剪当前批的分块，内存中不会同时保留所有分块
+        predictions = _forward(pipe, [image.crop(box) for box in batch], (tile_h, tile_w))
+        for (x0, y0, x1, y1), prediction in zip(batch, predictions):
+            scale, shift = _align(prediction, guide[y0:y1, x0:x1])
+            depth[y0:y1, x0:x1] += (prediction * scale + shift) * weight
+            weight_sum[y0:y1, x0:x1] += weight
+
+    depth /= weight_sum
+    return depth, {
+        'mode': 'tiled',
+        'tiles': len(boxes),
+        'tile_size': tile_size,
+        'overlap': overlap,
+        'batch_size': batch_size,
+    }
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+自顶向下的人体检测 + 姿态估计（单次预处理）
+图像只解码、缩放一次成为张量：YOLO 直接在该张量上检测人体，再用 roi_align 从同一张量中裁出所有人体框，
+整批送入 OpenPose 身体网络；每个裁剪框只含一个人，关键点直接取各热力图的峰值，无需 PAF 分组，
+也不再需要从渲染出的骨骼图中按像素颜色聚类计数。
+
+关键点统一为 OpenPose 18 点格式的 float32 数组 (人数, 18, 3)：原图像素坐标 x、y 与置信度，缺失的关键点为 -1
+"""
+
+import os
+import math
+
+import cv2
+import numpy as np
+
+NUM_KEYPOINTS = 18
+INPUT_SIZE = int(os.environ.get('TOPDOWN_INPUT_SIZE', 640))           # 检测输入的长边（对齐到 32 的倍数）
+CROP_HEIGHT = int(os.environ.get('TOPDOWN_CROP_HEIGHT', 256))         # 人体裁剪框送入 OpenPose 的尺寸（8 的倍数）
+CROP_WIDTH = int(os.environ.get('TOPDOWN_CROP_WIDTH', 192))
+PERSON_CONF = float(os.environ.get('TOPDOWN_PERSON_CONF', 0.4))       # 人体框置信度阈值
+KEYPOINT_THRESHOLD = float(os.environ.get('TOPDOWN_KEYPOINT_THRESHOLD', 0.1))
+BOX_PADDING = 0.1                                                     # 人体框四周外扩比例
+MAX_PEOPLE = int(os.environ.get('TOPDOWN_MAX_PEOPLE', 16))
+
+KEYPOINT_NAMES = ["鼻子", "颈部", "右肩", "右肘", "右腕", "左肩", "左肘", "左腕", "右髋", "右膝",
+                  "右踝", "左髋", "左膝", "左踝", "右眼", "左眼", "右耳", "左耳"]
+# COCO 17 点顺序（鼻子、左眼、右眼、左耳、右耳、左肩、右肩……）在 OpenPose 18 点中的下标
+COCO_FROM_OPENPOSE = [0, 15, 14, 17, 16, 5, 2, 6, 3, 7, 4, 11, 8, 12, 9, 13, 10]
+
+# OpenPose 身体骨架连线（关键点下标从 0 开始）与颜色（RGB）
+LIMBS = [[1, 2], [1, 5], [2, 3], [3, 4], [5, 6], [6, 7], [1, 8], [8, 9], [9, 10], [1, 11],
+         [11, 12], [12, 13], [1, 0], [0, 14], [14, 16], [0, 15], [15, 17]]
+COLORS = [[255, 0, 0], [255, 85, 0], [255, 170, 0], [255, 255, 0], [170, 255, 0], [85, 255, 0],
+          [0, 255, 0], [0, 255, 85], [0, 255, 170], [0, 255, 255], [0, 170, 255], [0, 85, 255],
+          [0, 0, 255], [85, 0, 255], [170, 0, 255], [255, 0, 255], [255, 0, 170], [255, 0, 85]]
+
+# ============================================================================
+# 关键点格式与绘制
+# ============================================================================
+
+def empty_keypoints(num_people=0):
+    return np.full((num_people, NUM_KEYPOINTS, 3), -1, dtype=np.float32)
+
+def detect_poses(pose_detector, image_rgb, detect_resolution):
+    """整图（自底向上）检测：短边缩放到 detect_resolution 后检测，返回 controlnet_aux 的 PoseResult 列表（坐标已归一化）"""
+    height, width = image_rgb.shape[:2]
+    scale = detect_resolution / min(height, width)
+    resized = cv2.resize(image_rgb, (max(1, round(width * scale)), max(1, round(height * scale))),
+                         interpolation=cv2.INTER_AREA)
+    return pose_detector.detect_poses(resized, include_hand=False, include_face=False)
+
+def poses_to_array(poses, width, height):
+    """controlnet_aux 的 PoseResult 列表 -> (人数, 18, 3) 关键点数组"""
+    keypoints = empty_keypoints(len(poses))
+    for person, pose in enumerate(poses):
+        for index, point in enumerate(pose.body.keypoints[:NUM_KEYPOINTS]):
+            if point is not None:
+                keypoints[person, index] = (point.x * width, point.y * height, min(max(point.score, 0.0), 1.0))
+    return keypoints
+
+def keypoints_to_list(keypoints, names=None, order=None):
+    """单人关键点数组 -> [{'name', 'x', 'y', 'score'}]，只保留检测到的点；order 为输出顺序（如 COCO_FROM_OPENPOSE）"""
+    order = order if order is not None else range(NUM_KEYPOINTS)
+    names = names or [KEYPOINT_NAMES[index] for index in order]
+    points = []
+    for name, index in zip(names, order):
+        x, y, score = keypoints[index]
+        if score >= 0:
+            points.append({'name': name, 'x': round(float(x), 1), 'y': round(float(y), 1),
+                           'score': round(float(score), 3)})
+    return points
+
+def render_keypoints(keypoints, width, height, canvas=None):
+    """在黑底（或给定的 RGB 画布）上绘制 OpenPose 风格骨架，返回 RGB 数组"""
+    if canvas is None:
+        canvas = np.zeros((height, width, 3), dtype=np.uint8)
+    radius = max(2, round(width / 160))
+    for person in keypoints:
+        overlay = canvas.copy()
+        for index, (a, b) in enumerate(LIMBS):
+            if person[a, 2] < 0 or person[b, 2] < 0:
+                continue
+            cv2.line(overlay, (int(person[a, 0]), int(person[a, 1])), (int(person[b, 0]), int(person[b, 1])),
+                     COLORS[index], max(1, round(radius * 1.5)), cv2.LINE_AA)
+        canvas = cv2.addWeighted(overlay, 0.6, canvas, 0.4, 0)
+        for index, (x, y, score) in enumerate(person):
+            if score >= 0:
+                cv2.circle(canvas, (int(x), int(y)), radius, COLORS[index], -1, cv2.LINE_AA)
+    return canvas
+
+# ============================================================================
+# 自顶向下检测
+# ============================================================================
+
+class TopDownPoseEstimator:
+    """
+    YOLO 人体框 + OpenPose 身体网络的融合检测
+    yolo_model: ultralytics.YOLO；body_model: controlnet_aux 的 bodypose_model（OpenposeDetector.body_estimation.model）
+    """
+
+    def __init__(self, yolo_model, body_model, device=None, input_size=INPUT_SIZE, crop_size=(CROP_HEIGHT, CROP_WIDTH),
+                 person_conf=PERSON_CONF, keypoint_threshold=KEYPOINT_THRESHOLD, max_people=MAX_PEOPLE):
+        import torch
+        self.device = torch.device(device or ('cuda' if torch.cuda.is_available() else 'cpu'))
+        self.yolo_model = yolo_model
+        self.body_model = body_model.to(self.device).eval()
+        self.input_size = input_size
+        self.crop_size = crop_size
+        self.person_conf = person_conf
+        self.keypoint_threshold = keypoint_threshold
+        self.max_people = max_people
+
+    @classmethod
+    def from_openpose(cls, yolo_model, pose_detector, **kwargs):
+        return cls(yolo_model, pose_detector.body_estimation.model, **kwargs)
+
+    def prepare(self, images):
+        """
+        RGB uint8 图像列表 -> (批张量 (B, 3, H, W) 取值 0~1, 各图缩放比例)
+        每张图按长边缩放到 input_size，右下方补灰边，批内对齐到最大尺寸（32 的倍数）
+        """
+        import torch
+        scales, resized = [], []
+        for image in images:
+            height, width = image.shape[:2]
+            scale = self.input_size / max(height, width)
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            if size != (width, height):
+                image = cv2.resize(image, size, interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+            scales.append(scale)
+            resized.append(image)
+        batch_height = math.ceil(max(image.shape[0] for image in resized) / 32) * 32
+        batch_width = math.ceil(max(image.shape[1] for image in resized) / 32) * 32
+        batch = torch.full((len(resized), 3, batch_height, batch_width), 114 / 255, device=self.device)
+        for index, image in enumerate(resized):
+            pixels = torch.from_numpy(np.ascontiguousarray(image)).to(self.device)
+            batch[index, :, :image.shape[0], :image.shape[1]] = pixels.permute(2, 0, 1).float() / 255
+        return batch, scales
+
+    def _crop_boxes(self, boxes):
+        """外扩人体框并调整为裁剪尺寸的宽高比，避免人体被拉伸"""
+        import torch
+        crop_height, crop_width = self.crop_size
+        centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        sizes = (boxes[:, 2:] - boxes[:, :2]) * (1 + 2 * BOX_PADDING)
+        half_widths = torch.maximum(sizes[:, 0], sizes[:, 1] * crop_width / crop_height) / 2
+        half_heights = half_widths * crop_height / crop_width
+        return torch.stack((centers[:, 0] - half_widths, centers[:, 1] - half_heights,
+                            centers[:, 0] + half_widths, centers[:, 1] + half_heights), dim=1)
+
+    def estimate(self, images):
+        """
+        images: RGB uint8 图像列表
+        返回每张图的 (关键点 (人数, 18, 3), 人体框 (人数, 4) 原图坐标 xyxy, 框置信度 (人数,))
+        """
+        import torch
+        import torch.nn.functional as F
+        from torchvision.ops import roi_align
+
+        if not images:
+            return []
+        batch, scales = self.prepare(images)
+        with torch.no_grad():
+            detections = self.yolo_model(batch, classes=[0], conf=self.person_conf, max_det=self.max_people,
+                                         verbose=False)
+            boxes = [result.boxes.xyxy.to(self.device).float() for result in detections]
+            box_scores = [result.boxes.conf.float().cpu().numpy() for result in detections]
+            counts = [len(image_boxes) for image_boxes in boxes]
+
+            outputs = []
+            if sum(counts) > 0:
+                crop_boxes = [self._crop_boxes(image_boxes) for image_boxes in boxes]
+                crops = roi_align(batch, crop_boxes, output_size=self.crop_size, spatial_scale=1.0,
+                                  sampling_ratio=2, aligned=True)
+                # OpenPose 输入为 BGR、像素值 / 256 - 0.5
+                _, heatmaps = self.body_model(crops.flip(1) * (255 / 256) - 0.5)
+                heatmaps = F.interpolate(heatmaps[:, :NUM_KEYPOINTS], size=self.crop_size, mode='bicubic',
+                                         align_corners=False)
+                num_crops, _, crop_height, crop_width = heatmaps.shape
+                scores, indices = heatmaps.reshape(num_crops, NUM_KEYPOINTS, -1).max(dim=-1)
+                crop_boxes = torch.cat(crop_boxes)
+                xs = (indices % crop_width).float() + 0.5
+                ys = torch.div(indices, crop_width, rounding_mode='floor').float() + 0.5
+                xs = crop_boxes[:, :1] + xs * ((crop_boxes[:, 2:3] - crop_boxes[:, :1]) / crop_width)
+                ys = crop_boxes[:, 1:2] + ys * ((crop_boxes[:, 3:4] - crop_boxes[:, 1:2]) / crop_height)
+                points = torch.stack((xs, ys, scores.clamp(0, 1)), dim=-1)
+                points[scores < self.keypoint_threshold] = -1
+                points = points.cpu().numpy()
+            else:
+                points = empty_keypoints()
+
+        start = 0
+        for image, image_boxes, image_scores, count, scale in zip(images, boxes, box_scores, counts, scales):
+            keypoints = points[start:start + count].copy()
+            start += count
+            found = keypoints[..., 2] >= 0
+            keypoints[..., :2][found] /= scale
+            outputs.append((keypoints, image_boxes.cpu().numpy() / scale, image_scores))
+        return outputs
+
+    def __call__(self, image):
+        """单张 RGB 图像，返回 (关键点, 人体框, 框置信度)"""
+        return self.estimate([image])[0]
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+标签翻译缓存
+内存 LRU + SQLite 持久化 + TTL，未命中的标签合并为一次批量翻译，
+启动时可用模型的 config.id2label 预热，稳定运行后不再访问外部翻译服务
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DB_PATH = os.environ.get(
+    'TRANSLATION_CACHE_PATH',
+    os.path.join(CURRENT_DIR, '.cache', 'label_translations.sqlite3')
+)
+
+MAX_MEMORY_ITEMS = 4096            # 内存 LRU 条目上限
+TTL_SECONDS = 30 * 24 * 3600       # 缓存有效期（标签词表基本固定，默认 30 天）
+BATCH_SIZE = 100                   # 单次批量翻译的标签数
+
+class TranslationCache:
+    """带持久化的标签翻译缓存，线程安全"""
+
+    def __init__(self, src='en', dest='zh-cn', db_path=DEFAULT_DB_PATH,
+                 max_memory_items=MAX_MEMORY_ITEMS, ttl_seconds=TTL_SECONDS, translator=None):
+        self.src = src
+        self.dest = dest
+        self.max_memory_items = max_memory_items
+        self.ttl_seconds = ttl_seconds
+        self._translator = translator
+        self._memory = OrderedDict()  # text -> (translated, created_at)
+        self._lock = threading.Lock()
+        self.stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'outbound_calls': 0, 'failures': 0}
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS translations ('
+            'src TEXT, dest TEXT, text TEXT, translated TEXT, created_at REAL, '
+            'PRIMARY KEY (src, dest, text))'
+        )
+        self._db.commit()
+
+    @property
+    def translator(self):
+        if self._translator is None:
+            from googletrans import Translator
+            self._translator = Translator()
+        return self._translator
+
+    def _fresh(self, created_at):
+        return self.ttl_seconds is None or time.time() - created_at < self.ttl_seconds
+
+    def _remember(self, text, translated, created_at):
+        self._memory[text] = (translated, created_at)
+        self._memory.move_to_end(text)
+        while len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def _lookup(self, text):
+        """只查缓存（内存 -> 磁盘），调用方需持有锁"""
+        entry = self._memory.get(text)
+        if entry is not None and self._fresh(entry[1]):
+            self._memory.move_to_end(text)
+            self.stats['memory_hits'] += 1
+            return entry[0]
+
+        row = self._db.execute(
+            'SELECT translated, created_at FROM translations WHERE src=? AND dest=? AND text=?',
+            (self.src, self.dest, text)
+        ).fetchone()
+        if row is not None and self._fresh(row[1]):
+            self._remember(text, row[0], row[1])
+            self.stats['disk_hits'] += 1
+            return row[0]
+        return None
+
+    def _fetch(self, texts):
+        """批量请求外部翻译服务，返回 {原文: 译文}，失败的标签不写入缓存"""
+        results = {}
+        for start in range(0, len(texts), BATCH_SIZE):
+            chunk = texts[start:start + BATCH_SIZE]
+            with self._lock:
+                self.stats['outbound_calls'] += 1
+            try:
+                translated = self.translator.translate(chunk, src=self.src, dest=self.dest)
+                for text, item in zip(chunk, translated):
+                    results[text] = item.text
+            except Exception as e:
+                with self._lock:
+                    self.stats['failures'] += 1
+                print(f"翻译失败: {len(chunk)} 个标签, 错误: {e}")
+        return results
+
+    def translate_many(self, texts):
+        """翻译一组标签，返回 {原文: 译文或 None}；所有未命中的标签合并为一次批量请求"""
+        unique = list(dict.fromkeys(t for t in texts if t))
+        results = {}
+        with self._lock:
+            for text in unique:
+                results[text] = self._lookup(text)
+        misses = [text for text in unique if results[text] is None]
+        if not misses:
+            return results
+
+        fetched = self._fetch(misses)
+        now = time.time()
+        with self._lock:
+            self.stats['misses'] += len(misses)
+            for text, translated in fetched.items():
+                self._remember(text, translated, now)
+                results[text] = translated
+            if fetched:
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO translations (src, dest, text, translated, created_at) '
+                    'VALUES (?, ?, ?, ?, ?)',
+                    [(self.src, self.dest, text, translated, now) for text, translated in fetched.items()]
+                )
+                self._db.commit()
+        return results
+
+    def translate(self, text):
+        """翻译单个标签，失败时返回 None"""
+        return self.translate_many([text]).get(text)
+
+    def warm_up(self, labels, background=True):
+        """用模型的标签词表（如 config.id2label.values()）预热缓存，默认在后台线程中进行"""
+        labels = list(labels)
+
+        def run():
+            start_time = time.time()
+            results = self.translate_many(labels)
+            done = sum(1 for v in results.values() if v is not None)
+            print(f"✅ 标签翻译缓存预热完成: {done}/{len(results)}，耗时 {time.time() - start_time:.1f}s")
+
+        if background:
+            threading.Thread(target=run, daemon=True).start()
+        else:
+            run()
+
+    def info(self):
+        with self._lock:
+            return {'memory_items': len(self._memory), **self.stats}
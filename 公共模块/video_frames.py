@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频帧采样
+按目标帧号顺序解码一遍视频，只保留需要的帧：不需要的帧用 grab() 跳过（不做颜色转换与拷贝），
+采样点间隔很大时才做一次 seek。需要的帧直接用 cv2 缩放并转换颜色，写入预分配的
+(帧数, 高, 宽, 3) uint8 数组；多个视频由线程池并行解码（OpenCV 解码时会释放 GIL）。
+滑动窗口模式按批产出重叠的窗口，重叠部分的帧只解码一次
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+NUM_FRAMES = 16
+TARGET_SIZE = (224, 224)                                                   # (宽, 高)
+MAX_GRAB_GAP = int(os.environ.get('VIDEO_MAX_GRAB_GAP', 300))             # 相邻采样点相隔超过该帧数时改为 seek
+DECODE_WORKERS = int(os.environ.get('VIDEO_DECODE_WORKERS', min(4, os.cpu_count() or 1)))
+
+_clip_pool = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix='video-decode')
+
+def sample_indices(total_frames, num_frames=NUM_FRAMES):
+    """均匀采样帧号；视频帧数不足时重复最后一帧"""
+    if total_frames < num_frames:
+        return np.array(list(range(total_frames)) + [total_frames - 1] * (num_frames - total_frames), dtype=int)
+    return np.linspace(0, total_frames - 1, num_frames, dtype=int)
+
+def read_frames(cap, indices, target_size=TARGET_SIZE, out=None):
+    """
+    从已打开的 VideoCapture 中按帧号读取帧（RGB），写入 out[i]（形状 (len(indices), 高, 宽, 3) 的 uint8 数组）
+    帧号可以重复、可以无序；读取失败的帧保持为黑色。返回 (out, 实际读到的帧数)
+    """
+    width, height = target_size
+    if out is None:
+        out = np.zeros((len(indices), height, width, 3), dtype=np.uint8)
+
+    # 帧号 -> 需要写入的输出位置
+    slots = {}
+    for slot, index in enumerate(indices):
+        slots.setdefault(int(index), []).append(slot)
+
+    position = int(cap.get(cv2.CAP_PROP_POS_FRAMES))
+    filled = 0
+    for index in sorted(slots):
+        if index < position or index - position > MAX_GRAB_GAP:
+            cap.set(cv2.CAP_PROP_POS_FRAMES, index)
+            position = index
+        while position < index:
+            if not cap.grab():
+                return out, filled
+            position += 1
+
+        ret, frame = cap.read()
+        if not ret:
+            return out, filled
+        position += 1
+
+        first, *rest = slots[index]
+        resized = cv2.resize(frame, target_size, interpolation=cv2.INTER_LINEAR)
+        cv2.cvtColor(resized, cv2.COLOR_BGR2RGB, dst=out[first])
+        for slot in rest:
+            out[slot] = out[first]
+        filled += len(slots[index])
+    return out, filled
+
+def video_info(source):
+    """返回 (总帧数, 帧率)"""
+    cap = cv2.VideoCapture(source)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        fps = cap.get(cv2.CAP_PROP_FPS) or 0.0
+    finally:
+        cap.release()
+    if total_frames <= 0:
+        raise ValueError("无法读取视频文件")
+    return total_frames, fps if fps > 0 else 30.0
+
+def window_indices(total_frames, num_frames=NUM_FRAMES, frame_step=4, stride=None, max_windows=None):
+    """
+    滑动窗口帧号：每个窗口取 num_frames 帧、帧间隔 frame_step，相邻窗口起点相隔 stride 帧（默认半个窗口）
+    最后一个窗口与视频末尾对齐；超过 max_windows 时自动加大 stride。返回每个窗口的帧号数组列表
+    """
+    span = (num_frames - 1) * frame_step + 1
+    if total_frames <= span:
+        return [sample_indices(total_frames, num_frames)]
+    stride = max(1, span // 2 if stride is None else stride)
+    if max_windows and (total_frames - span) // stride + 1 > max_windows:
+        stride = -(-(total_frames - span) // max(1, max_windows - 1))
+    starts = list(range(0, total_frames - span + 1, stride))
+    if starts[-1] != total_frames - span:
+        starts.append(total_frames - span)
+    offsets = np.arange(num_frames) * frame_step
+    return [start + offsets for start in starts]
+
+def iter_window_batches(source, windows, batch_size=8, target_size=TARGET_SIZE):
+    """
+    按批产出 (窗口序号列表, (批大小, 帧数, 高, 宽, 3) uint8 数组)
+    窗口需按起点升序排列；整个视频只向前解码一遍：每批解码时，之后的窗口中落在本批解码范围内的帧
+    一并读出并缓存，下一批需要的新帧都在解码位置之后，不会回退 seek；缓存只保留之后的窗口还会用到的帧
+    """
+    width, height = target_size
+    cap = cv2.VideoCapture(source)
+    cache = {}
+    try:
+        for start in range(0, len(windows), batch_size):
+            batch = windows[start:start + batch_size]
+            wanted = set(int(i) for window in batch for i in window)
+            last = max(wanted)
+            lookahead = set()
+            for window in windows[start + batch_size:]:
+                if window[0] > last:
+                    break
+                lookahead.update(int(i) for i in window if i <= last)
+            missing = sorted((wanted | lookahead) - set(cache))
+            if missing:
+                frames, _ = read_frames(cap, missing, target_size)
+                for slot, index in enumerate(missing):
+                    cache[index] = frames[slot]
+
+            out = np.empty((len(batch), len(batch[0]), height, width, 3), dtype=np.uint8)
+            for b, window in enumerate(batch):
+                for f, index in enumerate(window):
+                    out[b, f] = cache[int(index)]
+            yield list(range(start, start + len(batch))), out
+
+            cache = {index: cache[index] for index in lookahead}
+    finally:
+        cap.release()
+
+def extract_clip(source, num_frames=NUM_FRAMES, target_size=TARGET_SIZE):
+    """从视频（文件路径或 URL）中均匀采样 num_frames 帧，返回 (num_frames, 高, 宽, 3) uint8 RGB 数组"""
+    cap = cv2.VideoCapture(source)
+    try:
+        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        if total_frames <= 0:
+            raise ValueError("无法读取视频文件")
+        frames, filled = read_frames(cap, sample_indices(total_frames, num_frames), target_size)
+        if filled < num_frames:
+            print(f"警告: 期望 {num_frames} 帧，实际读取 {filled} 帧，其余以黑帧补齐")
+        return frames
+    finally:
+        cap.release()
+
+def extract_clips(sources, num_frames=NUM_FRAMES, target_size=TARGET_SIZE):
+    """并行采样多个视频，返回与 sources 等长的列表，失败的位置为异常对象"""
+    futures = [_clip_pool.submit(extract_clip, source, num_frames, target_size) for source in sources]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception as e:
+            results.append(e)
+    return results
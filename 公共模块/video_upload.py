@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+视频上传落地
+替换 Werkzeug 的上传文件流工厂：multipart 解析时上传内容直接流式写入最终位置，
+不再经过 file.read() 读入内存再写临时文件。小文件在 Linux 上写入 memfd（纯内存，无磁盘读写），
+大文件写入磁盘临时文件；OpenCV 通过路径直接打开。请求结束时 Flask 会关闭上传文件，
+此时临时文件随之删除，出错路径也不会遗留文件
+"""
+
+import os
+import atexit
+import shutil
+import tempfile
+
+from flask import Request
+
+MEMORY_LIMIT = int(os.environ.get('VIDEO_UPLOAD_MEMORY_MB', 64)) * 1024 * 1024  # 不超过该大小的上传放在 memfd 中
+SPOOL_ROOT = os.environ.get('VIDEO_UPLOAD_DIR', os.path.join(tempfile.gettempdir(), 'video_uploads'))
+
+# 根目录可能被多个服务进程共用，每个进程只使用并清理自己的子目录
+os.makedirs(SPOOL_ROOT, exist_ok=True)
+SPOOL_DIR = tempfile.mkdtemp(prefix=f'{os.getpid()}-', dir=SPOOL_ROOT)
+atexit.register(shutil.rmtree, SPOOL_DIR, ignore_errors=True)
+
+class UploadBuffer:
+    """上传文件的落地位置，可读写、可 seek；path 可直接交给 cv2.VideoCapture，close 时删除"""
+
+    def __init__(self, size_hint=None, suffix=''):
+        self.in_memory = hasattr(os, 'memfd_create') and size_hint is not None and size_hint <= MEMORY_LIMIT
+        if self.in_memory:
+            fd = os.memfd_create('upload')
+            self.path = f'/proc/self/fd/{fd}'
+        else:
+            fd, self.path = tempfile.mkstemp(suffix=suffix, dir=SPOOL_DIR)
+        self._file = os.fdopen(fd, 'w+b')
+
+    def __getattr__(self, name):
+        # read / readline / write / seek / tell / flush 等直接转发给底层文件
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def ready(self):
+        """刷新缓冲区，返回可供其他读取方打开的路径"""
+        self._file.flush()
+        return self.path
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.close()
+        if not self.in_memory:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class UploadRequest(Request):
+    """上传文件直接写入 UploadBuffer 的请求类，用法：app.request_class = UploadRequest"""
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        size_hint = content_length or total_content_length
+        suffix = os.path.splitext(filename or '')[1][:16]
+        return UploadBuffer(size_hint, suffix)
@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -13,21 +14,26 @@ from transformers import pipeline
 from PIL import Image, ImageDraw
 import io
 import base64
-from googletrans import Translator
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from translation_cache import TranslationCache
+from image_responses import image_response, install as install_image_responses
+
 print("=" * 70)
 print("🔍 关键点检测 Web 服务 - 精灵少女")
 print("=" * 70)
 
 print("\n🧚 正在召唤精灵少女...")
 detector = pipeline("object-detection", model="facebook/detr-resnet-50", device=0)
-translator = Translator()
+label_translator = TranslationCache(src='en', dest='zh-cn')
+label_translator.warm_up(detector.model.config.id2label.values())
 print("🌿 精灵少女准备完毕！开始寻找关键点~")
 
 app = Flask(__name__)
+install_image_responses(app)
 
 background_base64 = ""
 if os.path.exists(BACKGROUND_PATH):
@@ -476,6 +482,19 @@ def background():
 def index():
     return HTML_TEMPLATE
 
+def annotate_image(image, translated_results):
+    """在图片上标注关键点（使用中文标签），返回标注后的图片"""
+    draw = ImageDraw.Draw(image)
+    for item in translated_results:
+        box = item['box']
+        x1, y1, x2, y2 = box['xmin'], box['ymin'], box['xmax'], box['ymax']
+        draw.rectangle([x1, y1, x2, y2], outline='green', width=3)
+        
+        # 优先使用中文标签
+        label_text = item['label_zh'] if item['label_zh'] else item['label']
+        draw.text((x1, y1-10), f"{label_text}: {item['score']:.2f}", fill='green')
+    return image
+
 @app.route('/detect', methods=['POST'])
 def detect():
     try:
@@ -487,20 +506,15 @@ def detect():
         
         results = detector(image)
         
+        # 批量翻译标签（缓存命中时不访问外部翻译服务）
+        label_zh_map = label_translator.translate_many([item['label'] for item in results])
+        
         # 翻译标签并准备返回数据
         translated_results = []
         for item in results:
             label = item['label']
             
-            # 翻译标签
-            label_zh = None
-            try:
-                translated = translator.translate(label, src='en', dest='zh-cn')
-                label_zh = translated.text
-                print(f"翻译: {label} -> {label_zh}")
-            except Exception as e:
-                print(f"翻译失败: {label}, 错误: {e}")
-                label_zh = None
+            label_zh = label_zh_map.get(label)
             
             translated_results.append({
                 'label': label,
@@ -509,26 +523,11 @@ def detect():
                 'box': item['box']
             })
         
-        # 在图片上标注关键点（使用中文标签）
-        draw = ImageDraw.Draw(image)
-        for item in translated_results:
-            box = item['box']
-            x1, y1, x2, y2 = box['xmin'], box['ymin'], box['xmax'], box['ymax']
-            draw.rectangle([x1, y1, x2, y2], outline='green', width=3)
-            
-            # 优先使用中文标签
-            label_text = item['label_zh'] if item['label_zh'] else item['label']
-            draw.text((x1, y1-10), f"{label_text}: {item['score']:.2f}", fill='green')
-        
-        # 转换标注后的图片为base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        annotated_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        return jsonify({
-            'keypoints': translated_results,
-            'annotated_image': annotated_base64
-        })
+        # 标注图按请求的 response 模式返回（默认 base64 内联；response=json 时不绘制）
+        return image_response(
+            {'keypoints': translated_results},
+            {'annotated_image': lambda: annotate_image(image, translated_results)}
+        )
         
     except Exception as e:
         import traceback
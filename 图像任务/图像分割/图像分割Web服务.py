@@ -5,30 +5,39 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
 from flask import Flask, request, jsonify
 from transformers import pipeline
-from PIL import Image, ImageDraw
+from PIL import Image
 import io
+import time
 import base64
-import numpy as np
-from googletrans import Translator
+import torch
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from translation_cache import TranslationCache
+from batch_images import read_uploads, parse_batch_size, run_batch, BatchUploadError
+import segmentation_masks
+from image_responses import image_response, install as install_image_responses, to_base64
+
 print("=" * 70)
 print("🎭 图像分割 Web 服务 - 魔法少女")
 print("=" * 70)
 
 print("\n✨ 正在召唤魔法少女...")
 segmenter = pipeline("image-segmentation", model="nvidia/segformer-b0-finetuned-ade-512-512", device=0)
-translator = Translator()
+label_translator = TranslationCache(src='en', dest='zh-cn')
+label_translator.warm_up(segmenter.model.config.id2label.values())
 print("🌟 魔法少女准备完毕！开始施展魔法~")
 
 app = Flask(__name__)
+install_image_responses(app)
 
 background_base64 = ""
 if os.path.exists(BACKGROUND_PATH):
@@ -491,97 +500,85 @@ def background():
 def index():
     return HTML_TEMPLATE
 
+def predict_label_maps(images, batch_size=1):
+    """SegFormer 前向 + 语义后处理（与 pipeline 相同），返回每张图片原尺寸的 (高, 宽) 类别 id 数组"""
+    label_maps = []
+    for start in range(0, len(images), batch_size):
+        batch = images[start:start + batch_size]
+        inputs = segmenter.image_processor(images=batch, return_tensors="pt").to(segmenter.device)
+        with torch.no_grad():
+            outputs = segmenter.model(**inputs)
+        maps = segmenter.image_processor.post_process_semantic_segmentation(
+            outputs, target_sizes=[image.size[::-1] for image in batch])
+        label_maps.extend(label_map.to(torch.uint8 if segmenter.model.config.num_labels <= 256 else torch.int32)
+                          .cpu().numpy() for label_map in maps)
+    return label_maps
+
+def parse_mask_format(value, default):
+    value = (value or default).lower()
+    return value if value in segmentation_masks.MASK_FORMATS else None
+
+def build_segments(image, label_map, mask_format='indexed'):
+    """
+    把类别图转为返回数据（所有区域一起向量化处理），返回 (数据, 叠加图渲染函数)
+    mask_format: indexed（顶层 mask_png 为单张索引 PNG，像素值 = 区域 index）、
+                 rle（每个区域附带 COCO RLE）、png（每个区域附带黑白 PNG，兼容旧接口）、none
+    叠加了彩色区域的分割图只在调用渲染函数时才合成
+    """
+    id2label = segmenter.model.config.id2label
+    class_ids, pixel_counts, region_map = segmentation_masks.compact(label_map, segmenter.model.config.num_labels)
+    colors = segmentation_masks.region_colors(len(class_ids))
+    total_pixels = region_map.size
+    
+    labels = [id2label.get(int(class_id), f'class_{class_id}') for class_id in class_ids]
+    # 批量翻译标签（缓存命中时不访问外部翻译服务）
+    label_zh_map = label_translator.translate_many(labels)
+    
+    rle = segmentation_masks.rle_encode(region_map) if mask_format == 'rle' else None
+    
+    segments = []
+    for idx, (label, pixels, color) in enumerate(zip(labels, pixel_counts, colors)):
+        # 语义分割没有置信度，以覆盖面积比例作为 score
+        coverage_score = float(pixels) / total_pixels
+        segment = {
+            'index': idx + 1,
+            'label': label,
+            'label_zh': label_zh_map.get(label),
+            'score': coverage_score,
+            'coverage': coverage_score,
+            'color': f'rgba({color[0]}, {color[1]}, {color[2]}, {segmentation_masks.OVERLAY_ALPHA})'
+        }
+        if mask_format == 'rle':
+            segment['mask'] = rle[idx]
+        elif mask_format == 'png':
+            segment['mask'] = segmentation_masks.region_png(region_map, idx + 1)
+        segments.append(segment)
+    
+    response = {'segments': segments, 'mask_format': mask_format}
+    if mask_format == 'indexed':
+        response['mask_png'] = segmentation_masks.indexed_png(region_map)
+    
+    return response, lambda: segmentation_masks.overlay(image, region_map)
+
 @app.route('/segment', methods=['POST'])
 def segment():
     try:
         if 'image' not in request.files:
             return jsonify({'error': '没有上传图片'}), 400
         
+        mask_format = parse_mask_format(request.form.get('mask_format'), 'indexed')
+        if mask_format is None:
+            return jsonify({'error': f"mask_format 只能是 {', '.join(segmentation_masks.MASK_FORMATS)}"}), 400
+        include_overlay = request.form.get('overlay', '1').lower() not in ('0', 'false', 'no')
+        
         file = request.files['image']
         image = Image.open(io.BytesIO(file.read())).convert('RGB')
         
-        results = segmenter(image)
-        
-        # 创建彩色分割图
-        segmented_image = image.copy()
-        overlay = Image.new('RGBA', image.size, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(overlay)
-        
-        # 为每个区域生成不同的颜色
-        colors = [
-            (255, 0, 0, 100),    # 红色
-            (0, 255, 0, 100),    # 绿色
-            (0, 0, 255, 100),    # 蓝色
-            (255, 255, 0, 100),  # 黄色
-            (255, 0, 255, 100),  # 品红
-            (0, 255, 255, 100),  # 青色
-            (255, 128, 0, 100),  # 橙色
-            (128, 0, 255, 100),  # 紫色
-            (255, 192, 203, 100),# 粉色
-            (128, 255, 0, 100),  # 黄绿
-        ]
-        
-        # 将结果中的PIL Image对象转换为base64字符串
-        segments = []
-        total_pixels = image.size[0] * image.size[1]
-        
-        for idx, result in enumerate(results):
-            # 获取mask并应用颜色
-            mask_image = result['mask']
-            mask_array = np.array(mask_image)
-            
-            # 计算mask覆盖的像素数量作为score
-            mask_pixels = np.sum(mask_array > 0)
-            coverage_score = mask_pixels / total_pixels
-            
-            # 在overlay上绘制彩色区域
-            color = colors[idx % len(colors)]
-            colored_mask = Image.new('RGBA', image.size, color)
-            mask_alpha = Image.fromarray(mask_array).convert('L')
-            overlay.paste(colored_mask, (0, 0), mask_alpha)
-            
-            # 将mask转换为base64
-            buffered = io.BytesIO()
-            mask_image.save(buffered, format="PNG")
-            mask_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            # 获取原始score，如果没有则使用coverage_score
-            score = result.get('score')
-            if score is None or score == 0.0:
-                score = coverage_score
-            
-            label = result.get('label', 'unknown')
-            
-            # 翻译标签
-            label_zh = None
-            try:
-                translated = translator.translate(label, src='en', dest='zh-cn')
-                label_zh = translated.text
-                print(f"翻译: {label} -> {label_zh}, 覆盖率: {coverage_score*100:.1f}%")
-            except Exception as e:
-                print(f"翻译失败: {label}, 错误: {e}")
-                label_zh = None
-            
-            segments.append({
-                'label': label,
-                'label_zh': label_zh,
-                'score': float(score),
-                'mask': mask_base64,
-                'color': f'rgba{color}'
-            })
-        
-        # 合成最终的分割图像
-        segmented_image = Image.alpha_composite(segmented_image.convert('RGBA'), overlay)
-        
-        # 将分割后的图像转换为base64
-        buffered = io.BytesIO()
-        segmented_image.convert('RGB').save(buffered, format="PNG")
-        segmented_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-        
-        return jsonify({
-            'segments': segments,
-            'segmented_image': segmented_base64
-        })
+        label_map = predict_label_maps([image])[0]
+        
+        payload, render_overlay = build_segments(image, label_map, mask_format)
+        # 分割图按请求的 response 模式返回（默认 base64 内联；response=json 或 overlay=0 时不合成）
+        return image_response(payload, {'segmented_image': render_overlay if include_overlay else None})
         
     except Exception as e:
         import traceback
@@ -589,6 +586,39 @@ def segment():
         print(f"错误详情: {error_details}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/segment/batch', methods=['POST'])
+def segment_batch():
+    """
+    批量分割：images 字段多文件或 zip/tar 压缩包，可选 batch_size
+    默认只返回各区域统计；include_images=1 时附带叠加图与索引 PNG，mask_format 可单独指定 mask 格式
+    """
+    try:
+        items = read_uploads(request.files)
+        batch_size = parse_batch_size(request.form.get('batch_size'))
+        include_images = request.form.get('include_images', '0').lower() in ('1', 'true', 'yes')
+        mask_format = parse_mask_format(request.form.get('mask_format'), 'indexed' if include_images else 'none')
+        if mask_format is None:
+            return jsonify({'error': f"mask_format 只能是 {', '.join(segmentation_masks.MASK_FORMATS)}"}), 400
+        
+        def format_result(image, label_map):
+            payload, render_overlay = build_segments(image, label_map, mask_format)
+            if include_images:
+                payload['segmented_image'] = to_base64(render_overlay())
+            return payload
+        
+        start_time = time.time()
+        results, stats = run_batch(predict_label_maps, items, format_result, batch_size=batch_size)
+        
+        return jsonify({'results': results, **stats, 'time': round(time.time() - start_time, 3)})
+        
+    except BatchUploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': str(e)}), 500
+
 if __name__ == '__main__':
     import webbrowser
     import threading
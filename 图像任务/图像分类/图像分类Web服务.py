@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -12,12 +13,16 @@ from flask import Flask, request, jsonify
 from transformers import pipeline
 from PIL import Image
 import io
+import time
 import base64
-from googletrans import Translator
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from translation_cache import TranslationCache
+from batch_images import read_uploads, parse_batch_size, run_batch, BatchUploadError
+
 print("=" * 70)
 print("🐱 图像分类 Web 服务 - 猫娘助手")
 print("=" * 70)
@@ -25,7 +30,8 @@ print("=" * 70)
 # 加载模型
 print("\n🎀 正在召唤猫娘助手...")
 classifier = pipeline("image-classification", model="google/vit-base-patch16-224", device=0)
-translator = Translator()
+label_translator = TranslationCache(src='en', dest='zh-cn')
+label_translator.warm_up(classifier.model.config.id2label.values())
 print("✨ 猫娘助手准备完毕！喵~")
 
 app = Flask(__name__)
@@ -414,6 +420,26 @@ def background():
 def index():
     return HTML_TEMPLATE
 
+def translate_results(results):
+    """为分类结果添加中文标签"""
+    # 批量翻译标签（缓存命中时不访问外部翻译服务）
+    label_zh_map = label_translator.translate_many([result['label'] for result in results])
+    
+    # 添加中文翻译
+    translated_results = []
+    for result in results:
+        label = result['label']
+        score = result['score']
+        
+        label_zh = label_zh_map.get(label)
+        
+        translated_results.append({
+            'label': label,
+            'label_zh': label_zh,
+            'score': score
+        })
+    return translated_results
+
 @app.route('/classify', methods=['POST'])
 def classify():
     try:
@@ -425,30 +451,32 @@ def classify():
         
         results = classifier(image, top_k=5)
         
-        # 添加中文翻译
-        translated_results = []
-        for result in results:
-            label = result['label']
-            score = result['score']
-            
-            # 翻译标签
-            label_zh = None
-            try:
-                translated = translator.translate(label, src='en', dest='zh-cn')
-                label_zh = translated.text
-                print(f"翻译: {label} -> {label_zh}")
-            except Exception as e:
-                print(f"翻译失败: {label}, 错误: {e}")
-                label_zh = None
-            
-            translated_results.append({
-                'label': label,
-                'label_zh': label_zh,
-                'score': score
-            })
+        return jsonify({'results': translate_results(results)})
+        
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    """批量分类：images 字段多文件或 zip/tar 压缩包，可选 batch_size，按上传顺序返回结果"""
+    try:
+        items = read_uploads(request.files)
+        batch_size = parse_batch_size(request.form.get('batch_size'))
+        
+        start_time = time.time()
+        results, stats = run_batch(
+            classifier, items,
+            lambda image, output: {'results': translate_results(output)},
+            batch_size=batch_size, top_k=5
+        )
         
-        return jsonify({'results': translated_results})
+        return jsonify({'results': results, **stats, 'time': round(time.time() - start_time, 3)})
         
+    except BatchUploadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
@@ -3,9 +3,12 @@
 """
 姿态估计 Web 服务 - 运动少女风格 🤸
 真正的人体骨骼关键点检测
+默认为融合模式（mode=topdown）：图像只预处理一次，YOLO 检出的人体框整批送入 OpenPose，直接返回每个人的关键点；
+mode=full 为整图 OpenPose 检测
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -56,7 +59,21 @@ else:
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from image_responses import image_response, install as install_image_responses
+from topdown_pose import (COCO_FROM_OPENPOSE, TopDownPoseEstimator, detect_poses, keypoints_to_list,
+                          poses_to_array, render_keypoints)
+
+POSE_MODE = os.environ.get('POSE_MODE', 'topdown')  # topdown：YOLO 人体框内批量估计关键点；full：整图 OpenPose
+FULL_DETECT_RESOLUTION = 512
+
+topdown_estimator = None
+if USE_OPENPOSE and USE_YOLO:
+    topdown_estimator = TopDownPoseEstimator.from_openpose(yolo_model, pose_detector)
+    print("✅ 融合模式已启用：YOLO 人体框 + OpenPose 批量关键点")
+
 app = Flask(__name__)
+install_image_responses(app)
 
 # 读取背景图片
 background_base64 = ""
@@ -495,7 +512,7 @@ HTML_TEMPLATE = f"""
                         <p style="font-size: 1.5em; color: #ff6f00; font-weight: bold; margin-bottom: 10px;">
                             🎯 成功检测到 <span style="font-size: 1.8em; color: #d84315;">${{data.num_people}}</span> 个人体姿态
                         </p>
-                        <p style="color: #f57c00; font-size: 1.1em;">完整识别17个核心关键点</p>
+                        <p style="color: #f57c00; font-size: 1.1em;">识别到 ${{data.keypoints ? data.keypoints.length : 0}} 类核心关键点</p>
                     </div>
                 `;
                 
@@ -603,77 +620,39 @@ def detect():
         file = request.files['image']
         image = Image.open(io.BytesIO(file.read())).convert('RGB')
         
-        # 首先使用YOLO检测人数
-        num_people = 0
-        if USE_YOLO and yolo_model:
-            try:
-                # YOLO检测
-                results = yolo_model(image, verbose=False)
-                
-                # 统计检测到的人（class 0 是person）
-                for result in results:
-                    boxes = result.boxes
-                    for box in boxes:
-                        if int(box.cls[0]) == 0:  # class 0 = person
-                            num_people += 1
-                
-                print(f"🎯 YOLO检测到 {num_people} 个人")
-            except Exception as e:
-                print(f"⚠️ YOLO检测失败: {e}")
-                num_people = 0
-        
         if USE_OPENPOSE and pose_detector:
-            # 使用OpenPose检测
-            pose_image = pose_detector(image, detect_resolution=512, image_resolution=512)
-            
-            # 将骨骼图像转换为base64
-            buffered = io.BytesIO()
-            pose_image.save(buffered, format="PNG")
-            skeleton_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            # 如果YOLO没有检测到人，使用备用方法
-            if num_people == 0:
-                print("⚠️ YOLO未检测到人，使用图像分析方法")
-                # 改进的人数检测：分析骨骼图像中红色关键点的聚类
-                pose_array = np.array(pose_image.convert('RGB'))
-                
-                # 检测红色关键点（OpenPose使用红色标记关键点）
-                red_channel = pose_array[:, :, 0]
-                green_channel = pose_array[:, :, 1]
-                blue_channel = pose_array[:, :, 2]
-                
-                # 找出红色占主导的像素（关键点）- 降低阈值以检测更多点
-                red_mask = (red_channel > 100) & (red_channel > green_channel + 30) & (red_channel > blue_channel + 30)
-                
-                # 获取所有红色点的坐标
-                red_points = np.argwhere(red_mask)
-                
-                if len(red_points) > 50:  # 至少需要一定数量的点才能聚类
-                    # 使用DBSCAN聚类算法将关键点分组为不同的人
-                    from sklearn.cluster import DBSCAN
-                    
-                    clustering = DBSCAN(eps=150, min_samples=10).fit(red_points)
-                    labels = clustering.labels_
-                    
-                    # 统计聚类数量（排除噪声点，label=-1）
-                    unique_labels = set(labels)
-                    num_people = len(unique_labels) - (1 if -1 in unique_labels else 0)
-                    
-                    print(f"✅ 聚类检测到 {num_people} 个人体")
-                
-                # 如果还是0，至少设为1
-                if num_people == 0:
-                    num_people = 1
-                    print(f"⚠️ 默认设置为 {num_people} 个人")
+            image_rgb = np.array(image)
+            mode = request.values.get('mode', POSE_MODE)
+            boxes, box_scores = None, None
+            if mode == 'topdown' and topdown_estimator is not None:
+                # 融合模式：一次预处理，YOLO 人体框内整批估计关键点
+                keypoints, boxes, box_scores = topdown_estimator(image_rgb)
+            else:
+                # 整图模式：OpenPose 自底向上检测，人数即检出的骨架数
+                mode = 'full'
+                poses = detect_poses(pose_detector, image_rgb, FULL_DETECT_RESOLUTION)
+                keypoints = poses_to_array(poses, image.width, image.height)
+            num_people = len(keypoints)
+            print(f"✅ 检测到 {num_people} 个人体（{mode}）")
             
-            print(f"✅ 最终检测结果: {num_people} 个人体")
+            # 每个人的关键点按 COCO 17 点顺序返回像素坐标与置信度
+            people = []
+            for index, person in enumerate(keypoints):
+                entry = {'keypoints': keypoints_to_list(person, KEYPOINT_NAMES, COCO_FROM_OPENPOSE)}
+                if boxes is not None:
+                    entry['box'] = [round(float(value), 1) for value in boxes[index]]
+                    entry['score'] = round(float(box_scores[index]), 3)
+                people.append(entry)
+            detected = {point['name'] for person in people for point in person['keypoints']}
             
             result = {
+                'mode': mode,
                 'num_people': num_people,
-                'keypoints': [{'name': name, 'detected': True} for name in KEYPOINT_NAMES],
-                'skeleton_image': skeleton_base64,
+                'people': people,
+                'keypoints': [{'name': name, 'detected': True} for name in KEYPOINT_NAMES if name in detected],
                 'detection_quality': 'high' if num_people > 0 else 'low'
             }
+            skeleton_image = lambda: Image.fromarray(render_keypoints(keypoints, image.width, image.height))
         else:
             # 简化版本：绘制示例骨架
             draw_image = image.copy()
@@ -708,19 +687,15 @@ def detect():
                 draw.ellipse([pos[0]-5, pos[1]-5, pos[0]+5, pos[1]+5], 
                            fill='#ff0000', outline='#ffffff')
             
-            # 转换为base64
-            buffered = io.BytesIO()
-            draw_image.save(buffered, format="PNG")
-            skeleton_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
             result = {
                 'num_people': 1,
                 'keypoints': [{'name': name, 'detected': True} for name in KEYPOINT_NAMES],
-                'skeleton_image': skeleton_base64,
                 'detection_quality': 'demo'
             }
+            skeleton_image = draw_image
         
-        return jsonify(result)
+        # 骨骼图按请求的 response 模式返回（默认 base64 内联）
+        return image_response(result, {'skeleton_image': skeleton_image})
         
     except Exception as e:
         import traceback
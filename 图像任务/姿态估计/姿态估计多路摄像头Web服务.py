@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+姿态估计多路摄像头Web服务 📹📹
+一个进程服务多路视频源（摄像头编号、RTSP 地址、视频文件）：各路独立采集，
+每个节拍把所有路的新帧合成一批，只调用一次 YOLO + OpenPose（融合模式），结果分发到各路自己的 socket.io 房间；
+按延迟预算决定新视频源能否加入，运行中持续超出预算时丢弃最后加入的一路
+
+用法:
+    python 姿态估计多路摄像头Web服务.py [视频源 ...]      例如: 0 1 rtsp://192.168.1.10/stream demo.mp4
+    也可以用环境变量 POSE_STREAM_SOURCES（逗号分隔），或在页面上添加
+    页面上只能添加摄像头编号，以及环境变量 MULTI_STREAM_ALLOWED_SOURCES（逗号分隔的 URL 前缀 / 目录）允许的视频源
+"""
+
+import os
+import sys
+os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
+os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
+
+from flask import Flask, jsonify, render_template_string, request
+from flask_socketio import SocketIO, emit
+import cv2
+import json
+import time
+import threading
+import torch
+
+# 保存原始的cv2.imshow
+_original_imshow = cv2.imshow
+
+# 使用YOLO进行人体检测
+try:
+    from ultralytics import YOLO
+    yolo_model = YOLO('yolov8n.pt')
+    cv2.imshow = _original_imshow
+
+    if torch.cuda.is_available():
+        yolo_model.to('cuda')
+        print("✅ YOLO模型加载成功 (GPU加速)")
+    else:
+        print("✅ YOLO模型加载成功 (CPU模式)")
+    USE_YOLO = True
+except Exception as e:
+    USE_YOLO = False
+    yolo_model = None
+    print(f"⚠️ YOLO加载失败: {e}")
+
+# 使用OpenPose进行姿态估计
+try:
+    from controlnet_aux import OpenposeDetector
+    pose_detector = OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
+    USE_OPENPOSE = True
+    print("✅ OpenPose模型加载成功")
+except Exception as e:
+    USE_OPENPOSE = False
+    pose_detector = None
+    print(f"⚠️ OpenPose加载失败: {e}")
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from multi_stream import ALLOWED_SOURCES, AdmissionError, StreamManager, source_allowed
+from pose_stream import FrameBroadcaster, PoseResult
+from topdown_pose import COLORS, LIMBS, TopDownPoseEstimator, detect_poses, poses_to_array
+
+print("=" * 70)
+print("📹 姿态估计多路摄像头Web服务")
+print("=" * 70)
+
+app = Flask(__name__)
+app.config['SECRET_KEY'] = 'pose-detection-secret'
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+
+# 性能参数
+DETECT_RESOLUTION = 128  # 整图模式（无 YOLO 时）的 OpenPose 检测分辨率
+JPEG_QUALITY = 60
+CAMERA_WIDTH = 640
+CAMERA_HEIGHT = 480
+TOPDOWN_INPUT_SIZE = 320  # 融合模式的检测输入长边
+TOPDOWN_CROP_SIZE = (192, 144)  # 融合模式的人体裁剪尺寸（高, 宽）
+LATENCY_BUDGET_MS = float(os.environ.get('MULTI_STREAM_LATENCY_BUDGET_MS', 250))  # 每个节拍（整批检测）的延迟预算
+STREAM_IMAGE_FORMAT = os.environ.get('POSE_STREAM_IMAGE_FORMAT', 'jpeg')
+
+topdown_estimator = None
+if USE_YOLO and USE_OPENPOSE:
+    topdown_estimator = TopDownPoseEstimator.from_openpose(yolo_model, pose_detector, input_size=TOPDOWN_INPUT_SIZE,
+                                                           crop_size=TOPDOWN_CROP_SIZE)
+    print("✅ 融合模式：所有路的帧合成一批，YOLO 人体框 + OpenPose 批量关键点")
+
+# 每路视频一个发送器（房间 '<stream_id>:<传输模式>'）
+broadcasters = {}
+broadcasters_lock = threading.Lock()
+
+def estimate_batch(frames):
+    """所有路的新帧一次批量检测，返回与 frames 一一对应的 PoseResult"""
+    start_time = time.time()
+    frames_rgb = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+
+    if topdown_estimator is not None:
+        outputs = topdown_estimator.estimate(frames_rgb)
+        latency = (time.time() - start_time) * 1000
+        return [PoseResult(frame, keypoints, len(boxes), latency)
+                for frame, (keypoints, boxes, _) in zip(frames, outputs)]
+
+    # 缺少 YOLO 时逐帧整图检测（无法批量）
+    keypoints_list = []
+    for frame, frame_rgb in zip(frames, frames_rgb):
+        keypoints = None
+        if USE_OPENPOSE and pose_detector:
+            poses = detect_poses(pose_detector, frame_rgb, DETECT_RESOLUTION)
+            keypoints = poses_to_array(poses, frame.shape[1], frame.shape[0])
+        keypoints_list.append(keypoints)
+    latency = (time.time() - start_time) * 1000
+    return [PoseResult(frame, keypoints, len(keypoints) if keypoints is not None else 0, latency)
+            for frame, keypoints in zip(frames, keypoints_list)]
+
+def publish_frame(stream_id, frame, result, info):
+    with broadcasters_lock:
+        broadcaster = broadcasters.get(stream_id)
+    # 没有观看者的路不编码
+    if broadcaster is not None and broadcaster.has_viewers():
+        broadcaster.publish(frame, result, info)
+
+def on_stream_change(event, stream_id, reason):
+    with broadcasters_lock:
+        if event == 'added':
+            broadcasters[stream_id] = FrameBroadcaster(socketio, JPEG_QUALITY, STREAM_IMAGE_FORMAT, channel=stream_id)
+        else:
+            broadcasters.pop(stream_id, None)
+    socketio.emit('streams', {'event': event, 'stream': stream_id, 'reason': reason,
+                              'streams': [stream['id'] for stream in manager.info()['streams']]})
+
+manager = StreamManager(estimate_batch, publish_frame, latency_budget_ms=LATENCY_BUDGET_MS,
+                        on_change=on_stream_change, width=CAMERA_WIDTH, height=CAMERA_HEIGHT)
+
+HTML_TEMPLATE = f"""
+<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>📹 多路实时姿态检测</title>
+    <script src="https://cdn.socket.io/4.5.4/socket.io.min.js"></script>
+    <style>
+        * {{
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }}
+
+        body {{
+            font-family: 'Microsoft YaHei', 'Arial', sans-serif;
+            background: linear-gradient(135deg, #ff8c00 0%, #ff4500 100%);
+            min-height: 100vh;
+            padding: 20px;
+        }}
+
+        .container {{
+            max-width: 1800px;
+            margin: 0 auto;
+            background: rgba(255, 255, 255, 0.15);
+            border-radius: 30px;
+            box-shadow: 0 20px 60px rgba(255, 140, 0, 0.5);
+            padding: 30px;
+            border: 3px solid rgba(255, 255, 255, 0.6);
+        }}
+
+        h1 {{
+            text-align: center;
+            color: #fff;
+            margin-bottom: 10px;
+            font-size: 2.5em;
+        }}
+
+        .controls {{
+            text-align: center;
+            margin: 20px 0;
+        }}
+
+        .controls input {{
+            padding: 12px 20px;
+            font-size: 1.1em;
+            border-radius: 15px;
+            border: none;
+            width: 420px;
+            max-width: 60%;
+        }}
+
+        button {{
+            padding: 12px 30px;
+            font-size: 1.1em;
+            font-weight: bold;
+            border: none;
+            border-radius: 15px;
+            cursor: pointer;
+            background: linear-gradient(135deg, #4caf50 0%, #388e3c 100%);
+            color: white;
+            margin-left: 10px;
+        }}
+
+        .status {{
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 15px;
+            padding: 12px;
+            text-align: center;
+            color: #666;
+            margin-bottom: 20px;
+        }}
+
+        .grid {{
+            display: grid;
+            grid-template-columns: repeat(auto-fill, minmax(420px, 1fr));
+            gap: 20px;
+        }}
+
+        .tile {{
+            background: rgba(255, 255, 255, 0.95);
+            border-radius: 20px;
+            padding: 12px;
+            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.2);
+        }}
+
+        .tile-header {{
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            color: #ff8c00;
+            font-weight: bold;
+            margin-bottom: 8px;
+        }}
+
+        .tile-header button {{
+            padding: 4px 14px;
+            font-size: 0.9em;
+            background: linear-gradient(135deg, #dc3545 0%, #c82333 100%);
+        }}
+
+        .frame {{
+            position: relative;
+            background: #000;
+            border-radius: 12px;
+            overflow: hidden;
+            min-height: 240px;
+        }}
+
+        .frame img, .frame canvas {{
+            width: 100%;
+            height: auto;
+            display: block;
+        }}
+
+        .frame canvas {{
+            position: absolute;
+            top: 0;
+            left: 0;
+        }}
+
+        .tile-stats {{
+            color: #666;
+            font-size: 0.9em;
+            margin-top: 6px;
+        }}
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>📹 多路实时姿态检测</h1>
+
+        <div class="controls">
+            <input id="sourceInput" placeholder="摄像头编号 / RTSP 地址 / 视频文件路径">
+            <button onclick="addStream()">➕ 添加视频源</button>
+        </div>
+
+        <div id="status" class="status">
+            ⚡ 所有路的帧合并为一批检测，延迟预算 {LATENCY_BUDGET_MS:.0f}ms/节拍
+        </div>
+
+        <div class="grid" id="grid"></div>
+    </div>
+
+    <script>
+        const LIMBS = {json.dumps(LIMBS)};
+        const COLORS = {json.dumps(COLORS)};
+        const socket = io();
+        const tiles = {{}};
+
+        function setStatus(message) {{
+            document.getElementById('status').textContent = message;
+        }}
+
+        function createTile(streamId, source) {{
+            if (tiles[streamId]) return;
+            const tile = document.createElement('div');
+            tile.className = 'tile';
+            tile.innerHTML = `
+                <div class="tile-header">
+                    <span>📷 ${{streamId}} <small style="color: #999;">${{source || ''}}</small></span>
+                    <button onclick="removeStream('${{streamId}}')">⏹️ 移除</button>
+                </div>
+                <div class="frame"><img><canvas></canvas></div>
+                <div class="tile-stats">等待画面...</div>
+            `;
+            document.getElementById('grid').appendChild(tile);
+            tiles[streamId] = {{
+                element: tile,
+                img: tile.querySelector('img'),
+                canvas: tile.querySelector('canvas'),
+                stats: tile.querySelector('.tile-stats'),
+                frames: 0,
+                lastTime: Date.now(),
+                fps: 0
+            }};
+            socket.emit('watch', {{stream: streamId, transport: 'binary'}});
+        }}
+
+        function deleteTile(streamId) {{
+            const tile = tiles[streamId];
+            if (!tile) return;
+            tile.element.remove();
+            delete tiles[streamId];
+        }}
+
+        // 在透明画布上叠加骨架：每人 18 个 (x, y, 千分制置信度)，缺失为 -1
+        function drawSkeleton(canvas, keypoints, width, height) {{
+            canvas.width = width;
+            canvas.height = height;
+            const ctx = canvas.getContext('2d');
+            ctx.clearRect(0, 0, width, height);
+            const stride = 18 * 3;
+            const radius = Math.max(2, Math.round(width / 160));
+            ctx.lineWidth = radius * 1.5;
+            for (let base = 0; base < keypoints.length; base += stride) {{
+                LIMBS.forEach(function(limb, i) {{
+                    const a = base + limb[0] * 3, b = base + limb[1] * 3;
+                    if (keypoints[a] < 0 || keypoints[b] < 0) return;
+                    ctx.strokeStyle = 'rgba(' + COLORS[i].join(',') + ',0.8)';
+                    ctx.beginPath();
+                    ctx.moveTo(keypoints[a], keypoints[a + 1]);
+                    ctx.lineTo(keypoints[b], keypoints[b + 1]);
+                    ctx.stroke();
+                }});
+                for (let k = 0; k < 18; k++) {{
+                    const i = base + k * 3;
+                    if (keypoints[i] < 0) continue;
+                    ctx.fillStyle = 'rgb(' + COLORS[k].join(',') + ')';
+                    ctx.beginPath();
+                    ctx.arc(keypoints[i], keypoints[i + 1], radius, 0, 2 * Math.PI);
+                    ctx.fill();
+                }}
+            }}
+        }}
+
+        socket.on('connect', function() {{
+            fetch('/api/streams').then(r => r.json()).then(function(data) {{
+                data.streams.forEach(stream => createTile(stream.id, stream.source));
+            }});
+        }});
+
+        socket.on('frame_bin', function(data) {{
+            const tile = tiles[data.stream];
+            if (!tile) return;
+            const url = URL.createObjectURL(new Blob([data.image], {{type: data.mimetype}}));
+            tile.img.onload = function() {{ URL.revokeObjectURL(url); }};
+            tile.img.src = url;
+            if (data.keypoints) {{
+                drawSkeleton(tile.canvas, new Int16Array(data.keypoints), data.width, data.height);
+            }}
+
+            tile.frames++;
+            const now = Date.now();
+            if (now - tile.lastTime >= 1000) {{
+                tile.fps = tile.frames;
+                tile.frames = 0;
+                tile.lastTime = now;
+            }}
+            tile.stats.textContent = `👥 ${{data.num_people || 0}} 人 | 📊 ${{tile.fps}} FPS | ⏱️ 批量检测 ${{Math.round(data.latency || 0)}}ms`;
+        }});
+
+        socket.on('streams', function(data) {{
+            if (data.event === 'added') {{
+                createTile(data.stream);
+            }} else {{
+                deleteTile(data.stream);
+                if (data.reason) setStatus(`⚠️ ${{data.stream}} 已移除：${{data.reason}}`);
+            }}
+        }});
+
+        function addStream() {{
+            const source = document.getElementById('sourceInput').value.trim();
+            if (!source) return;
+            fetch('/api/streams', {{
+                method: 'POST',
+                headers: {{'Content-Type': 'application/json'}},
+                body: JSON.stringify({{source: source}})
+            }}).then(r => r.json()).then(function(data) {{
+                if (data.error) {{
+                    setStatus('❌ ' + data.error);
+                }} else {{
+                    setStatus(`✅ 已添加 ${{data.stream}}`);
+                    createTile(data.stream, source);
+                    document.getElementById('sourceInput').value = '';
+                }}
+            }});
+        }}
+
+        function removeStream(streamId) {{
+            fetch('/api/streams/' + streamId, {{method: 'DELETE'}});
+            deleteTile(streamId);
+        }}
+    </script>
+</body>
+</html>
+"""
+
+@app.route('/')
+def index():
+    return render_template_string(HTML_TEMPLATE)
+
+@app.route('/api/streams', methods=['GET'])
+def list_streams():
+    """各路状态、节拍延迟与批大小、加入一路后的预测延迟"""
+    info = manager.info()
+    with broadcasters_lock:
+        for stream in info['streams']:
+            broadcaster = broadcasters.get(stream['id'])
+            if broadcaster is not None:
+                stream['transport'] = {
+                    **broadcaster.stats,
+                    'viewers': {transport: len(members) for transport, members in broadcaster.members.items()}
+                }
+    return jsonify(info)
+
+@app.route('/api/streams', methods=['POST'])
+def add_stream():
+    data = request.get_json(silent=True) or request.form
+    source = data.get('source') if isinstance(data, dict) else None
+    # JSON 中的摄像头编号可能是整数（0 也是合法编号），统一转成字符串
+    if source is None:
+        source = ''
+    elif isinstance(source, int) and not isinstance(source, bool):
+        source = str(source)
+    elif not isinstance(source, str):
+        return jsonify({'error': '视频源 source 必须是字符串或摄像头编号'}), 400
+    source = source.strip()
+    if not source:
+        return jsonify({'error': '缺少视频源 source'}), 400
+    # 命令行 / POSE_STREAM_SOURCES 中的视频源由运维指定，网页接口只接受白名单内的视频源
+    if not source_allowed(source):
+        return jsonify({'error': f'视频源不在允许范围内（MULTI_STREAM_ALLOWED_SOURCES）: {source}'}), 403
+    try:
+        stream_id = manager.add(source)
+    except AdmissionError as e:
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'stream': stream_id, 'source': source}), 201
+
+@app.route('/api/streams/<stream_id>', methods=['DELETE'])
+def remove_stream(stream_id):
+    if not manager.remove(stream_id):
+        return jsonify({'error': f'视频源不存在: {stream_id}'}), 404
+    return jsonify({'stream': stream_id, 'removed': True})
+
+@socketio.on('watch')
+def handle_watch(data):
+    """观看某一路：加入该路对应传输模式的房间"""
+    stream_id = (data or {}).get('stream')
+    with broadcasters_lock:
+        broadcaster = broadcasters.get(stream_id)
+    if broadcaster is None:
+        emit('streams', {'event': 'removed', 'stream': stream_id, 'reason': '视频源不存在'})
+        return
+    broadcaster.join(request.sid, (data or {}).get('transport', 'binary'))
+
+@socketio.on('unwatch')
+def handle_unwatch(data):
+    with broadcasters_lock:
+        broadcaster = broadcasters.get((data or {}).get('stream'))
+    if broadcaster is not None:
+        broadcaster.leave(request.sid)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    with broadcasters_lock:
+        active = list(broadcasters.values())
+    for broadcaster in active:
+        broadcaster.leave(request.sid)
+
+if __name__ == '__main__':
+    import webbrowser
+
+    print("\n" + "=" * 70)
+    print("📹 启动多路实时姿态检测服务")
+    print("=" * 70)
+    print("\n📍 访问地址: http://localhost:6009")
+    print(f"⚡ 延迟预算: {LATENCY_BUDGET_MS:.0f}ms/节拍")
+    print(f"🔒 页面可添加的视频源: 摄像头编号{'、' + '、'.join(ALLOWED_SOURCES) if ALLOWED_SOURCES else ''}")
+
+    if torch.cuda.is_available():
+        print(f"🚀 GPU: {torch.cuda.get_device_name(0)}")
+    else:
+        print("💻 使用CPU模式")
+
+    manager.start()
+    sources = sys.argv[1:] or [s for s in os.environ.get('POSE_STREAM_SOURCES', '').split(',') if s.strip()]
+    for source in sources:
+        try:
+            manager.add(source)
+        except AdmissionError as e:
+            print(f"⚠️ 视频源 {source} 未加入: {e}")
+
+    print()
+
+    # 延迟1.5秒后自动打开浏览器
+    def open_browser():
+        time.sleep(1.5)
+        webbrowser.open('http://localhost:6009')
+
+    threading.Thread(target=open_browser, daemon=True).start()
+
+    socketio.run(app, host='0.0.0.0', port=6009, debug=False, allow_unsafe_werkzeug=True)
@@ -2,9 +2,22 @@
 # -*- coding: utf-8 -*-
 """
 姿态估计实时检测 - 支持摄像头和视频文件 🎥
+另有批量标注模式：遍历目录中的视频，切成片段分给进程池，逐批检测后把每帧关键点写入列式文件（npz / Parquet），
+可选输出渲染视频；按文件（及片段）断点续跑，适合在 CPU 节点上通宵处理长时间素材
+
+用法:
+    python 姿态估计实时检测.py                                  交互菜单
+    python 姿态估计实时检测.py --batch 视频目录 [--output 输出目录] [--workers 4] [--format npz|parquet] [--render]
 """
 
 import os
+import sys
+import json
+import shutil
+import argparse
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -13,40 +26,50 @@ import numpy as np
 from PIL import Image
 import time
 
-# 保存原始的cv2.imshow，避免被ultralytics patch
-_original_imshow = cv2.imshow
-
-# 使用YOLO进行人体检测
-try:
-    from ultralytics import YOLO
-    yolo_model = YOLO('yolov8n.pt')
-    USE_YOLO = True
-    print("✅ YOLO模型加载成功")
-    # 恢复原始的imshow函数
-    cv2.imshow = _original_imshow
-except Exception as e:
-    USE_YOLO = False
-    yolo_model = None
-    print(f"⚠️ YOLO加载失败: {e}")
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from topdown_pose import TopDownPoseEstimator, detect_poses, empty_keypoints, poses_to_array, render_keypoints
 
-# 使用OpenPose进行姿态估计
-try:
-    from controlnet_aux import OpenposeDetector
-    pose_detector = OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
-    USE_OPENPOSE = True
-    print("✅ OpenPose模型加载成功")
-except Exception as e:
-    USE_OPENPOSE = False
-    pose_detector = None
-    print(f"⚠️ OpenPose加载失败: {e}")
+USE_YOLO = False
+USE_OPENPOSE = False
+yolo_model = None
+pose_detector = None
+topdown_estimator = None
 
-print("\n" + "=" * 70)
-print("🎥 姿态估计实时检测系统")
-print("=" * 70)
-print("\n选择检测模式：")
-print("1. 摄像头实时检测")
-print("2. 视频文件检测")
-print("3. 退出")
+def load_models():
+    """加载 YOLO 与 OpenPose（批量模式下每个工作进程各自加载一次）"""
+    global USE_YOLO, USE_OPENPOSE, yolo_model, pose_detector, topdown_estimator
+    
+    # 保存原始的cv2.imshow，避免被ultralytics patch
+    _original_imshow = cv2.imshow
+    
+    # 使用YOLO进行人体检测
+    try:
+        from ultralytics import YOLO
+        yolo_model = YOLO('yolov8n.pt')
+        USE_YOLO = True
+        print("✅ YOLO模型加载成功")
+        # 恢复原始的imshow函数
+        cv2.imshow = _original_imshow
+    except Exception as e:
+        USE_YOLO = False
+        yolo_model = None
+        print(f"⚠️ YOLO加载失败: {e}")
+    
+    # 使用OpenPose进行姿态估计
+    try:
+        from controlnet_aux import OpenposeDetector
+        pose_detector = OpenposeDetector.from_pretrained("lllyasviel/ControlNet")
+        USE_OPENPOSE = True
+        print("✅ OpenPose模型加载成功")
+    except Exception as e:
+        USE_OPENPOSE = False
+        pose_detector = None
+        print(f"⚠️ OpenPose加载失败: {e}")
+    
+    # 批量模式使用融合检测：YOLO 人体框内整批估计关键点
+    if USE_YOLO and USE_OPENPOSE:
+        topdown_estimator = TopDownPoseEstimator.from_openpose(yolo_model, pose_detector)
 
 def detect_pose_in_frame(frame):
     """对单帧图像进行姿态检测"""
@@ -242,26 +265,342 @@ def video_detection():
         print(f"\n✅ 视频已保存: {output_path}")
     cv2.destroyAllWindows()
 
+# ============================================================================
+# 批量视频标注
+# ============================================================================
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.mkv', '.flv', '.wmv', '.webm', '.m4v')
+CHUNK_FRAMES = 1800  # 每个片段的帧数（0 表示整段视频一个任务）
+BATCH_SIZE = 8  # 每次送入检测器的帧数
+# Parquet 列名使用的关键点名称（OpenPose 18 点顺序）
+KEYPOINT_COLUMNS = ['nose', 'neck', 'r_shoulder', 'r_elbow', 'r_wrist', 'l_shoulder', 'l_elbow', 'l_wrist',
+                    'r_hip', 'r_knee', 'r_ankle', 'l_hip', 'l_knee', 'l_ankle', 'r_eye', 'l_eye', 'r_ear', 'l_ear']
+
+def init_worker(num_threads):
+    """工作进程初始化：限制 torch 线程数，避免多个进程争抢 CPU，然后加载模型"""
+    import torch
+    torch.set_num_threads(num_threads)
+    load_models()
+    if not USE_YOLO and not USE_OPENPOSE:
+        # 初始化失败会使进程池中止，避免每个片段都输出全零关键点
+        raise RuntimeError("YOLO和OpenPose都未加载成功")
+
+def estimate_frames(frames):
+    """一批 BGR 帧 -> 每帧的 (关键点, 人体框, 框置信度)"""
+    frames_rgb = [cv2.cvtColor(frame, cv2.COLOR_BGR2RGB) for frame in frames]
+    if topdown_estimator is not None:
+        return topdown_estimator.estimate(frames_rgb)
+    
+    # 缺少 YOLO 时逐帧整图检测，没有人体框
+    outputs = []
+    for frame_rgb in frames_rgb:
+        keypoints = empty_keypoints()
+        if USE_OPENPOSE and pose_detector:
+            poses = detect_poses(pose_detector, frame_rgb, 384)
+            keypoints = poses_to_array(poses, frame_rgb.shape[1], frame_rgb.shape[0])
+        outputs.append((keypoints, np.zeros((len(keypoints), 4), np.float32), np.zeros(len(keypoints), np.float32)))
+    return outputs
+
+def save_npz(path, **arrays):
+    """先写临时文件再改名，文件存在即表示写入完整（断点续跑依赖这一点）"""
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, **arrays)
+    os.replace(tmp_path, path)
+
+def annotate_chunk(task):
+    """
+    工作进程：标注一个视频片段 [start, end)，结果写入片段文件
+    返回 (视频路径, 片段起点, 检测帧数)
+    """
+    video_path, chunk_path, start, end, stride, batch_size, render_path = task
+    cap = cv2.VideoCapture(video_path)
+    if start > 0:
+        cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    fps = cap.get(cv2.CAP_PROP_FPS) or 25
+    width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+    height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    
+    writer = None
+    if render_path:
+        writer = cv2.VideoWriter(render_path + '.tmp.mp4', cv2.VideoWriter_fourcc(*'mp4v'), fps / stride, (width, height))
+    
+    frame_indices, num_people, keypoints, boxes, box_scores = [], [], [], [], []
+    
+    def flush(pending):
+        for (index, frame), (frame_keypoints, frame_boxes, frame_scores) in zip(
+                pending, estimate_frames([frame for _, frame in pending])):
+            frame_indices.append(index)
+            num_people.append(len(frame_keypoints))
+            keypoints.append(frame_keypoints)
+            boxes.append(frame_boxes)
+            box_scores.append(frame_scores)
+            if writer is not None:
+                canvas = render_keypoints(frame_keypoints, width, height, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+                writer.write(cv2.cvtColor(canvas, cv2.COLOR_RGB2BGR))
+    
+    pending = []
+    index = start
+    while index < end:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        if index % stride == 0:
+            pending.append((index, frame))
+            if len(pending) == batch_size:
+                flush(pending)
+                pending = []
+        index += 1
+    if pending:
+        flush(pending)
+    cap.release()
+    
+    if writer is not None:
+        writer.release()
+        os.replace(render_path + '.tmp.mp4', render_path)
+    save_npz(chunk_path,
+             frame_index=np.array(frame_indices, dtype=np.int64),
+             num_people=np.array(num_people, dtype=np.int32),
+             keypoints=np.concatenate(keypoints) if keypoints else empty_keypoints(),
+             boxes=np.concatenate(boxes).astype(np.float32) if boxes else np.zeros((0, 4), np.float32),
+             box_scores=np.concatenate(box_scores).astype(np.float32) if box_scores else np.zeros(0, np.float32))
+    return video_path, start, len(frame_indices)
+
+def write_parquet(path, data, meta):
+    """每个检测到的人一行：帧号、时间、人体框与 18 个关键点的 x / y / score 列（缺失为 NaN）"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    
+    frame_index = np.repeat(data['frame_index'], data['num_people'])
+    keypoints = data['keypoints'].copy()
+    keypoints[keypoints[..., 2] < 0] = np.nan
+    columns = {
+        'frame_index': frame_index,
+        'timestamp': (frame_index / meta['fps']).astype(np.float32),
+        'person': np.concatenate([np.arange(n) for n in data['num_people']]).astype(np.int32)
+                  if len(frame_index) else np.zeros(0, np.int32),
+    }
+    for column, values in zip(('box_x1', 'box_y1', 'box_x2', 'box_y2'), data['boxes'].T):
+        columns[column] = values
+    columns['box_score'] = data['box_scores']
+    for index, name in enumerate(KEYPOINT_COLUMNS):
+        for axis, suffix in enumerate(('x', 'y', 'score')):
+            columns[f'{name}_{suffix}'] = keypoints[:, index, axis]
+    
+    table = pa.table(columns).replace_schema_metadata({'pose_meta': json.dumps(meta, ensure_ascii=False)})
+    pq.write_table(table, path + '.tmp', compression='zstd')
+    os.replace(path + '.tmp', path)
+
+def merge_chunks(job, fmt):
+    """合并一个视频的所有片段：关键点写入最终文件，渲染视频按顺序拼接，然后删除片段目录"""
+    parts = [np.load(chunk['path']) for chunk in job['chunks']]
+    data = {
+        'frame_index': np.concatenate([part['frame_index'] for part in parts]),
+        'num_people': np.concatenate([part['num_people'] for part in parts]),
+        'keypoints': np.concatenate([part['keypoints'] for part in parts]),
+        'boxes': np.concatenate([part['boxes'] for part in parts]),
+        'box_scores': np.concatenate([part['box_scores'] for part in parts]),
+    }
+    meta = {key: job[key] for key in ('source', 'fps', 'width', 'height', 'total_frames', 'stride')}
+    meta['keypoint_names'] = KEYPOINT_COLUMNS
+    
+    # 渲染视频先完成，关键点文件最后写入：关键点文件存在即表示该视频已全部完成
+    if job['render']:
+        writer = cv2.VideoWriter(job['output'] + '.tmp.mp4', cv2.VideoWriter_fourcc(*'mp4v'),
+                                 job['fps'] / job['stride'], (job['width'], job['height']))
+        for chunk in job['chunks']:
+            cap = cv2.VideoCapture(chunk['render'])
+            while True:
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                writer.write(frame)
+            cap.release()
+        writer.release()
+        os.replace(job['output'] + '.tmp.mp4', job['output'] + '.mp4')
+    
+    if fmt == 'parquet':
+        write_parquet(job['result'], data, meta)
+    else:
+        # 列式存储：person_offsets[i]:person_offsets[i+1] 为第 i 帧的人
+        offsets = np.concatenate([[0], np.cumsum(data['num_people'])]).astype(np.int64)
+        save_npz(job['result'], **data, person_offsets=offsets,
+                 timestamp=(data['frame_index'] / job['fps']).astype(np.float32),
+                 meta=np.array(json.dumps(meta, ensure_ascii=False)))
+    shutil.rmtree(job['chunk_dir'], ignore_errors=True)
+
+def plan_jobs(input_dir, output_dir, fmt, render, stride, chunk_frames):
+    """遍历视频目录，为每个未完成的视频规划片段；已完成的视频和片段跳过
+    输出名保留视频扩展名（a.mp4 -> a.mp4.npz），同名不同格式的视频互不覆盖"""
+    jobs = []
+    for root, dirs, files in os.walk(input_dir):
+        dirs[:] = sorted(d for d in dirs if os.path.abspath(os.path.join(root, d)) != os.path.abspath(output_dir))
+        for name in sorted(files):
+            if not name.lower().endswith(VIDEO_EXTENSIONS):
+                continue
+            video_path = os.path.join(root, name)
+            output = os.path.join(output_dir, os.path.relpath(video_path, input_dir))
+            result = output + ('.parquet' if fmt == 'parquet' else '.npz')
+            if os.path.exists(result):
+                print(f"⏭️ 已完成，跳过: {video_path}")
+                continue
+            
+            cap = cv2.VideoCapture(video_path)
+            if not cap.isOpened():
+                print(f"⚠️ 无法打开，跳过: {video_path}")
+                continue
+            job = {
+                'source': video_path, 'output': output, 'result': result, 'render': render, 'stride': stride,
+                'fps': cap.get(cv2.CAP_PROP_FPS) or 25,
+                'total_frames': int(cap.get(cv2.CAP_PROP_FRAME_COUNT)),
+                'width': int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                'height': int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                'chunk_dir': output + '.chunks',
+                'chunks': [],
+            }
+            cap.release()
+            os.makedirs(job['chunk_dir'], exist_ok=True)
+            
+            size = chunk_frames if chunk_frames > 0 else max(job['total_frames'], 1)
+            # 帧数未知时整段作为一个片段
+            ends = range(size, job['total_frames'] + size, size) if job['total_frames'] > 0 else [sys.maxsize]
+            start = 0
+            for end in ends:
+                end = min(end, job['total_frames']) if job['total_frames'] > 0 else end
+                job['chunks'].append({
+                    'start': start, 'end': end,
+                    'path': os.path.join(job['chunk_dir'], f'{start:09d}.npz'),
+                    'render': os.path.join(job['chunk_dir'], f'{start:09d}.mp4') if render else None,
+                })
+                start = end
+            # 容器记录的帧数可能偏小，最后一个片段一直读到视频结束
+            job['chunks'][-1]['end'] = sys.maxsize
+            jobs.append(job)
+    return jobs
+
+def batch_annotation(input_dir, output_dir=None, workers=None, fmt='npz', render=False, stride=1,
+                     chunk_frames=CHUNK_FRAMES, batch_size=BATCH_SIZE):
+    """批量标注目录中的视频：片段分给进程池并行处理，每个视频的片段全部完成后合并输出"""
+    output_dir = output_dir or os.path.join(input_dir, 'pose_annotations')
+    workers = workers or max(1, (os.cpu_count() or 2) // 2)
+    if fmt == 'parquet' and importlib.util.find_spec('pyarrow') is None:
+        print("⚠️ pyarrow 未安装，改为输出 npz（pip install pyarrow）")
+        fmt = 'npz'
+    # 模型在工作进程中加载，主进程先确认至少一个检测器可用，再规划任务、创建片段目录
+    if importlib.util.find_spec('ultralytics') is None and importlib.util.find_spec('controlnet_aux') is None:
+        raise RuntimeError("YOLO和OpenPose都不可用，请安装 ultralytics 或 controlnet-aux")
+    
+    jobs = plan_jobs(input_dir, output_dir, fmt, render, stride, chunk_frames)
+    tasks = []
+    for job in jobs:
+        for chunk in job['chunks']:
+            chunk['done'] = os.path.exists(chunk['path']) and (not render or os.path.exists(chunk['render']))
+            if not chunk['done']:
+                tasks.append((job['source'], chunk['path'], chunk['start'], chunk['end'], stride, batch_size,
+                              chunk['render']))
+    
+    print(f"\n📂 待处理视频: {len(jobs)} 个，片段: {len(tasks)} 个，进程数: {workers}")
+    print(f"   输出目录: {output_dir}（格式: {fmt}{'，含渲染视频' if render else ''}）")
+    
+    jobs_by_source = {job['source']: job for job in jobs}
+    # 片段此前已全部完成（上次合并前中断）的视频直接合并
+    for job in jobs:
+        if all(chunk['done'] for chunk in job['chunks']):
+            merge_chunks(job, fmt)
+            print(f"✅ 已合并: {job['result']}")
+    if not tasks:
+        return
+    
+    start_time = time.time()
+    frames_done = 0
+    threads = max(1, (os.cpu_count() or workers) // workers)
+    # spawn 启动工作进程，不继承主进程 fork 时的 torch/OpenCV 线程状态
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(threads,),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(annotate_chunk, task) for task in tasks]
+        for completed, future in enumerate(as_completed(futures), 1):
+            try:
+                video_path, start, num_frames = future.result()
+            except Exception as e:
+                print(f"❌ 片段处理失败: {e}")
+                continue
+            frames_done += num_frames
+            elapsed = time.time() - start_time
+            print(f"🎞️ [{completed}/{len(tasks)}] {os.path.basename(video_path)} @ {start} | "
+                  f"{num_frames} 帧 | 累计 {frames_done / elapsed:.1f} 帧/秒")
+            
+            job = jobs_by_source[video_path]
+            for chunk in job['chunks']:
+                if chunk['start'] == start:
+                    chunk['done'] = True
+            if all(chunk['done'] for chunk in job['chunks']):
+                merge_chunks(job, fmt)
+                print(f"✅ 已完成: {job['result']}")
+    
+    print(f"\n✅ 批量标注结束，共 {frames_done} 帧，用时 {time.time() - start_time:.0f} 秒")
+
+def batch_detection():
+    """交互式批量标注"""
+    print("\n📂 请输入视频目录：")
+    input_dir = input("> ").strip().strip('"')
+    if not os.path.isdir(input_dir):
+        print(f"❌ 目录不存在: {input_dir}")
+        return
+    
+    print("\n输出格式？(npz/parquet，默认 npz)")
+    fmt = input("> ").strip().lower() or 'npz'
+    print("\n是否同时输出渲染视频？(y/n)")
+    render = input("> ").strip().lower() == 'y'
+    batch_annotation(input_dir, fmt=fmt, render=render)
+
 def main():
     """主函数"""
+    print("\n" + "=" * 70)
+    print("🎥 姿态估计实时检测系统")
+    print("=" * 70)
+    print("\n选择检测模式：")
+    print("1. 摄像头实时检测")
+    print("2. 视频文件检测")
+    print("3. 批量视频标注（目录）")
+    print("4. 退出")
+    
     while True:
-        choice = input("\n请选择 (1/2/3): ").strip()
+        choice = input("\n请选择 (1/2/3/4): ").strip()
         
         if choice == '1':
             camera_detection()
         elif choice == '2':
             video_detection()
         elif choice == '3':
+            batch_detection()
+        elif choice == '4':
             print("\n👋 再见！")
             break
         else:
-            print("❌ 无效选择，请输入 1、2 或 3")
+            print("❌ 无效选择，请输入 1、2、3 或 4")
 
 if __name__ == '__main__':
-    if not USE_YOLO and not USE_OPENPOSE:
-        print("\n❌ 错误：YOLO和OpenPose都未加载成功")
-        print("请确保已安装：")
-        print("  pip install ultralytics")
-        print("  pip install controlnet-aux")
+    parser = argparse.ArgumentParser(description="姿态估计实时检测 / 批量视频标注")
+    parser.add_argument("--batch", metavar="DIR", help="批量标注该目录（含子目录）中的视频")
+    parser.add_argument("--output", default=None, help="输出目录，默认 <视频目录>/pose_annotations")
+    parser.add_argument("--workers", type=int, default=None, help="进程数，默认 CPU 核数的一半")
+    parser.add_argument("--format", choices=['npz', 'parquet'], default='npz', help="关键点文件格式")
+    parser.add_argument("--render", action="store_true", help="同时输出叠加骨架的视频")
+    parser.add_argument("--stride", type=int, default=1, help="每隔多少帧检测一帧")
+    parser.add_argument("--chunk-frames", type=int, default=CHUNK_FRAMES, help="每个片段的帧数，0 表示不切分")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE, help="每次送入检测器的帧数")
+    args = parser.parse_args()
+    
+    if args.batch:
+        # 模型在各工作进程中加载，主进程只负责调度与合并
+        batch_annotation(args.batch, args.output, args.workers, args.format, args.render,
+                         max(1, args.stride), args.chunk_frames, max(1, args.batch_size))
     else:
-        main()
+        load_models()
+        if not USE_YOLO and not USE_OPENPOSE:
+            print("\n❌ 错误：YOLO和OpenPose都未加载成功")
+            print("请确保已安装：")
+            print("  pip install ultralytics")
+            print("  pip install controlnet-aux")
+        else:
+            main()
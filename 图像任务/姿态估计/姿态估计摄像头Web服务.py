@@ -3,19 +3,22 @@
 """
 姿态估计摄像头Web服务 - 实时检测 🎥
 支持GPU加速，左右分屏显示
+画面以二进制 JPEG / WebP 附件发送，骨骼只发送关键点数组（检测结果更新时才发送）由浏览器绘制；
+连接时不带 transport=binary 的客户端仍收到原有的 base64 画面 + 骨骼图
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
-from flask import Flask, render_template_string, Response
+from flask import Flask, render_template_string, Response, request
 from flask_socketio import SocketIO, emit
 import cv2
-import numpy as np
 from PIL import Image
 import base64
 import io
+import json
 import time
 import threading
 import torch
@@ -80,6 +83,9 @@ if os.path.exists(BACKGROUND_PATH):
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from pose_stream import FrameBroadcaster, PoseResult
+from topdown_pose import COLORS, LIMBS, TopDownPoseEstimator, detect_poses, poses_to_array
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'pose-detection-secret'
@@ -91,6 +97,18 @@ camera_lock = threading.Lock()
 is_detecting = False
 detection_thread = None
 
+DETECT_RESOLUTION = 192  # OpenPose检测分辨率
+JPEG_QUALITY = 70
+STREAM_IMAGE_FORMAT = os.environ.get('POSE_STREAM_IMAGE_FORMAT', 'jpeg')  # 二进制传输的画面编码：jpeg / webp
+POSE_MODE = os.environ.get('POSE_MODE', 'topdown')  # topdown：YOLO 人体框内批量估计关键点；full：整图 OpenPose
+
+topdown_estimator = None
+if POSE_MODE == 'topdown' and USE_YOLO and USE_OPENPOSE:
+    topdown_estimator = TopDownPoseEstimator.from_openpose(yolo_model, pose_detector)
+    print("✅ 融合模式：YOLO 人体框 + OpenPose 批量关键点")
+
+broadcaster = FrameBroadcaster(socketio, JPEG_QUALITY, STREAM_IMAGE_FORMAT)
+
 HTML_TEMPLATE = f"""
 <!DOCTYPE html>
 <html lang="zh-CN">
@@ -221,7 +239,7 @@ HTML_TEMPLATE = f"""
             font-size: 1.2em;
         }}
         
-        .video-frame img {{
+        .video-frame img, .video-frame canvas {{
             width: 100%;
             height: auto;
             border-radius: 15px;
@@ -348,7 +366,9 @@ HTML_TEMPLATE = f"""
     </div>
     
     <script>
-        const socket = io();
+        const LIMBS = {json.dumps(LIMBS)};
+        const COLORS = {json.dumps(COLORS)};
+        const socket = io({{query: {{transport: 'binary'}}}});
         let isRunning = false;
         let frameCount = 0;
         let lastTime = Date.now();
@@ -357,14 +377,65 @@ HTML_TEMPLATE = f"""
             console.log('✅ WebSocket连接成功');
         }});
         
-        socket.on('frame', function(data) {{
-            // 更新原始画面
-            document.getElementById('originalFrame').innerHTML = 
-                '<img src="data:image/jpeg;base64,' + data.original + '" alt="原始画面">';
+        function frameElement(containerId, tag) {{
+            const container = document.getElementById(containerId);
+            let element = container.querySelector(tag);
+            if (!element) {{
+                container.textContent = '';
+                element = document.createElement(tag);
+                container.appendChild(element);
+            }}
+            return element;
+        }}
+        
+        // 关键点数组：每人 18 个 (x, y, 千分制置信度)，缺失为 -1
+        function drawSkeleton(keypoints, width, height, numPeople) {{
+            const canvas = frameElement('poseFrame', 'canvas');
+            canvas.width = width;
+            canvas.height = height;
+            const ctx = canvas.getContext('2d');
+            ctx.fillStyle = '#000';
+            ctx.fillRect(0, 0, width, height);
+            const stride = 18 * 3;
+            const people = keypoints.length / stride;
+            const radius = Math.max(2, Math.round(width / 160));
+            ctx.lineWidth = radius * 1.5;
+            for (let p = 0; p < people; p++) {{
+                const base = p * stride;
+                LIMBS.forEach(function(limb, i) {{
+                    const a = base + limb[0] * 3, b = base + limb[1] * 3;
+                    if (keypoints[a] < 0 || keypoints[b] < 0) return;
+                    ctx.strokeStyle = 'rgba(' + COLORS[i].join(',') + ',0.6)';
+                    ctx.beginPath();
+                    ctx.moveTo(keypoints[a], keypoints[a + 1]);
+                    ctx.lineTo(keypoints[b], keypoints[b + 1]);
+                    ctx.stroke();
+                }});
+                for (let k = 0; k < 18; k++) {{
+                    const i = base + k * 3;
+                    if (keypoints[i] < 0) continue;
+                    ctx.fillStyle = 'rgb(' + COLORS[k].join(',') + ')';
+                    ctx.beginPath();
+                    ctx.arc(keypoints[i], keypoints[i + 1], radius, 0, 2 * Math.PI);
+                    ctx.fill();
+                }}
+            }}
+            ctx.fillStyle = '#0f0';
+            ctx.font = 'bold ' + Math.round(height / 16) + 'px Arial';
+            ctx.fillText('People: ' + numPeople, 10, 30);
+        }}
+        
+        socket.on('frame_bin', function(data) {{
+            // 更新原始画面（二进制图片直接生成 Blob 地址）
+            const img = frameElement('originalFrame', 'img');
+            const url = URL.createObjectURL(new Blob([data.image], {{type: data.mimetype}}));
+            img.onload = function() {{ URL.revokeObjectURL(url); }};
+            img.src = url;
             
-            // 更新骨骼检测画面
-            document.getElementById('poseFrame').innerHTML = 
-                '<img src="data:image/jpeg;base64,' + data.pose + '" alt="骨骼检测">';
+            // 更新骨骼检测画面：只在检测结果更新时收到关键点，其余帧保留上一次的绘制
+            if (data.keypoints) {{
+                drawSkeleton(new Int16Array(data.keypoints), data.width, data.height, data.num_people || 0);
+            }}
             
             // 更新统计信息
             document.getElementById('peopleCount').textContent = data.num_people || 0;
@@ -463,11 +534,20 @@ def index():
     return render_template_string(HTML_TEMPLATE)
 
 def detect_pose_in_frame(frame):
-    """对单帧图像进行姿态检测（优化版）"""
+    """对单帧图像进行姿态检测（优化版），返回 PoseResult（关键点数组，骨骼图按需渲染）"""
     start_time = time.time()
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    
+    # 融合模式：一次预处理，YOLO 检出的人体框整批送入 OpenPose，直接得到每个人的关键点
+    if topdown_estimator is not None:
+        try:
+            keypoints, boxes, _ = topdown_estimator(frame_rgb)
+            latency = (time.time() - start_time) * 1000
+            return PoseResult(frame, keypoints, len(boxes), latency)
+        except Exception as e:
+            print(f"融合检测失败，改用整图检测: {e}")
     
     # 转换为PIL Image
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     pil_image = Image.fromarray(frame_rgb)
     
     # YOLO检测人数（GPU加速）
@@ -484,36 +564,19 @@ def detect_pose_in_frame(frame):
         except Exception as e:
             print(f"YOLO检测失败: {e}")
     
-    # OpenPose检测骨骼（GPU加速）
-    pose_frame = frame.copy()
+    # OpenPose检测骨骼（GPU加速）：只取关键点，骨骼图由浏览器绘制（legacy 客户端才在服务端渲染）
+    keypoints = None
     if USE_OPENPOSE and pose_detector:
         try:
-            # 使用更低的分辨率以提高速度（从256降到192）
-            # hand_and_face=False 可以进一步提速
-            pose_image = pose_detector(
-                pil_image, 
-                detect_resolution=192,  # 降低分辨率提速
-                image_resolution=192,
-                hand_and_face=False,  # 不检测手和脸，提速
-                output_type='pil'
-            )
-            
-            # 转换回OpenCV格式
-            pose_array = np.array(pose_image)
-            pose_frame = cv2.cvtColor(pose_array, cv2.COLOR_RGB2BGR)
-            
-            # 调整回原始尺寸
-            pose_frame = cv2.resize(pose_frame, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_LINEAR)
+            # 使用更低的分辨率以提高速度（从256降到192），不检测手和脸
+            poses = detect_poses(pose_detector, frame_rgb, DETECT_RESOLUTION)
+            keypoints = poses_to_array(poses, frame.shape[1], frame.shape[0])
         except Exception as e:
             print(f"姿态检测失败: {e}")
     
-    # 在骨骼图上添加信息
-    cv2.putText(pose_frame, f'People: {num_people}', (10, 30), 
-               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-    
     latency = (time.time() - start_time) * 1000  # 转换为毫秒
     
-    return pose_frame, num_people, latency
+    return PoseResult(frame, keypoints, num_people, latency)
 
 def camera_loop():
     """摄像头循环（优化版）"""
@@ -542,6 +605,7 @@ def camera_loop():
     
     frame_count = 0
     skip_frames = 1  # 每N帧处理一次（1=不跳帧，2=每2帧处理一次）
+    result, result_seq = None, None
     
     while is_detecting:
         ret, frame = camera.read()
@@ -555,28 +619,11 @@ def camera_loop():
             # 跳帧处理（可选，进一步提速）
             if frame_count % skip_frames == 0:
                 # 检测姿态
-                pose_frame, num_people, latency = detect_pose_in_frame(frame)
-            else:
-                # 跳过的帧直接使用原图
-                pose_frame = frame.copy()
-                num_people = 0
-                latency = 0
-            
-            # 转换为JPEG（降低质量以减少传输时间）
-            _, original_buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            _, pose_buffer = cv2.imencode('.jpg', pose_frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
-            
-            # 转换为base64
-            original_base64 = base64.b64encode(original_buffer).decode('utf-8')
-            pose_base64 = base64.b64encode(pose_buffer).decode('utf-8')
+                result, result_seq = detect_pose_in_frame(frame), frame_count
+            # 跳过的帧沿用上一次的检测结果，关键点不会重复发送
             
-            # 发送到前端
-            socketio.emit('frame', {
-                'original': original_base64,
-                'pose': pose_base64,
-                'num_people': num_people,
-                'latency': latency
-            })
+            # 按各观看者的传输模式编码发送（降低JPEG质量以减少传输时间）
+            broadcaster.publish(frame, result, {'seq': frame_count, 'result_seq': result_seq, 'skip': skip_frames})
             
             # 控制帧率（减少sleep时间以提高响应速度）
             time.sleep(0.01)  # 约100fps（实际受检测速度限制）
@@ -595,6 +642,15 @@ def camera_loop():
     
     print("✅ 摄像头已停止")
 
+@socketio.on('connect')
+def handle_connect():
+    """页面以 transport=binary 连接；其他客户端默认 legacy（base64 画面 + 骨骼图）"""
+    broadcaster.join(request.sid, request.args.get('transport', 'legacy'))
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    broadcaster.leave(request.sid)
+
 @socketio.on('start_camera')
 def handle_start_camera():
     """启动摄像头"""
@@ -2,20 +2,23 @@
 # -*- coding: utf-8 -*-
 """
 姿态估计摄像头Web服务 - 极速版 🚀
-优化策略：降低OpenPose分辨率，跳帧处理，减少传输
+优化策略：降低OpenPose分辨率，采集 / 检测 / 编码发送流水线并行，按检测延迟自适应跳帧，减少传输
+传输：画面以二进制 JPEG / WebP 附件发送，骨骼只发送关键点数组（检测结果更新时才发送）由浏览器绘制；
+      连接时不带 transport=binary 的客户端仍收到原有的 base64 画面 + 骨骼图
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
-from flask import Flask, render_template_string
+from flask import Flask, jsonify, render_template_string, request
 from flask_socketio import SocketIO, emit
 import cv2
-import numpy as np
 from PIL import Image
 import base64
 import io
+import json
 import time
 import threading
 import torch
@@ -53,6 +56,12 @@ except Exception as e:
 
 BACKGROUND_PATH = r'D:\transformers训练\transformers-main\实战训练\图像任务\姿态估计\背景.png'
 
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from frame_pipeline import FramePipeline
+from pose_stream import FrameBroadcaster, PoseResult
+from topdown_pose import COLORS, LIMBS, TopDownPoseEstimator, detect_poses, poses_to_array
+
 print("=" * 70)
 print("🚀 姿态估计摄像头Web服务 - 极速版")
 print("=" * 70)
@@ -72,13 +81,26 @@ camera = None
 camera_lock = threading.Lock()
 is_detecting = False
 detection_thread = None
+pipeline = None
 
 # 性能优化参数
 DETECT_RESOLUTION = 128  # OpenPose检测分辨率（越小越快）
-SKIP_FRAMES = 2  # 跳帧数（2=每2帧检测一次）
+MAX_SKIP_FRAMES = 8  # 自适应跳帧上限（实际送检间隔按检测延迟 / 采集间隔自动调整）
 JPEG_QUALITY = 60  # JPEG质量（越低越快）
 CAMERA_WIDTH = 640
 CAMERA_HEIGHT = 480
+STREAM_IMAGE_FORMAT = os.environ.get('POSE_STREAM_IMAGE_FORMAT', 'jpeg')  # 二进制传输的画面编码：jpeg / webp
+POSE_MODE = os.environ.get('POSE_MODE', 'topdown')  # topdown：YOLO 人体框内批量估计关键点；full：整图 OpenPose
+TOPDOWN_INPUT_SIZE = 320  # 融合模式的检测输入长边
+TOPDOWN_CROP_SIZE = (192, 144)  # 融合模式的人体裁剪尺寸（高, 宽）
+
+topdown_estimator = None
+if POSE_MODE == 'topdown' and USE_YOLO and USE_OPENPOSE:
+    topdown_estimator = TopDownPoseEstimator.from_openpose(yolo_model, pose_detector, input_size=TOPDOWN_INPUT_SIZE,
+                                                           crop_size=TOPDOWN_CROP_SIZE)
+    print("✅ 融合模式：YOLO 人体框 + OpenPose 批量关键点")
+
+broadcaster = FrameBroadcaster(socketio, JPEG_QUALITY, STREAM_IMAGE_FORMAT)
 
 HTML_TEMPLATE = f"""
 <!DOCTYPE html>
@@ -200,7 +222,7 @@ HTML_TEMPLATE = f"""
             font-size: 1.2em;
         }}
         
-        .video-frame img {{
+        .video-frame img, .video-frame canvas {{
             width: 100%;
             height: auto;
             border-radius: 15px;
@@ -275,7 +297,7 @@ HTML_TEMPLATE = f"""
         <p class="subtitle">GPU加速 + 性能优化 = 流畅体验</p>
         
         <div class="optimization-info">
-            ⚡ 优化策略：降低分辨率({DETECT_RESOLUTION}px) + 跳帧处理(1/{SKIP_FRAMES}) + 压缩传输({JPEG_QUALITY}%)
+            ⚡ 优化策略：降低分辨率({DETECT_RESOLUTION}px) + 自适应跳帧(1/1~1/{MAX_SKIP_FRAMES}) + 二进制传输({STREAM_IMAGE_FORMAT.upper()} {JPEG_QUALITY}%) + 仅发送关键点
         </div>
         
         <div class="controls">
@@ -331,7 +353,9 @@ HTML_TEMPLATE = f"""
     </div>
     
     <script>
-        const socket = io();
+        const LIMBS = {json.dumps(LIMBS)};
+        const COLORS = {json.dumps(COLORS)};
+        const socket = io({{query: {{transport: 'binary'}}}});
         let isRunning = false;
         let frameCount = 0;
         let lastTime = Date.now();
@@ -340,16 +364,71 @@ HTML_TEMPLATE = f"""
             console.log('✅ WebSocket连接成功');
         }});
         
-        socket.on('frame', function(data) {{
-            document.getElementById('originalFrame').innerHTML = 
-                '<img src="data:image/jpeg;base64,' + data.original + '" alt="原始画面">';
+        function frameElement(containerId, tag) {{
+            const container = document.getElementById(containerId);
+            let element = container.querySelector(tag);
+            if (!element) {{
+                container.textContent = '';
+                element = document.createElement(tag);
+                container.appendChild(element);
+            }}
+            return element;
+        }}
+        
+        // 关键点数组：每人 18 个 (x, y, 千分制置信度)，缺失为 -1
+        function drawSkeleton(keypoints, width, height, numPeople) {{
+            const canvas = frameElement('poseFrame', 'canvas');
+            canvas.width = width;
+            canvas.height = height;
+            const ctx = canvas.getContext('2d');
+            ctx.fillStyle = '#000';
+            ctx.fillRect(0, 0, width, height);
+            const stride = 18 * 3;
+            const people = keypoints.length / stride;
+            const radius = Math.max(2, Math.round(width / 160));
+            ctx.lineWidth = radius * 1.5;
+            for (let p = 0; p < people; p++) {{
+                const base = p * stride;
+                LIMBS.forEach(function(limb, i) {{
+                    const a = base + limb[0] * 3, b = base + limb[1] * 3;
+                    if (keypoints[a] < 0 || keypoints[b] < 0) return;
+                    ctx.strokeStyle = 'rgba(' + COLORS[i].join(',') + ',0.6)';
+                    ctx.beginPath();
+                    ctx.moveTo(keypoints[a], keypoints[a + 1]);
+                    ctx.lineTo(keypoints[b], keypoints[b + 1]);
+                    ctx.stroke();
+                }});
+                for (let k = 0; k < 18; k++) {{
+                    const i = base + k * 3;
+                    if (keypoints[i] < 0) continue;
+                    ctx.fillStyle = 'rgb(' + COLORS[k].join(',') + ')';
+                    ctx.beginPath();
+                    ctx.arc(keypoints[i], keypoints[i + 1], radius, 0, 2 * Math.PI);
+                    ctx.fill();
+                }}
+            }}
+            ctx.fillStyle = '#0f0';
+            ctx.font = 'bold ' + Math.round(height / 16) + 'px Arial';
+            ctx.fillText('People: ' + numPeople, 10, 30);
+        }}
+        
+        socket.on('frame_bin', function(data) {{
+            const img = frameElement('originalFrame', 'img');
+            const url = URL.createObjectURL(new Blob([data.image], {{type: data.mimetype}}));
+            img.onload = function() {{ URL.revokeObjectURL(url); }};
+            img.src = url;
             
-            document.getElementById('poseFrame').innerHTML = 
-                '<img src="data:image/jpeg;base64,' + data.pose + '" alt="骨骼检测">';
+            // 骨骼只在检测结果更新时随帧下发，其余帧沿用上一次的绘制结果
+            if (data.keypoints) {{
+                drawSkeleton(new Int16Array(data.keypoints), data.width, data.height, data.num_people || 0);
+            }}
             
             document.getElementById('peopleCount').textContent = data.num_people || 0;
             document.getElementById('latency').textContent = Math.round(data.latency || 0) + 'ms';
-            document.getElementById('detectRate').textContent = '1/' + {SKIP_FRAMES};
+            document.getElementById('detectRate').textContent = '1/' + (data.skip || 1);
+            if (data.stats) {{
+                console.log('📈 流水线统计', data.stats);
+            }}
             
             frameCount++;
             const now = Date.now();
@@ -432,11 +511,20 @@ def index():
     return render_template_string(HTML_TEMPLATE)
 
 def detect_pose_in_frame(frame):
-    """对单帧图像进行姿态检测（极速优化版）"""
+    """对单帧图像进行姿态检测（极速优化版），返回 PoseResult（关键点数组，骨骼图按需渲染）"""
     start_time = time.time()
+    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    
+    # 融合模式：一次预处理，YOLO 检出的人体框整批送入 OpenPose，直接得到每个人的关键点
+    if topdown_estimator is not None:
+        try:
+            keypoints, boxes, _ = topdown_estimator(frame_rgb)
+            latency = (time.time() - start_time) * 1000
+            return PoseResult(frame, keypoints, len(boxes), latency)
+        except Exception as e:
+            print(f"融合检测失败，改用整图检测: {e}")
     
     # 转换为PIL Image
-    frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
     pil_image = Image.fromarray(frame_rgb)
     
     # YOLO检测人数（GPU加速）
@@ -452,36 +540,32 @@ def detect_pose_in_frame(frame):
         except Exception as e:
             pass
     
-    # OpenPose检测骨骼（极速模式）
-    pose_frame = frame.copy()
+    # OpenPose检测骨骼（极速模式）：只取关键点，不渲染骨骼图
+    keypoints = None
     if USE_OPENPOSE and pose_detector:
         try:
             # 极速配置：最低分辨率 + 不检测手和脸
-            pose_image = pose_detector(
-                pil_image, 
-                detect_resolution=DETECT_RESOLUTION,  # 128px 极速
-                image_resolution=DETECT_RESOLUTION,
-                hand_and_face=False,  # 不检测手和脸
-                output_type='pil'
-            )
-            
-            pose_array = np.array(pose_image)
-            pose_frame = cv2.cvtColor(pose_array, cv2.COLOR_RGB2BGR)
-            pose_frame = cv2.resize(pose_frame, (frame.shape[1], frame.shape[0]), interpolation=cv2.INTER_NEAREST)
+            poses = detect_poses(pose_detector, frame_rgb, DETECT_RESOLUTION)
+            keypoints = poses_to_array(poses, frame.shape[1], frame.shape[0])
         except Exception as e:
             print(f"姿态检测失败: {e}")
     
-    # 添加信息
-    cv2.putText(pose_frame, f'People: {num_people}', (10, 30), 
-               cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-    
     latency = (time.time() - start_time) * 1000
     
-    return pose_frame, num_people, latency
+    return PoseResult(frame, keypoints, num_people, latency)
+
+def read_camera_frame():
+    """采集线程：读取一帧，失败时返回 None"""
+    ret, frame = camera.read()
+    return frame if ret else None
+
+def publish_frame(frame, result, info):
+    """编码发送线程：原始帧与最新的检测结果按各观看者的传输模式发送"""
+    broadcaster.publish(frame, result, info)
 
 def camera_loop():
-    """摄像头循环（极速优化版）"""
-    global camera, is_detecting
+    """摄像头循环（极速优化版）：打开摄像头后交给采集 / 检测 / 编码发送三级流水线"""
+    global camera, is_detecting, pipeline
     
     with camera_lock:
         camera = cv2.VideoCapture(0)
@@ -504,62 +588,28 @@ def camera_loop():
     
     print("✅ 摄像头已启动（极速模式）")
     print(f"   - 检测分辨率: {DETECT_RESOLUTION}px")
-    print(f"   - 跳帧率: 1/{SKIP_FRAMES}")
+    print(f"   - 自适应跳帧: 1/1 ~ 1/{MAX_SKIP_FRAMES}")
     print(f"   - JPEG质量: {JPEG_QUALITY}%")
     
-    frame_count = 0
-    last_pose_frame = None
-    last_num_people = 0
-    last_latency = 0
+    pipeline = FramePipeline(read_camera_frame, detect_pose_in_frame, publish_frame,
+                             max_skip=MAX_SKIP_FRAMES, name='camera')
+    pipeline.start()
     
-    while is_detecting:
-        ret, frame = camera.read()
-        if not ret:
-            print("❌ 无法读取摄像头画面")
-            break
-        
-        frame_count += 1
-        
-        try:
-            # 跳帧处理
-            if frame_count % SKIP_FRAMES == 0:
-                pose_frame, num_people, latency = detect_pose_in_frame(frame)
-                last_pose_frame = pose_frame
-                last_num_people = num_people
-                last_latency = latency
-            else:
-                # 使用上一帧的检测结果
-                if last_pose_frame is not None:
-                    pose_frame = last_pose_frame
-                    num_people = last_num_people
-                    latency = last_latency
-                else:
-                    pose_frame = frame.copy()
-                    num_people = 0
-                    latency = 0
-            
-            # JPEG编码（低质量高速度）
-            _, original_buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-            _, pose_buffer = cv2.imencode('.jpg', pose_frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
-            
-            # Base64编码
-            original_base64 = base64.b64encode(original_buffer).decode('utf-8')
-            pose_base64 = base64.b64encode(pose_buffer).decode('utf-8')
-            
-            # 发送到前端
-            socketio.emit('frame', {
-                'original': original_base64,
-                'pose': pose_base64,
-                'num_people': num_people,
-                'latency': latency
-            })
-            
-            # 最小延迟
-            time.sleep(0.001)
-            
-        except Exception as e:
-            print(f"处理帧时出错: {e}")
-            continue
+    last_report = time.time()
+    while is_detecting and pipeline.running:
+        time.sleep(0.1)
+        if time.time() - last_report >= 10:
+            last_report = time.time()
+            stats = pipeline.info()
+            print(f"📈 采集 {stats['capture']['fps']}fps | 检测 {stats['detect']['fps']}fps "
+                  f"{stats['detect']['latency_ms']}ms | 发送 {stats['publish']['fps']}fps | "
+                  f"跳帧 1/{stats['skip']} | 端到端 {stats['end_to_end_ms']}ms")
+    
+    # 摄像头读取失败导致流水线自行结束时，复位状态以便重新启动
+    if not pipeline.running:
+        is_detecting = False
+    pipeline.stop()
+    pipeline.join()
     
     with camera_lock:
         if camera:
@@ -568,6 +618,25 @@ def camera_loop():
     
     print("✅ 摄像头已停止")
 
+@app.route('/api/stats')
+def pipeline_stats():
+    """流水线各级的 FPS / 延迟 / 丢帧统计"""
+    stats = pipeline.info() if pipeline is not None else {'running': False}
+    stats['transport'] = {
+        **broadcaster.stats,
+        'viewers': {transport: len(members) for transport, members in broadcaster.members.items()}
+    }
+    return jsonify(stats)
+
+@socketio.on('connect')
+def handle_connect():
+    # 页面以 transport=binary 连接；其他客户端默认 legacy（base64 画面 + 骨骼图）
+    broadcaster.join(request.sid, request.args.get('transport', 'legacy'))
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    broadcaster.leave(request.sid)
+
 @socketio.on('start_camera')
 def handle_start_camera():
     global is_detecting, detection_thread
@@ -5,19 +5,27 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from transformers import pipeline
 from PIL import Image
 import io
+import time
 import base64
 import numpy as np
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from batch_images import read_uploads, parse_batch_size, run_batch, BatchUploadError
+from tiled_depth import TILE_SIZE, TILE_OVERLAP, TILE_BATCH_SIZE, estimate_single, estimate_tiled
+import depth_formats
+from image_responses import image_response, install as install_image_responses
+
 print("=" * 70)
 print("📏 深度估计 Web 服务 - 科技少女")
 print("=" * 70)
@@ -27,6 +35,7 @@ depth_estimator = pipeline("depth-estimation", model="Intel/dpt-large", device=0
 print("💻 科技少女准备完毕！开始分析深度~")
 
 app = Flask(__name__)
+install_image_responses(app)
 
 background_base64 = ""
 if os.path.exists(BACKGROUND_PATH):
@@ -449,30 +458,104 @@ def background():
 def index():
     return HTML_TEMPLATE
 
+def wants_binary():
+    """binary=1 或 Accept 首选 application/octet-stream 时直接返回二进制，而不是 base64 放进 JSON"""
+    if request.form.get('binary', request.args.get('binary', '')).lower() in ('1', 'true', 'yes'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', 'application/octet-stream']) == 'application/octet-stream'
+
 @app.route('/estimate', methods=['POST'])
 def estimate():
+    """
+    深度估计
+    format: png8（默认，8 位可视化图）、png16、npy、npz（float16 原始数值）、raw（float16 字节流）、preview（缩小的预览图）
+    compress_level: PNG 压缩级别 0-9；binary=1 时以二进制响应返回，元数据放在 X-Depth-* 响应头中
+    """
     try:
         if 'image' not in request.files:
             return jsonify({'error': '没有上传图片'}), 400
         
+        fmt = request.form.get('format', 'png8').lower()
+        if fmt not in depth_formats.FORMATS:
+            return jsonify({'error': f"format 只能是 {', '.join(depth_formats.FORMATS)}"}), 400
+        try:
+            compress_level = max(0, min(int(request.form.get('compress_level', depth_formats.PNG_COMPRESS_LEVEL)), 9))
+        except ValueError:
+            return jsonify({'error': '参数格式错误'}), 400
+        
         file = request.files['image']
         image = Image.open(io.BytesIO(file.read())).convert('RGB')
         
-        result = depth_estimator(image)
-        depth_map = result['depth']
+        # mode=tiled：重叠分块的高分辨率推理（小图自动走单次推理），默认 single 为整图单次推理
+        if request.form.get('mode', 'single') == 'tiled':
+            try:
+                tile_size = max(64, min(int(request.form.get('tile_size', TILE_SIZE)), 1024))
+                overlap = max(0, int(request.form.get('overlap', TILE_OVERLAP)))
+                tile_batch_size = parse_batch_size(request.form.get('tile_batch_size'), TILE_BATCH_SIZE)
+            except ValueError:
+                return jsonify({'error': '参数格式错误'}), 400
+            
+            start_time = time.time()
+            depth, stats = estimate_tiled(depth_estimator, image, tile_size, overlap, tile_batch_size)
+        else:
+            start_time = time.time()
+            depth, stats = estimate_single(depth_estimator, image), {'mode': 'single'}
+        elapsed = round(time.time() - start_time, 3)
+        
+        if wants_binary():
+            data, mimetype, meta = depth_formats.encode(depth, fmt, compress_level)
+            headers = {
+                'X-Depth-Format': meta['format'],
+                'X-Depth-Shape': ','.join(str(n) for n in meta['shape']),
+                'X-Depth-Dtype': meta['dtype'],
+                'X-Depth-Min': repr(meta['min']),
+                'X-Depth-Max': repr(meta['max']),
+                'X-Inference-Time': str(elapsed),
+                'Content-Disposition': f"attachment; filename=depth.{depth_formats.EXTENSIONS[fmt]}",
+            }
+            return Response(data, mimetype=mimetype, headers=headers)
+        
+        # 其余情况按 response 模式返回：默认 base64 内联，也可以是 multipart / url / 仅元数据；
+        # 深度图在确定需要时才编码，response=json 时不做编码
+        meta = depth_formats.describe(depth, fmt)
+        return image_response(
+            {**meta, **stats, 'time': elapsed},
+            {'depth_map': lambda: depth_formats.encode(depth, fmt, compress_level)[:2]}
+        )
         
-        # 转换深度图为可视化图像
-        depth_array = np.array(depth_map)
-        depth_normalized = ((depth_array - depth_array.min()) / (depth_array.max() - depth_array.min()) * 255).astype(np.uint8)
-        depth_image = Image.fromarray(depth_normalized)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def encode_depth_map(depth_map):
+    """深度图归一化到 0-255，返回 base64 编码的 PNG"""
+    # 转换深度图为可视化图像
+    depth_array = np.array(depth_map)
+    depth_normalized = ((depth_array - depth_array.min()) / (depth_array.max() - depth_array.min()) * 255).astype(np.uint8)
+    depth_image = Image.fromarray(depth_normalized)
+    
+    # 转换为base64
+    buffered = io.BytesIO()
+    depth_image.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode('utf-8')
+
+@app.route('/estimate/batch', methods=['POST'])
+def estimate_batch():
+    """批量深度估计：images 字段多文件或 zip/tar 压缩包，可选 batch_size，按上传顺序返回深度图"""
+    try:
+        items = read_uploads(request.files)
+        batch_size = parse_batch_size(request.form.get('batch_size'))
         
-        # 转换为base64
-        buffered = io.BytesIO()
-        depth_image.save(buffered, format="PNG")
-        depth_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
+        start_time = time.time()
+        results, stats = run_batch(
+            depth_estimator, items,
+            lambda image, output: {'depth_map': encode_depth_map(output['depth'])},
+            batch_size=batch_size
+        )
         
-        return jsonify({'depth_map': depth_base64})
+        return jsonify({'results': results, **stats, 'time': round(time.time() - start_time, 3)})
         
+    except BatchUploadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
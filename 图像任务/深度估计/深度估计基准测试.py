@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+深度估计基准测试
+对比整图单次推理（Web 服务当前默认路径）与分块推理在不同分辨率下的延迟和推理内存。
+每个 (模式, 分辨率) 组合在独立子进程中运行；记录模型加载并预热后的当前常驻内存（RSS）作为基线，
+计时推理期间由后台线程采样 RSS 取最大值，报告推理带来的增量（不含模型加载时的峰值），
+以及使用 GPU 时的显存峰值
+
+用法:
+    python 深度估计基准测试.py [--image 图片路径] [--sizes 768 1536 3072] [--repeats 3]
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
+os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_NAME = "Intel/dpt-large"
+RSS_SAMPLE_INTERVAL = 0.005   # 推理期间 RSS 采样间隔（秒）
+
+def current_rss_mb():
+    """当前进程的常驻内存（MB）；ru_maxrss 是历史峰值，会包含模型加载时的峰值，不能用来衡量推理"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 / 1024
+    except ImportError:
+        with open('/proc/self/statm') as f:                               # 没有 psutil 时仅支持 Linux
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+class RssSampler:
+    """后台线程按固定间隔采样当前 RSS，记录 with 块内的最大值"""
+
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._loop, daemon=True)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+def load_image(path, size):
+    """读取测试图片并把长边缩放到 size；未指定图片时生成带纹理的合成图"""
+    from PIL import Image
+    import numpy as np
+    if path:
+        image = Image.open(path).convert('RGB')
+        scale = size / max(image.size)
+        return image.resize((round(image.width * scale), round(image.height * scale)), Image.BICUBIC)
+    height, width = size * 3 // 4, size
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    pixels = np.stack([
+        127 + 127 * np.sin(x / 37.0) * np.cos(y / 53.0),
+        127 + 127 * np.sin((x + y) / 71.0),
+        255 * y / height,
+    ], axis=-1)
+    return Image.fromarray(pixels.clip(0, 255).astype(np.uint8))
+
+def worker(args):
+    """子进程：加载模型，预热一次后重复推理，输出一行 JSON"""
+    import torch
+    from transformers import pipeline
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+    from tiled_depth import estimate_tiled
+
+    device = 0 if torch.cuda.is_available() else -1
+    depth_estimator = pipeline("depth-estimation", model=MODEL_NAME, device=device)
+    image = load_image(args.image, args.size)
+
+    if args.mode == 'single':
+        run = lambda: depth_estimator(image)
+    else:
+        run = lambda: estimate_tiled(depth_estimator, image, args.tile_size, args.overlap, args.tile_batch_size)
+
+    run()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    baseline = current_rss_mb()
+    latencies = []
+    with RssSampler() as sampler:
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            run()
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            latencies.append(time.perf_counter() - start)
+
+    print(json.dumps({
+        'mode': args.mode,
+        'size': f'{image.width}x{image.height}',
+        'latency_ms': round(sorted(latencies)[len(latencies) // 2] * 1000, 1),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(sampler.peak, 1),
+        'inference_rss_mb': round(sampler.peak - baseline, 1),
+        'gpu_peak_mb': round(torch.cuda.max_memory_allocated() / 1024 / 1024, 1) if torch.cuda.is_available() else None,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="深度估计基准测试：单次推理 vs 分块推理")
+    parser.add_argument("--image", default=None, help="测试图片，不指定时使用合成图")
+    parser.add_argument("--sizes", type=int, nargs='+', default=[768, 1536, 3072], help="测试的长边分辨率")
+    parser.add_argument("--repeats", type=int, default=3, help="每组重复次数（取中位数）")
+    parser.add_argument("--tile-size", type=int, default=384)
+    parser.add_argument("--overlap", type=int, default=96)
+    parser.add_argument("--tile-batch-size", type=int, default=4)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--mode", default="single", help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, default=768, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(args)
+        return
+
+    print("=" * 70)
+    print("📏 深度估计基准测试：单次推理 vs 分块推理")
+    print("=" * 70)
+
+    rows = []
+    for size in args.sizes:
+        for mode in ('single', 'tiled'):
+            command = [sys.executable, os.path.abspath(__file__), '--worker', '--mode', mode, '--size', str(size),
+                       '--repeats', str(args.repeats), '--tile-size', str(args.tile_size),
+                       '--overlap', str(args.overlap), '--tile-batch-size', str(args.tile_batch_size)]
+            if args.image:
+                command += ['--image', args.image]
+            print(f"⏱️ {mode:<6} 长边 {size}px ...")
+            output = subprocess.run(command, capture_output=True, text=True)
+            if output.returncode != 0:
+                print(f"❌ 运行失败:\n{output.stderr[-2000:]}")
+                continue
+            rows.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    print("\n" + "-" * 84)
+    print(f"{'模式':<8}{'分辨率':<12}{'延迟(ms)':>10}{'基线RSS(MB)':>14}{'峰值RSS(MB)':>14}"
+          f"{'推理增量(MB)':>14}{'显存峰值(MB)':>14}")
+    print("-" * 84)
+    for row in rows:
+        gpu = row['gpu_peak_mb'] if row['gpu_peak_mb'] is not None else '-'
+        print(f"{row['mode']:<8}{row['size']:<12}{row['latency_ms']:>10}"
+              f"{row['baseline_rss_mb']:>14}{row['peak_rss_mb']:>14}{row['inference_rss_mb']:>14}{gpu:>14}")
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -12,23 +13,30 @@ from flask import Flask, request, jsonify
 from transformers import pipeline
 from PIL import Image, ImageDraw, ImageFont
 import io
+import time
 import base64
 import random
-from googletrans import Translator
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from translation_cache import TranslationCache
+from batch_images import read_uploads, parse_batch_size, run_batch, BatchUploadError
+from image_responses import image_response, install as install_image_responses, to_base64
+
 print("=" * 70)
 print("🎯 目标检测 Web 服务 - 侦探少女")
 print("=" * 70)
 
 print("\n🔍 正在召唤侦探少女...")
 detector = pipeline("object-detection", model="facebook/detr-resnet-50", device=0)
-translator = Translator()
+label_translator = TranslationCache(src='en', dest='zh-cn')
+label_translator.warm_up(detector.model.config.id2label.values())
 print("✨ 侦探少女准备完毕！开始调查~")
 
 app = Flask(__name__)
+install_image_responses(app)
 
 background_base64 = ""
 if os.path.exists(BACKGROUND_PATH):
@@ -433,59 +441,85 @@ def detect():
         image = Image.open(io.BytesIO(file.read())).convert('RGB')
         
         results = detector(image)
+        translated_results = translate_detections(results)
         
-        # 翻译标签并准备返回数据
-        translated_results = []
-        for detection in results:
-            label = detection['label']
-            
-            # 翻译标签
-            label_zh = None
-            try:
-                translated = translator.translate(label, src='en', dest='zh-cn')
-                label_zh = translated.text
-                print(f"翻译: {label} -> {label_zh}")
-            except Exception as e:
-                print(f"翻译失败: {label}, 错误: {e}")
-                label_zh = None
-            
-            translated_results.append({
-                'label': label,
-                'label_zh': label_zh,
-                'score': detection['score'],
-                'box': detection['box']
-            })
-        
-        # 在图片上绘制检测框
-        draw = ImageDraw.Draw(image)
-        colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F']
-        
-        for i, detection in enumerate(translated_results):
-            box = detection['box']
-            color = colors[i % len(colors)]
-            
-            # 绘制矩形框
-            draw.rectangle(
-                [(box['xmin'], box['ymin']), (box['xmax'], box['ymax'])],
-                outline=color,
-                width=3
-            )
-            
-            # 绘制标签（优先使用中文）
-            label_text = detection['label_zh'] if detection['label_zh'] else detection['label']
-            label = f"{label_text} {detection['score']:.2f}"
-            draw.text((box['xmin'], box['ymin']-20), label, fill=color)
-        
-        # 转换为base64
-        buffered = io.BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
-        
-        return jsonify({
-            'detections': translated_results,
-            'annotated_image': img_str
+        # 标注图按请求的 response 模式返回（默认 base64 内联；response=json 时不绘制）
+        return image_response(
+            {'detections': translated_results},
+            {'annotated_image': lambda: annotate_image(image, translated_results)}
+        )
+        
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': str(e)}), 500
+
+def translate_detections(results):
+    """为检测结果添加中文标签"""
+    # 批量翻译标签（缓存命中时不访问外部翻译服务）
+    label_zh_map = label_translator.translate_many([detection['label'] for detection in results])
+    
+    # 翻译标签并准备返回数据
+    translated_results = []
+    for detection in results:
+        label = detection['label']
+        
+        label_zh = label_zh_map.get(label)
+        
+        translated_results.append({
+            'label': label,
+            'label_zh': label_zh,
+            'score': detection['score'],
+            'box': detection['box']
         })
+    return translated_results
+
+def annotate_image(image, translated_results):
+    """在图片上绘制检测框，返回标注后的图片"""
+    draw = ImageDraw.Draw(image)
+    colors = ['#FF6B6B', '#4ECDC4', '#45B7D1', '#FFA07A', '#98D8C8', '#F7DC6F']
+    
+    for i, detection in enumerate(translated_results):
+        box = detection['box']
+        color = colors[i % len(colors)]
+        
+        # 绘制矩形框
+        draw.rectangle(
+            [(box['xmin'], box['ymin']), (box['xmax'], box['ymax'])],
+            outline=color,
+            width=3
+        )
+        
+        # 绘制标签（优先使用中文）
+        label_text = detection['label_zh'] if detection['label_zh'] else detection['label']
+        label = f"{label_text} {detection['score']:.2f}"
+        draw.text((box['xmin'], box['ymin']-20), label, fill=color)
+    
+    return image
+
+@app.route('/detect/batch', methods=['POST'])
+def detect_batch():
+    """批量检测：images 字段多文件或 zip/tar 压缩包，可选 batch_size；annotate=1 时附带标注图"""
+    try:
+        items = read_uploads(request.files)
+        batch_size = parse_batch_size(request.form.get('batch_size'))
+        annotate = request.form.get('annotate', '0').lower() in ('1', 'true', 'yes')
+        
+        def format_result(image, output):
+            translated_results = translate_detections(output)
+            result = {'detections': translated_results}
+            if annotate:
+                result['annotated_image'] = to_base64(annotate_image(image, translated_results))
+            return result
+        
+        start_time = time.time()
+        results, stats = run_batch(detector, items, format_result, batch_size=batch_size)
+        
+        return jsonify({'results': results, **stats, 'time': round(time.time() - start_time, 3)})
         
+    except BatchUploadError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         import traceback
         error_details = traceback.format_exc()
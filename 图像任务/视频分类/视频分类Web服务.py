@@ -6,6 +6,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -13,16 +14,17 @@ from flask import Flask, request, jsonify
 from transformers import AutoImageProcessor, AutoModelForVideoClassification
 import torch
 from PIL import Image
-import io
 import base64
 import numpy as np
-import cv2
-import tempfile
-from googletrans import Translator
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from translation_cache import TranslationCache
+from video_frames import extract_clip, extract_clips, video_info, window_indices, iter_window_batches
+from video_upload import UploadRequest
+
 print("=" * 70)
 print("🎬 视频分类 Web 服务 - 偶像少女")
 print("=" * 70)
@@ -34,11 +36,23 @@ model = AutoModelForVideoClassification.from_pretrained("MCG-NJU/videomae-base-f
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 model.to(device)
 
-# 初始化翻译器
-translator = Translator()
+# 初始化标签翻译缓存，并用模型标签词表预热
+label_translator = TranslationCache(src='en', dest='zh-cn')
+label_translator.warm_up(model.config.id2label.values())
 print("🌟 偶像少女准备完毕！开始分类视频~")
 
 app = Flask(__name__)
+# 上传的视频在解析表单时直接流式写入 memfd / 临时文件，请求结束时自动删除
+app.request_class = UploadRequest
+
+CLIP_BATCH_SIZE = 4  # 多片段请求中一次前向的片段数
+
+# 滑动窗口（时间轴）分类
+WINDOW_FRAME_STEP = 4                                                     # 窗口内相邻采样帧的间隔（Kinetics 训练时的采样率）
+WINDOW_STRIDE_SECONDS = float(os.environ.get('VIDEO_WINDOW_STRIDE', 1.0))  # 相邻窗口起点间隔（秒）
+WINDOW_BATCH_SIZE = int(os.environ.get('VIDEO_WINDOW_BATCH_SIZE', 8))      # 一次前向的窗口数
+MAX_WINDOW_BATCH_SIZE = 32
+MAX_WINDOWS = 512                                                          # 窗口数上限，超过时自动加大步长
 
 background_base64 = ""
 if os.path.exists(BACKGROUND_PATH):
@@ -516,61 +530,67 @@ def index():
     return HTML_TEMPLATE
 
 def extract_video_frames(video_path, num_frames=16, target_size=(224, 224)):
-    """从视频中提取指定数量的帧，并resize到统一大小"""
-    cap = cv2.VideoCapture(video_path)
-    frames = []
-    
-    # 获取视频总帧数
-    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-    
-    if total_frames == 0:
-        cap.release()
-        raise ValueError("无法读取视频文件")
+    """从视频中均匀采样指定数量的帧并缩放，返回 (num_frames, 高, 宽, 3) 的 uint8 RGB 数组"""
+    return extract_clip(video_path, num_frames=num_frames, target_size=target_size)
+
+def image_to_frames(image, num_frames=16, target_size=(224, 224)):
+    """单张图片缩放后复制为 num_frames 帧"""
+    frames = np.empty((num_frames, target_size[1], target_size[0], 3), dtype=np.uint8)
+    frames[:] = np.asarray(image.resize(target_size, Image.BILINEAR))
+    return frames
+
+def clip_probs(clips):
+    """多个片段（每个为帧数组）一起前向，返回 (片段数, 类别数) 的概率张量"""
+    # VideoMAE处理器接受视频列表，每个视频为帧列表
+    inputs = processor([list(frames) for frames in clips], return_tensors="pt")
     
-    # 均匀采样帧
-    if total_frames < num_frames:
-        # 如果视频帧数少于需要的帧数，重复最后一帧
-        indices = list(range(total_frames)) + [total_frames - 1] * (num_frames - total_frames)
-    else:
-        # 均匀采样
-        indices = np.linspace(0, total_frames - 1, num_frames, dtype=int)
+    # 将输入移到设备上
+    inputs = {k: v.to(device) for k, v in inputs.items()}
     
-    for idx in indices:
-        cap.set(cv2.CAP_PROP_POS_FRAMES, idx)
-        ret, frame = cap.read()
-        if ret:
-            # OpenCV读取的是BGR格式，转换为RGB
-            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            # 转换为PIL Image并resize到目标大小
-            pil_image = Image.fromarray(frame_rgb)
-            pil_image = pil_image.resize(target_size, Image.BILINEAR)
-            frames.append(pil_image)
-        else:
-            # 如果读取失败，使用黑色图像
-            frames.append(Image.new('RGB', target_size, (0, 0, 0)))
+    with torch.no_grad():
+        outputs = model(**inputs)
+        return torch.nn.functional.softmax(outputs.logits, dim=-1)
+
+def classify_clips(clips, top_k=5):
+    """多个片段（每个为帧数组）一起前向，返回每个片段的 top-k 预测"""
+    return top_predictions(clip_probs(clips), top_k)
+
+def top_predictions(probs, top_k=5):
+    """(N, 类别数) 概率 -> 每行的 top-k 预测（含中文标签）"""
+    # 获取top-k结果
+    num_classes = probs.shape[-1]
+    k = min(top_k, num_classes)
+    top_probs, top_indices = torch.topk(probs, k)
     
-    cap.release()
+    all_labels = [
+        [model.config.id2label.get(idx.item(), f"类别_{idx.item()}") for idx in row]
+        for row in top_indices
+    ]
     
-    # 确保返回正确数量的帧
-    if len(frames) != num_frames:
-        print(f"警告: 期望 {num_frames} 帧，实际获得 {len(frames)} 帧")
-        # 补齐或截断
-        if len(frames) < num_frames:
-            frames.extend([Image.new('RGB', target_size, (0, 0, 0))] * (num_frames - len(frames)))
-        else:
-            frames = frames[:num_frames]
+    # 批量翻译标签（缓存命中时不访问外部翻译服务）
+    label_zh_map = label_translator.translate_many([label for labels in all_labels for label in labels])
     
-    return frames
+    results = []
+    for row_probs, labels in zip(top_probs, all_labels):
+        predictions = []
+        for prob, label in zip(row_probs, labels):
+            label_zh = label_zh_map.get(label)
+            
+            predictions.append({
+                'label': label,
+                'label_zh': label_zh,
+                'score': prob.item()
+            })
+        results.append(predictions)
+    return results
 
 @app.route('/classify', methods=['POST'])
 def classify():
-    temp_file = None
     try:
         if 'file' not in request.files:
             return jsonify({'error': '没有上传文件'}), 400
         
         file = request.files['file']
-        file_content = file.read()
         
         # 判断文件类型
         file_type = file.content_type
@@ -580,64 +600,20 @@ def classify():
             # 处理视频文件
             print(f"处理视频文件: {file.filename}, 类型: {file_type}")
             
-            # 保存临时文件
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_file:
-                temp_file.write(file_content)
-                temp_path = temp_file.name
-            
-            # 提取视频帧
-            frames = extract_video_frames(temp_path, num_frames=16)
+            # 上传内容已在 memfd / 临时文件中，直接按路径解码
+            frames = extract_video_frames(file.stream.ready(), num_frames=16)
             
-            # 删除临时文件
-            os.unlink(temp_path)
-            
-            print(f"成功提取 {len(frames)} 帧，每帧大小: {frames[0].size}")
+            print(f"成功提取 {len(frames)} 帧，每帧大小: {frames.shape[2]}x{frames.shape[1]}")
         else:
             # 处理图片文件
             print(f"处理图片文件: {file.filename}")
-            image = Image.open(io.BytesIO(file_content)).convert('RGB')
-            # Resize到224x224
-            image = image.resize((224, 224), Image.BILINEAR)
-            # 将单张图片复制为16帧
-            frames = [image.copy() for _ in range(16)]
-            print(f"图片已复制为16帧，每帧大小: {frames[0].size}")
+            image = Image.open(file.stream).convert('RGB')
+            # 将单张图片缩放到224x224并复制为16帧
+            frames = image_to_frames(image)
+            print(f"图片已复制为16帧，每帧大小: {frames.shape[2]}x{frames.shape[1]}")
         
         # 使用模型进行分类
-        # VideoMAE处理器直接接受帧列表
-        inputs = processor(frames, return_tensors="pt")
-        
-        # 将输入移到设备上
-        inputs = {k: v.to(device) for k, v in inputs.items()}
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            probs = torch.nn.functional.softmax(logits, dim=-1)
-        
-        # 获取top-k结果
-        num_classes = logits.shape[-1]
-        k = min(5, num_classes)
-        top_probs, top_indices = torch.topk(probs, k)
-        
-        predictions = []
-        for prob, idx in zip(top_probs[0], top_indices[0]):
-            label = model.config.id2label.get(idx.item(), f"类别_{idx.item()}")
-            
-            # 尝试翻译成中文
-            label_zh = None
-            try:
-                translated = translator.translate(label, src='en', dest='zh-cn')
-                label_zh = translated.text
-                print(f"翻译: {label} -> {label_zh}")
-            except Exception as e:
-                print(f"翻译失败: {label}, 错误: {e}")
-                label_zh = None
-            
-            predictions.append({
-                'label': label,
-                'label_zh': label_zh,
-                'score': prob.item()
-            })
+        predictions = classify_clips([frames])[0]
         
         return jsonify({
             'predictions': predictions,
@@ -649,14 +625,120 @@ def classify():
         import traceback
         error_details = traceback.format_exc()
         print(f"错误详情: {error_details}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/classify/batch', methods=['POST'])
+def classify_batch():
+    """多个视频一起分类：files 字段上传多个视频，并行采样帧后按 CLIP_BATCH_SIZE 分批前向"""
+    try:
+        files = request.files.getlist('files') or request.files.getlist('file')
+        if not files:
+            return jsonify({'error': '没有上传文件'}), 400
+        
+        # 线程池并行采样各视频的帧
+        clips = extract_clips([file.stream.ready() for file in files], num_frames=16)
         
-        # 清理临时文件
-        if temp_file and os.path.exists(temp_file.name):
-            try:
-                os.unlink(temp_file.name)
-            except:
-                pass
+        results = [{'index': i, 'name': file.filename} for i, file in enumerate(files)]
+        valid = []
+        for i, clip in enumerate(clips):
+            if isinstance(clip, Exception):
+                results[i]['error'] = str(clip)
+            else:
+                valid.append(i)
         
+        for start in range(0, len(valid), CLIP_BATCH_SIZE):
+            batch = valid[start:start + CLIP_BATCH_SIZE]
+            for i, predictions in zip(batch, classify_clips([clips[i] for i in batch])):
+                results[i]['predictions'] = predictions
+        
+        return jsonify({'results': results})
+        
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"错误详情: {error_details}")
+        return jsonify({'error': str(e)}), 500
+
+def merge_segments(timeline):
+    """相邻且 top-1 标签相同的窗口合并为一段，分数取各窗口的平均值"""
+    segments = []
+    for window in timeline:
+        top = window['predictions'][0]
+        last = segments[-1] if segments else None
+        if last is not None and last['label'] == top['label'] and window['start_time'] <= last['end_time']:
+            last['end_time'] = window['end_time']
+            last['end_frame'] = window['end_frame']
+            last['windows'] += 1
+            last['score'] += (top['score'] - last['score']) / last['windows']
+        else:
+            segments.append({
+                'label': top['label'], 'label_zh': top['label_zh'], 'score': top['score'],
+                'start_time': window['start_time'], 'end_time': window['end_time'],
+                'start_frame': window['start_frame'], 'end_frame': window['end_frame'], 'windows': 1,
+            })
+    return segments
+
+@app.route('/classify/timeline', methods=['POST'])
+def classify_timeline():
+    """
+    长视频滑动窗口分类：视频切成重叠的 16 帧窗口，按批前向，
+    返回每个窗口的预测（时间轴）、合并后的片段以及全片的汇总标签
+    可选参数：stride（窗口步长，秒）、batch_size（一次前向的窗口数）、frame_step（窗口内采样帧间隔）、top_k
+    """
+    try:
+        if 'file' not in request.files:
+            return jsonify({'error': '没有上传文件'}), 400
+        
+        try:
+            stride_seconds = max(0.04, float(request.form.get('stride', WINDOW_STRIDE_SECONDS)))
+            batch_size = max(1, min(int(request.form.get('batch_size', WINDOW_BATCH_SIZE)), MAX_WINDOW_BATCH_SIZE))
+            frame_step = max(1, min(int(request.form.get('frame_step', WINDOW_FRAME_STEP)), 16))
+            top_k = max(1, min(int(request.form.get('top_k', 3)), 10))
+        except ValueError:
+            return jsonify({'error': '参数格式错误'}), 400
+        
+        video_path = request.files['file'].stream.ready()
+        total_frames, fps = video_info(video_path)
+        windows = window_indices(total_frames, num_frames=16, frame_step=frame_step,
+                                 stride=max(1, round(stride_seconds * fps)), max_windows=MAX_WINDOWS)
+        print(f"时间轴分类: {total_frames} 帧 @ {fps:.1f}fps，{len(windows)} 个窗口，批大小 {batch_size}")
+        
+        timeline = []
+        prob_sum = None
+        for window_ids, batch in iter_window_batches(video_path, windows, batch_size=batch_size):
+            probs = clip_probs(batch)
+            prob_sum = probs.sum(dim=0) if prob_sum is None else prob_sum + probs.sum(dim=0)
+            for i, predictions in zip(window_ids, top_predictions(probs, top_k)):
+                start_frame, end_frame = int(windows[i][0]), int(windows[i][-1])
+                timeline.append({
+                    'index': i,
+                    'start_frame': start_frame,
+                    'end_frame': end_frame,
+                    'start_time': round(start_frame / fps, 3),
+                    'end_time': round((end_frame + 1) / fps, 3),
+                    'predictions': predictions,
+                })
+        
+        # 汇总标签：所有窗口概率的平均
+        aggregate = top_predictions((prob_sum / len(windows)).unsqueeze(0), top_k=5)[0]
+        
+        return jsonify({
+            'predictions': aggregate,
+            'segments': merge_segments(timeline),
+            'timeline': timeline,
+            'num_windows': len(windows),
+            'total_frames': total_frames,
+            'fps': fps,
+            'duration': round(total_frames / fps, 3),
+            'stride_frames': int(windows[1][0] - windows[0][0]) if len(windows) > 1 else 0,
+            'frame_step': frame_step,
+            'batch_size': batch_size,
+        })
+        
+    except Exception as e:
+        import traceback
+        error_details = traceback.format_exc()
+        print(f"错误详情: {error_details}")
         return jsonify({'error': str(e)}), 500
 
 if __name__ == '__main__':
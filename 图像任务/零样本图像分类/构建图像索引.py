@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+构建 CLIP 图像检索索引
+递归扫描图片目录，按批编码为 CLIP 图像嵌入并追加到索引（已索引的图片自动跳过，可中断后续建），
+Web 服务的 /search 接口会自动加载新增的条目
+
+用法:
+    python 构建图像索引.py 图片目录 [--batch-size 64] [--ivf] [--nlist 1024]
+"""
+
+import os
+import sys
+import argparse
+os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
+os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
+
+import torch
+from transformers import CLIPModel, CLIPProcessor
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_NAME = os.environ.get('CLIP_MODEL', 'openai/clip-vit-base-patch32')  # 也可以指向 run_clip.py 微调后的输出目录
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from clip_image_index import INDEX_DIR, ImageEmbeddingIndex, index_images, list_images
+from clip_text_cache import ClipTextCache
+
+def main():
+    parser = argparse.ArgumentParser(description="构建 CLIP 图像检索索引")
+    parser.add_argument("image_dir", help="图片目录（递归扫描）")
+    parser.add_argument("--index-dir", default=INDEX_DIR, help="索引目录")
+    parser.add_argument("--batch-size", type=int, default=64, help="每批编码的图片数")
+    parser.add_argument("--ivf", action="store_true", help="建完后构建 IVF 倒排索引（适合数十万张以上的图片库）")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF 聚类数，默认约 4*sqrt(图片数)")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("🔍 构建 CLIP 图像检索索引")
+    print("=" * 70)
+
+    print(f"\n📥 加载模型: {MODEL_NAME}")
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = CLIPModel.from_pretrained(MODEL_NAME).to(device).eval()
+    processor = CLIPProcessor.from_pretrained(MODEL_NAME)
+    encoder = ClipTextCache(model, processor.tokenizer, processor.image_processor)
+
+    index = ImageEmbeddingIndex(args.index_dir, dim=model.config.projection_dim, model_name=MODEL_NAME)
+    paths = list_images(args.image_dir)
+    print(f"📂 找到 {len(paths)} 张图片，索引中已有 {len(index)} 条")
+
+    added, failed = index_images(
+        index, lambda images: encoder.image_embeddings(images).float().cpu().numpy(), paths, args.batch_size)
+    print(f"✅ 新增 {added} 条，读取失败 {failed} 张，索引共 {len(index)} 条")
+
+    if args.ivf:
+        print("\n🧮 构建 IVF 倒排索引...")
+        nlist = index.build_ivf(args.nlist)
+        print(f"✅ IVF 构建完成: {nlist} 个聚类")
+
+if __name__ == "__main__":
+    main()
@@ -5,10 +5,11 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, send_file
 from transformers import pipeline
 from PIL import Image
 import io
@@ -16,6 +17,12 @@ import base64
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
+# 启动时预先注册的标签集合：{名字: [标签...]}，请求中可用 label_set=名字 代替 labels
+LABEL_SETS_PATH = os.environ.get('CLIP_LABEL_SETS', os.path.join(CURRENT_DIR, 'label_sets.json'))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from clip_text_cache import ClipTextCache, DEFAULT_TEMPLATE
+from clip_image_index import INDEX_DIR, ImageEmbeddingIndex
 
 print("=" * 70)
 print("🌈 零样本图像分类 Web 服务 - 魔导书少女")
@@ -23,6 +30,22 @@ print("=" * 70)
 
 print("\n📖 正在召唤魔导书少女...")
 classifier = pipeline("zero-shot-image-classification", model="openai/clip-vit-base-patch32", device=0)
+# 标签的文本嵌入按 (模板, 标签) 缓存并持久化，打分只需编码图片 + 一次矩阵乘法
+text_cache = ClipTextCache(classifier.model, classifier.tokenizer, classifier.image_processor)
+num_label_sets = text_cache.load_label_sets(LABEL_SETS_PATH)
+if num_label_sets:
+    print(f"📚 已预计算 {num_label_sets} 个标签集合")
+
+# 图像检索索引由 构建图像索引.py 离线构建，存在时才启用 /search 接口
+image_index = None
+
+def get_image_index():
+    global image_index
+    if image_index is None and os.path.exists(os.path.join(INDEX_DIR, 'meta.json')):
+        image_index = ImageEmbeddingIndex(INDEX_DIR, dim=classifier.model.config.projection_dim,
+                                          model_name=classifier.model.config._name_or_path)
+        print(f"🔍 已加载图像检索索引: {len(image_index)} 张图片")
+    return image_index
 print("✨ 魔导书少女准备完毕！可以识别任意类别~")
 
 app = Flask(__name__)
@@ -519,32 +542,53 @@ def background():
 def index():
     return HTML_TEMPLATE
 
+def template_error(template):
+    """检查客户端提供的提示词模板，可用时返回 None，否则返回错误信息"""
+    if not isinstance(template, str) or '{}' not in template:
+        return '提示词模板需要包含 {} 占位符'
+    try:
+        # 多余的 {0}/{name} 占位符或未配对的花括号在格式化时才会报错，提前拒绝
+        template.format('x')
+    except (AttributeError, IndexError, KeyError, ValueError) as e:
+        return f'提示词模板无效: {e}'
+    return None
+
 @app.route('/classify', methods=['POST'])
 def classify():
     try:
         if 'image' not in request.files:
             return jsonify({'error': '没有上传图片'}), 400
         
-        if 'labels' not in request.form:
-            return jsonify({'error': '没有提供类别标签'}), 400
-        
         file = request.files['image']
-        labels_str = request.form['labels']
-        
-        # 解析标签 - 支持中英文逗号和分号
-        # 先统一替换为英文逗号
-        labels_str = labels_str.replace('，', ',').replace('；', ';').replace(';', ',')
-        labels = [label.strip() for label in labels_str.split(',') if label.strip()]
+        template = request.form.get('template') or DEFAULT_TEMPLATE
+        error = template_error(template)
+        if error:
+            return jsonify({'error': error}), 400
+        
+        if request.form.get('label_set'):
+            # 使用预先注册的标签集合（矩阵已预计算）
+            label_set = text_cache.named(request.form['label_set'])
+            if label_set is None:
+                return jsonify({'error': f"未注册的标签集合: {request.form['label_set']}"}), 400
+            template, labels = label_set
+        elif 'labels' in request.form:
+            labels_str = request.form['labels']
+            
+            # 解析标签 - 支持中英文逗号和分号
+            # 先统一替换为英文逗号
+            labels_str = labels_str.replace('，', ',').replace('；', ';').replace(';', ',')
+            labels = list(dict.fromkeys(label.strip() for label in labels_str.split(',') if label.strip()))
+        else:
+            return jsonify({'error': '没有提供类别标签'}), 400
         
         if not labels:
             return jsonify({'error': '请至少提供一个类别标签'}), 400
         
         image = Image.open(io.BytesIO(file.read())).convert('RGB')
         
-        results = classifier(image, candidate_labels=labels)
+        # 与 pipeline 结果相同：每个元素是字典 {'score': float, 'label': str}，按分数降序
+        results = text_cache.classify([image], labels, template)[0]
         
-        # CLIP零样本分类返回的是列表格式
-        # 每个元素是字典: {'score': float, 'label': str}
         formatted_results = []
         for item in results:
             formatted_results.append({
@@ -560,6 +604,92 @@ def classify():
         print(f"错误详情: {error_details}")
         return jsonify({'error': f'{str(e)}'}), 500
 
+@app.route('/label_sets', methods=['POST'])
+def register_label_set():
+    """注册命名标签集合：JSON {"name": ..., "labels": [...], "template": 可选}"""
+    data = request.get_json(silent=True) or {}
+    name = data.get('name')
+    labels = [str(label).strip() for label in data.get('labels', []) if str(label).strip()]
+    template = data.get('template') or DEFAULT_TEMPLATE
+    if not name or not labels:
+        return jsonify({'error': '需要提供 name 和 labels'}), 400
+    error = template_error(template)
+    if error:
+        return jsonify({'error': error}), 400
+    try:
+        count = text_cache.register(name, list(dict.fromkeys(labels)), template)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    return jsonify({'name': name, 'labels': count, 'template': template})
+
+def search_params(values):
+    try:
+        k = int(values.get('k', 10))
+    except (TypeError, ValueError):
+        k = 10
+    exact = str(values.get('exact', '')).lower() in ('1', 'true', 'yes')
+    return k, exact
+
+@app.route('/search/text', methods=['POST'])
+def search_by_text():
+    """以文搜图：JSON 或表单 {"query": ..., "k": 10, "exact": false}"""
+    index = get_image_index()
+    if index is None:
+        return jsonify({'error': '图像检索索引尚未构建，请先运行 构建图像索引.py'}), 404
+    values = request.get_json(silent=True) or request.form
+    query = str(values.get('query', '')).strip()
+    if not query:
+        return jsonify({'error': '没有提供查询文本'}), 400
+    try:
+        k, exact = search_params(values)
+        query_vector = text_cache.encode_texts([query]).numpy()
+        return jsonify({'query': query, 'results': index.search(query_vector, k, exact=exact)[0]})
+    except Exception as e:
+        import traceback
+        print(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search/image', methods=['POST'])
+def search_by_image():
+    """以图搜图：上传 image，可选 k / exact"""
+    index = get_image_index()
+    if index is None:
+        return jsonify({'error': '图像检索索引尚未构建，请先运行 构建图像索引.py'}), 404
+    if 'image' not in request.files:
+        return jsonify({'error': '没有上传图片'}), 400
+    try:
+        k, exact = search_params(request.form)
+        image = Image.open(request.files['image'].stream).convert('RGB')
+        query_vector = text_cache.image_embeddings([image]).float().cpu().numpy()
+        return jsonify({'results': index.search(query_vector, k, exact=exact)[0]})
+    except Exception as e:
+        import traceback
+        print(f"错误详情: {traceback.format_exc()}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/search/item/<int:item_id>')
+def search_item(item_id):
+    """返回检索结果对应的原图"""
+    index = get_image_index()
+    if index is None or not 0 <= item_id < len(index.items):
+        return '', 404
+    path = index.items[item_id].get('path')
+    if not path or not os.path.exists(path):
+        return '', 404
+    return send_file(path)
+
+@app.route('/search/info')
+def search_info():
+    index = get_image_index()
+    return jsonify(index.info() if index is not None else {'count': 0})
+
+@app.route('/cache/info')
+def cache_info():
+    """文本嵌入缓存统计"""
+    return jsonify(text_cache.info())
+
 if __name__ == '__main__':
     import webbrowser
     import threading
@@ -7,6 +7,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -28,6 +29,10 @@ app = Flask(__name__)
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from generation_scheduler import build_processors, token_probs
+import speculative_decoding
+
 print("=" * 70)
 print("🚀 正在启动视觉文本生成 Web 服务（两步法）...")
 print("=" * 70)
@@ -49,6 +54,16 @@ qwen_model = AutoModelForCausalLM.from_pretrained("Qwen/Qwen2.5-1.5B-Instruct")
 qwen_model = qwen_model.to(device)
 print(f"✅ Qwen 模型加载成功！(设备: {device})")
 
+# 可选的推测解码（SPECULATIVE_DECODING=1 开启），故事生成为长文本，收益最明显
+speculative = None
+if speculative_decoding.ENABLED:
+    try:
+        speculative = speculative_decoding.SpeculativeDecoder(
+            qwen_model, speculative_decoding.load_draft_model(qwen_model)
+        )
+    except Exception as e:
+        print(f"⚠️  推测解码初始化失败，使用普通解码: {e}")
+
 # 初始化翻译器
 translator = None
 if TRANSLATOR_AVAILABLE:
@@ -84,6 +99,25 @@ def generate_story_with_qwen(image_description):
     
     model_inputs = qwen_tokenizer([text], return_tensors="pt").to(device)
     
+    if speculative is not None:
+        # 采样参数与下面的 generate 调用一致（top_k 等其余默认值取自模型的 generation_config）
+        generation_config = qwen_model.generation_config
+        processors = build_processors(
+            temperature=0.85,
+            top_p=0.9,
+            top_k=generation_config.top_k,
+            repetition_penalty=1.1,
+            do_sample=True
+        )
+        eos = generation_config.eos_token_id
+        generated = speculative.generate(
+            model_inputs.input_ids[0].tolist(),
+            max_new_tokens=600,
+            probs_fn=lambda history, logits: token_probs(processors, True, history, logits),
+            stop_token_ids=eos if isinstance(eos, (list, tuple)) else [eos]
+        )
+        return qwen_tokenizer.decode(generated, skip_special_tokens=True).strip()
+    
     generated_ids = qwen_model.generate(
         **model_inputs,
         max_new_tokens=600,
@@ -494,6 +528,13 @@ def background():
         return send_file(BACKGROUND_PATH, mimetype='image/png')
     return '', 404
 
+@app.route('/api/metrics')
+def metrics():
+    """推测解码统计（接受率、回退次数等）"""
+    return jsonify({
+        'speculative_decoding': speculative.info() if speculative is not None else None
+    })
+
 @app.route('/generate', methods=['POST'])
 def generate():
     """生成内容（支持两种模式）"""
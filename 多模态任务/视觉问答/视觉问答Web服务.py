@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -14,23 +15,23 @@ from PIL import Image
 import base64
 import io
 
-# 导入翻译库
-try:
-    from googletrans import Translator
-    TRANSLATOR_AVAILABLE = True
-    translator = Translator()
-    print("✅ Google翻译支持已启用")
-except ImportError:
-    TRANSLATOR_AVAILABLE = False
-    translator = None
-    print("⚠️  未安装 googletrans，中文翻译不可用")
-    print("   安装命令: pip install googletrans==4.0.0-rc1")
-
 app = Flask(__name__)
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from async_translation import AsyncTranslator, CHINESE_LANGS
+
+# 异步翻译阶段：语言检测与翻译合并为一次请求，在线程池中执行，超时返回原文
+translator = AsyncTranslator()
+TRANSLATOR_AVAILABLE = translator.available
+if TRANSLATOR_AVAILABLE:
+    print(f"✅ Google翻译已加载（截止时间 {translator.timeout}s）")
+else:
+    print("⚠️  未安装 googletrans，中文翻译不可用")
+    print("   安装命令: pip install googletrans==4.0.0-rc1")
+
 # 常见中文问题的直接映射（避免翻译错误）
 QUESTION_MAPPING = {
     '图中有什么？': 'What is in the image?',
@@ -577,36 +578,30 @@ def ask():
         if not question:
             return jsonify({'success': False, 'error': '请输入问题'})
         
-        image = Image.open(file.stream).convert('RGB')
-        
         # 检测问题语言并翻译
         original_question = question
         question_lang = 'en'  # 默认英文
         translated_question = None
+        translation_future = None
         
-        # 首先检查是否有直接映射
+        # 首先检查是否有直接映射，否则在后台线程中检测语言并翻译，与图片解码并行
         if question in QUESTION_MAPPING:
             translated_question = QUESTION_MAPPING[question]
             question = translated_question
             question_lang = 'zh'
             print(f"使用预设映射: {original_question} -> {translated_question}")
-        elif TRANSLATOR_AVAILABLE:
-            try:
-                # 检测语言
-                detected = translator.detect(question)
-                question_lang = detected.lang
-                print(f"检测到语言: {question_lang}")
-                
-                # 如果是中文，翻译成英文
-                if question_lang in ['zh-cn', 'zh-tw', 'zh']:
-                    print(f"原始中文问题: {question}")
-                    translated = translator.translate(question, src='auto', dest='en')
-                    translated_question = translated.text
-                    print(f"翻译为英文: {translated_question}")
-                    question = translated_question
-            except Exception as e:
-                print(f"翻译失败，使用原始问题: {e}")
-                question_lang = 'en'  # 翻译失败时假设是英文
+        else:
+            translation_future = translator.submit(question, src='auto', dest='en', skip_langs=())
+        
+        image = Image.open(file.stream).convert('RGB')
+        
+        if translation_future is not None:
+            translation = translator.wait(translation_future, question)
+            # 只有中文问题才使用译文；超时或失败时假设是英文
+            if translation['src'] in CHINESE_LANGS:
+                question_lang = translation['src']
+                translated_question = translation['text']
+                question = translated_question
         
         # 调用VQA模型
         print(f"调用VQA模型，问题: {question}")
@@ -634,15 +629,9 @@ def ask():
         
         print(f"提取的答案: {answer}, 置信度: {score}")
         
-        # 如果原始问题是中文，将答案翻译回中文
-        if TRANSLATOR_AVAILABLE and question_lang in ['zh-cn', 'zh-tw', 'zh']:
-            try:
-                print(f"英文答案: {answer}")
-                translated_answer = translator.translate(answer, src='en', dest='zh-cn')
-                answer = translated_answer.text
-                print(f"翻译为中文: {answer}")
-            except Exception as e:
-                print(f"答案翻译失败，返回英文答案: {e}")
+        # 如果原始问题是中文，将答案翻译回中文（超时返回英文答案）
+        if question_lang in CHINESE_LANGS:
+            answer = translator.translate(answer, src='en', dest='zh-cn')['text']
         
         response = {
             'success': True,
@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -18,22 +19,22 @@ from flask import Flask, request, jsonify, render_template_string, send_file
 from transformers import pipeline
 import base64
 
-# 导入翻译库
-try:
-    from googletrans import Translator
-    TRANSLATOR_AVAILABLE = True
-    translator = Translator()
-    print("✅ Google翻译支持已启用")
-except ImportError:
-    TRANSLATOR_AVAILABLE = False
-    translator = None
-    print("⚠️  未安装 googletrans，翻译功能不可用")
-
 app = Flask(__name__)
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from async_translation import AsyncTranslator
+
+# 异步翻译阶段：语言检测与翻译合并为一次请求，在线程池中执行，超时返回原文
+translator = AsyncTranslator()
+TRANSLATOR_AVAILABLE = translator.available
+if TRANSLATOR_AVAILABLE:
+    print(f"✅ Google翻译已加载（截止时间 {translator.timeout}s）")
+else:
+    print("⚠️  未安装 googletrans，翻译功能不可用")
+
 print("=" * 70)
 print("🎵 音频文本理解 Web 服务 - 音频解析师")
 print("=" * 70)
@@ -408,6 +409,35 @@ def background():
     else:
         return '', 404
 
+def classify_sentiment(text):
+    """文本分类（情感分析），失败时返回 None"""
+    try:
+        classification = classifier(text)[0]
+        
+        # 翻译情感标签为中文
+        sentiment_map = {
+            'positive': '积极',
+            'negative': '消极',
+            'neutral': '中性',
+            'POSITIVE': '积极',
+            'NEGATIVE': '消极',
+            'NEUTRAL': '中性',
+            'LABEL_0': '消极',
+            'LABEL_1': '积极',
+            'LABEL_2': '中性',
+        }
+        
+        if 'label' in classification:
+            original_label = classification['label']
+            # 清理标签文本，只保留主要情感词
+            clean_label = original_label.split('(')[0].strip()
+            classification['label_cn'] = sentiment_map.get(clean_label, sentiment_map.get(original_label, '积极'))
+            classification['label_en'] = original_label
+        return classification
+    except Exception as e:
+        print(f"情感分析失败: {e}")
+        return None
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     try:
@@ -426,57 +456,19 @@ def analyze():
         # generate_kwargs 可以指定语言，提高中文识别准确率
         transcription_result = asr(tmp_path, generate_kwargs={"language": "chinese"})
         transcription = transcription_result['text']
-        transcription_cn = transcription  # 默认使用原文
-        
-        # 如果识别结果是英文，翻译成中文
-        if TRANSLATOR_AVAILABLE:
-            try:
-                # 检测语言
-                detected = translator.detect(transcription)
-                print(f"检测到语言: {detected.lang}")
-                
-                # 如果不是中文，翻译成中文
-                if detected.lang != 'zh-cn' and detected.lang != 'zh':
-                    print(f"原文: {transcription}")
-                    translated = translator.translate(transcription, src='auto', dest='zh-cn')
-                    transcription_cn = translated.text
-                    print(f"翻译: {transcription_cn}")
-            except Exception as e:
-                print(f"翻译失败: {e}")
-                transcription_cn = transcription
-        
-        # 文本分类（情感分析）- 使用中文文本
-        classification = None
-        try:
-            classification_result = classifier(transcription_cn)
-            classification = classification_result[0]
-            
-            # 翻译情感标签为中文
-            sentiment_map = {
-                'positive': '积极',
-                'negative': '消极',
-                'neutral': '中性',
-                'POSITIVE': '积极',
-                'NEGATIVE': '消极',
-                'NEUTRAL': '中性',
-                'LABEL_0': '消极',
-                'LABEL_1': '积极',
-                'LABEL_2': '中性',
-            }
-            
-            if 'label' in classification:
-                original_label = classification['label']
-                # 清理标签文本，只保留主要情感词
-                clean_label = original_label.split('(')[0].strip()
-                classification['label_cn'] = sentiment_map.get(clean_label, sentiment_map.get(original_label, '积极'))
-                classification['label_en'] = original_label
-        except Exception as e:
-            print(f"情感分析失败: {e}")
-            pass
-        
-        # 删除临时文件
+        
+        # 如果识别结果不是中文，翻译成中文（后台线程执行，超时使用原文）
+        translation_future = translator.submit(transcription, src='auto', dest='zh-cn')
         os.unlink(tmp_path)
         
+        # 识别已强制为中文，绝大多数情况下无需翻译：情感分析先在原文上运行，与翻译请求并行，
+        # 只有确实翻译了的少数情况才在译文上重新分析
+        classification = classify_sentiment(transcription)
+        translation = translator.wait(translation_future, transcription)
+        transcription_cn = translation['text']
+        if translation['translated'] and transcription_cn != transcription:
+            classification = classify_sentiment(transcription_cn)
+        
         return jsonify({
             'success': True,
             'transcription': transcription_cn,  # 返回中文翻译
@@ -11,6 +11,8 @@ from transformers import AutoModelForSequenceClassification, AutoTokenizer, pipe
 import torch
 import torch.nn.functional as F
 import time
+import queue
+import threading
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
@@ -23,6 +25,106 @@ tokenizer = None
 classifier = None
 model_info = {}
 
+# 动态批处理参数（可通过环境变量覆盖）
+BATCH_MAX_SIZE = int(os.environ.get('SENTIMENT_BATCH_MAX_SIZE', 32))       # 单批最多合并的请求数
+BATCH_MAX_WAIT_MS = float(os.environ.get('SENTIMENT_BATCH_MAX_WAIT_MS', 10))  # 凑批最长等待时间（毫秒）
+BATCH_TIMEOUT = 30       # 单个请求等待结果的超时时间（秒）
+
+# ============================================================================
+# 动态批处理队列
+# ============================================================================
+
+class BatchInferenceQueue:
+    """请求合并推理队列：在 max_wait_ms 或 max_batch_size 内凑批，一次前向后分发结果"""
+    
+    def __init__(self, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS):
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._worker = None
+        self.num_batches = 0
+        self.num_requests = 0
+        self.max_fill = 0
+        self.last_fill = 0
+        self.fill_histogram = {}
+    
+    def start(self):
+        """启动后台推理线程"""
+        if self._worker is None:
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+    
+    def submit(self, text, timeout=BATCH_TIMEOUT):
+        """提交一条文本并阻塞等待，返回 (负面概率, 正面概率)"""
+        item = {'text': text, 'event': threading.Event(), 'probs': None, 'error': None}
+        self._queue.put(item)
+        if not item['event'].wait(timeout):
+            raise TimeoutError('推理排队超时')
+        if item['error'] is not None:
+            raise item['error']
+        return item['probs']
+    
+    def _collect(self):
+        """阻塞取到第一个请求后，在等待窗口内继续凑批"""
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait_ms / 1000.0
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                texts = [item['text'] for item in batch]
+                inputs = tokenizer(texts, return_tensors="pt", padding=True, truncation=True)
+                with torch.no_grad():
+                    outputs = model(**inputs)
+                probs = F.softmax(outputs.logits, dim=-1).tolist()
+                for item, p in zip(batch, probs):
+                    item['probs'] = (p[0], p[1])
+            except Exception as e:
+                for item in batch:
+                    item['error'] = e
+            finally:
+                self._record(len(batch))
+                for item in batch:
+                    item['event'].set()
+    
+    def _record(self, size):
+        with self._stats_lock:
+            self.num_batches += 1
+            self.num_requests += size
+            self.last_fill = size
+            self.max_fill = max(self.max_fill, size)
+            self.fill_histogram[size] = self.fill_histogram.get(size, 0) + 1
+    
+    def stats(self):
+        """批处理填充统计"""
+        with self._stats_lock:
+            avg_fill = self.num_requests / self.num_batches if self.num_batches else 0.0
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait_ms,
+                'queue_size': self._queue.qsize(),
+                'num_batches': self.num_batches,
+                'num_requests': self.num_requests,
+                'avg_fill': round(avg_fill, 2),
+                'avg_fill_ratio': round(avg_fill / self.max_batch_size, 3),
+                'last_fill': self.last_fill,
+                'max_fill': self.max_fill,
+                'fill_histogram': {str(k): v for k, v in sorted(self.fill_histogram.items())}
+            }
+
+batch_queue = BatchInferenceQueue()
+
 # ============================================================================
 # 加载模型
 # ============================================================================
@@ -66,8 +168,12 @@ def load_model():
         model_info["device"] = device
         model_info["model_path"] = model_path
         
+        # 启动动态批处理
+        batch_queue.start()
+        
         print(f"\n✅ 模型加载完成")
         print(f"   设备: {device}")
+        print(f"   动态批处理: 最大 {BATCH_MAX_SIZE} 条 / 最长等待 {BATCH_MAX_WAIT_MS}ms")
         return True
         
     except Exception as e:
@@ -581,15 +687,8 @@ def analyze():
         # 开始计时
         start_time = time.time()
         
-        # 使用模型进行预测
-        inputs = tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-        
-        probs = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        negative_prob = probs[0][0].item()
-        positive_prob = probs[0][1].item()
+        # 提交到动态批处理队列，与并发请求合并成一个批次推理
+        negative_prob, positive_prob = batch_queue.submit(text)
         
         elapsed_time = time.time() - start_time
         
@@ -614,7 +713,7 @@ def analyze():
 @app.route('/api/info', methods=['GET'])
 def info():
     """获取模型信息"""
-    return jsonify(model_info)
+    return jsonify({**model_info, 'batching': batch_queue.stats()})
 
 # ============================================================================
 # 主函数
@@ -6,29 +6,47 @@ Qwen2.5 智能客服 Web 服务
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
-from flask import Flask, request, jsonify, render_template_string, send_file
+from flask import Flask, request, jsonify, render_template_string, send_file, Response, stream_with_context
 import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from peft import PeftModel
 import time
+import json
+import uuid
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(CURRENT_DIR))), '公共模块'))
+from generation_scheduler import ContinuousBatchScheduler
+from session_cache import SessionStore
+import speculative_decoding
 
 app = Flask(__name__)
 
 # 全局变量
 model = None
 tokenizer = None
+scheduler = None
+sessions = SessionStore()
 model_info = {}
 
+# 生成配置
+SYSTEM_PROMPT = "你是一个专业的智能客服助手，请根据用户的问题提供准确、友好的回答。"
+MAX_NEW_TOKENS = 512
+TEMPERATURE = 0.7
+TOP_P = 0.8
+MAX_HISTORY_TURNS = 10  # 每个会话保留的历史轮数，超出后丢弃最早的轮次（该轮需完整预填充）
+
 # ============================================================================
 # 加载模型
 # ============================================================================
 
 def load_model():
     """加载 Qwen2.5 + LoRA 模型"""
-    global model, tokenizer, model_info
+    global model, tokenizer, scheduler, model_info
     
     # 获取脚本所在目录
     script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -79,6 +97,24 @@ def load_model():
         
         model = model.eval()
         
+        # 可选的推测解码：只有一个在途请求时由草稿模型提出 token、本模型验证
+        speculative = None
+        if speculative_decoding.ENABLED:
+            try:
+                draft_model = speculative_decoding.load_draft_model(model)
+                speculative = speculative_decoding.SpeculativeDecoder(model, draft_model)
+            except Exception as e:
+                print(f"⚠️  推测解码初始化失败，使用普通解码: {e}")
+        model_info["speculative_decoding"] = speculative is not None
+        
+        # 所有请求都交给连续批处理调度器，在 token 级别交错解码
+        scheduler = ContinuousBatchScheduler(model, tokenizer, speculative=speculative)
+        
+        # 系统提示词部分对所有请求都相同，预先算好 KV 并固定在前缀缓存中
+        prefix_ids = shared_prompt_prefix()
+        if scheduler.pin_prefix(prefix_ids):
+            print(f"✅ 系统提示词前缀已缓存: {len(prefix_ids)} tokens")
+        
         device = "GPU" if torch.cuda.is_available() else "CPU"
         model_info["device"] = device
         
@@ -316,6 +352,9 @@ HTML_TEMPLATE = """
     </div>
     
     <script>
+        // 会话 ID 由服务端在第一轮回复时分配，之后每轮带上以延续多轮对话
+        let sessionId = null;
+        
         function addMessage(content, isUser) {
             const messagesDiv = document.getElementById('chatMessages');
             const messageDiv = document.createElement('div');
@@ -328,6 +367,7 @@ HTML_TEMPLATE = """
             messageDiv.appendChild(contentDiv);
             messagesDiv.appendChild(messageDiv);
             messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            return contentDiv;
         }
         
         async function sendMessage() {
@@ -347,21 +387,48 @@ HTML_TEMPLATE = """
             input.disabled = true;
             loading.style.display = 'block';
             
+            let contentDiv = null;
             try {
-                const response = await fetch('/api/chat', {
+                const response = await fetch('/api/chat/stream', {
                     method: 'POST',
                     headers: {
                         'Content-Type': 'application/json'
                     },
-                    body: JSON.stringify({ question: question })
+                    body: JSON.stringify({ question: question, session_id: sessionId })
                 });
                 
-                const data = await response.json();
-                
-                if (data.success) {
-                    addMessage(data.response, false);
-                } else {
+                if (!response.ok || !response.body) {
+                    const data = await response.json();
                     addMessage('抱歉，出现了错误：' + data.error, false);
+                    return;
+                }
+                
+                // 逐段读取 SSE 事件，收到第一个 token 就开始显示回复
+                const reader = response.body.getReader();
+                const decoder = new TextDecoder();
+                let buffer = '';
+                while (true) {
+                    const { value, done } = await reader.read();
+                    if (done) break;
+                    buffer += decoder.decode(value, { stream: true });
+                    const events = buffer.split('\\n\\n');
+                    buffer = events.pop();
+                    for (const event of events) {
+                        if (!event.startsWith('data: ')) continue;
+                        const data = JSON.parse(event.slice(6));
+                        if (data.error) {
+                            addMessage('抱歉，出现了错误：' + data.error, false);
+                        } else if (data.done) {
+                            sessionId = data.session_id;
+                        } else if (data.delta) {
+                            if (!contentDiv) {
+                                loading.style.display = 'none';
+                                contentDiv = addMessage('', false);
+                            }
+                            contentDiv.textContent += data.delta;
+                            document.getElementById('chatMessages').scrollTop = document.getElementById('chatMessages').scrollHeight;
+                        }
+                    }
                 }
             } catch (error) {
                 addMessage('抱歉，网络错误：' + error.message, false);
@@ -404,52 +471,101 @@ def background():
     bg_path = os.path.join(script_dir, '背景.png')
     return send_file(bg_path, mimetype='image/png')
 
+def build_prompt_ids(question, session=None):
+    """
+    构建 Qwen2.5 对话格式的输入，返回 (渲染文本, token)
+    会话的已编码文本是新文本的前缀时沿用会话的 token，只编码新增部分，保证与会话 KV 对齐
+    """
+    history = session['messages'] if session else []
+    messages = [{"role": "system", "content": SYSTEM_PROMPT}] + history + [{"role": "user", "content": question}]
+    text = tokenizer.apply_chat_template(
+        messages,
+        tokenize=False,
+        add_generation_prompt=True
+    )
+    if session and text.startswith(session['text']):
+        return text, session['token_ids'] + tokenizer(text[len(session['text']):]).input_ids
+    return text, tokenizer(text).input_ids
+
+def shared_prompt_prefix():
+    """所有问题共享的提示词 token 前缀（系统提示词 + 用户轮次的开头）"""
+    first, second = build_prompt_ids("你好")[1], build_prompt_ids("Hello")[1]
+    length = 0
+    while length < min(len(first), len(second)) and first[length] == second[length]:
+        length += 1
+    return first[:length]
+
+def submit_question(data):
+    """校验请求并提交给调度器，返回 (本轮对话, 错误信息)"""
+    data = data or {}
+    question = data.get('question', '').strip()
+    if not question:
+        return None, '问题不能为空'
+    if scheduler is None:
+        return None, '模型未加载'
+    
+    session_id = str(data.get('session_id') or uuid.uuid4().hex)[:64]
+    session = sessions.get(session_id)
+    if session and len(session['messages']) > MAX_HISTORY_TURNS * 2:
+        session['messages'] = session['messages'][-MAX_HISTORY_TURNS * 2:]
+    
+    text, prompt_ids = build_prompt_ids(question, session)
+    generation = scheduler.submit(
+        prompt_ids,
+        max_new_tokens=MAX_NEW_TOKENS,
+        temperature=TEMPERATURE,
+        top_p=TOP_P,
+        do_sample=True,
+        past=session['cache'] if session else None,
+        keep_cache=True
+    )
+    return {
+        'session_id': session_id,
+        'question': question,
+        'history': session['messages'] if session else [],
+        'text': text,
+        'generation': generation
+    }, None
+
+def finish_turn(turn):
+    """把本轮问答和结束时的 KV 写回会话；被取消或出错的轮次不记录"""
+    generation = turn['generation']
+    if generation.finish_reason not in ('stop', 'length'):
+        return
+    messages = turn['history'] + [
+        {"role": "user", "content": turn['question']},
+        {"role": "assistant", "content": generation.text}
+    ]
+    sessions.save(
+        turn['session_id'],
+        messages,
+        turn['text'] + generation.text,
+        generation.prompt_ids + generation.generated,
+        generation.cache
+    )
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
-    """聊天 API"""
+    """聊天 API（等待完整回复）"""
     try:
-        data = request.json
-        question = data.get('question', '').strip()
-        
-        if not question:
+        start_time = time.time()
+        turn, error = submit_question(request.json)
+        if error:
             return jsonify({
                 'success': False,
-                'error': '问题不能为空'
+                'error': error
             })
         
-        # 构建 Qwen2.5 格式的提示
-        messages = [
-            {"role": "system", "content": "你是一个专业的智能客服助手，请根据用户的问题提供准确、友好的回答。"},
-            {"role": "user", "content": question}
-        ]
-        
-        # 使用 tokenizer 的 apply_chat_template
-        text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
-        )
-        
-        # 调用模型生成
-        start_time = time.time()
-        inputs = tokenizer([text], return_tensors="pt").to(model.device)
-        
-        with torch.no_grad():
-            outputs = model.generate(
-                **inputs,
-                max_new_tokens=512,
-                temperature=0.7,
-                top_p=0.8,
-                do_sample=True
-            )
-        
-        # 解码输出
-        response = tokenizer.decode(outputs[0][len(inputs.input_ids[0]):], skip_special_tokens=True)
+        generation = turn['generation']
+        response = generation.result()
+        finish_turn(turn)
         elapsed_time = time.time() - start_time
         
         return jsonify({
             'success': True,
             'response': response.strip(),
+            'session_id': turn['session_id'],
+            'cached_tokens': generation.cached_tokens,
             'time': f"{elapsed_time:.2f}s"
         })
         
@@ -459,10 +575,58 @@ def chat():
             'error': str(e)
         })
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    """聊天 API（SSE 逐 token 推送）"""
+    try:
+        start_time = time.time()
+        turn, error = submit_question(request.json)
+    except Exception as e:
+        turn, error = None, str(e)
+    if error:
+        return jsonify({'success': False, 'error': error}), 400
+    
+    generation = turn['generation']
+    
+    def sse(payload):
+        return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    
+    def generate():
+        try:
+            for delta in generation.stream():
+                yield sse({'delta': delta})
+            finish_turn(turn)
+            yield sse({
+                'done': True,
+                'session_id': turn['session_id'],
+                'finish_reason': generation.finish_reason,
+                'tokens': len(generation.generated),
+                'cached_tokens': generation.cached_tokens,
+                'ttft': f"{generation.ttft:.2f}s" if generation.ttft is not None else None,
+                'time': f"{time.time() - start_time:.2f}s"
+            })
+        except Exception as e:
+            yield sse({'error': str(e)})
+        finally:
+            # 客户端断开时生成器被关闭，通知调度器释放该请求的批次位置
+            generation.cancel()
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/session/<session_id>', methods=['DELETE'])
+def end_session(session_id):
+    """结束会话，释放其历史与 KV 缓存"""
+    return jsonify({'success': sessions.drop(session_id)})
+
 @app.route('/api/info', methods=['GET'])
 def info():
-    """获取模型信息"""
-    return jsonify(model_info)
+    """获取模型信息与调度器统计"""
+    return jsonify({
+        **model_info,
+        'scheduler': scheduler.info() if scheduler else None,
+        'sessions': sessions.info()
+    })
 
 # ============================================================================
 # 主函数
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+统一推理服务 - 多模型共享宿主进程
+在一个进程内挂载各任务 Web 服务（每个任务一个路由命名空间），
+共享 tokenizer / processor 缓存和工作线程池，模型首次访问时才加载，
+超出内存预算时按 LRU 卸载最久未使用的任务
+"""
+
+import os
+import sys
+import gc
+import time
+import threading
+import importlib.util
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from flask import Flask, jsonify, render_template_string
+from werkzeug.serving import run_simple
+from werkzeug.wsgi import ClosingIterator
+import torch
+import transformers
+
+CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(CURRENT_DIR)
+
+# ============================================================================
+# 配置
+# ============================================================================
+
+PORT = int(os.environ.get('MODEL_HOST_PORT', 6000))
+MEMORY_BUDGET_MB = int(os.environ.get('MODEL_HOST_MEMORY_MB', 8192))  # 已加载模型的内存预算
+MAX_WORKERS = int(os.environ.get('MODEL_HOST_MAX_WORKERS', 16))       # 所有任务共享的并发请求数
+SHARED_CACHE_SIZE = 32                                                 # tokenizer / processor 共享缓存条目数
+
+# 任务注册表：路由命名空间 -> 任务脚本
+#   path: 相对项目根目录的脚本路径，脚本需定义模块级 Flask 对象 app
+#   init: 可选，导入后调用的初始化函数（脚本只在 __main__ 中加载模型时使用）
+# 摄像头类服务依赖 SocketIO 长连接，不在此挂载
+TASK_REGISTRY = {
+    # 文本任务
+    'qa':                  {'name': '问答系统',     'path': '文本任务/问答系统/问答系统Web服务.py', 'init': 'load_model'},
+    'ner':                 {'name': '命名实体识别', 'path': '文本任务/命名实体识别/命名实体识别Web服务.py'},
+    'fill-mask':           {'name': '掩码词填充',   'path': '文本任务/掩码词填充/掩码词填充Web服务.py'},
+    'news':                {'name': '新闻分类',     'path': '文本任务/文本分类/新闻分类Web服务.py'},
+    'summarization':       {'name': '文本摘要',     'path': '文本任务/文本摘要/文本摘要Web服务.py'},
+    'translation':         {'name': '机器翻译',     'path': '文本任务/机器翻译/机器翻译Web服务.py'},
+    'zero-shot':           {'name': '零样本分类',   'path': '文本任务/零样本分类/零样本分类Web服务.py'},
+    'customer-service':    {'name': '智能客服',     'path': '文本任务/文本生成/ChatGLM智能客服微调/customer_service_web.py', 'init': 'load_model'},
+    'sentiment':           {'name': '情感分析',     'path': '情感分析/情感分析Web服务.py', 'init': 'load_model'},
+    # 音频任务
+    'audio-classification': {'name': '音频分类',    'path': '音频任务/音频分类/音频分类Web服务.py'},
+    'asr':                 {'name': '语音识别',     'path': '音频任务/语音识别/语音识别Web服务.py'},
+    'speech-to-speech':    {'name': '语音到语音',   'path': '音频任务/语音到语音/语音到语音Web服务.py'},
+    'text-to-music':       {'name': '文本到音乐',   'path': '音频任务/文本到音乐/文本到音乐Web服务.py'},
+    'tts':                 {'name': '文本转语音',   'path': '音频任务/文本转语音/文本转语音Web服务.py'},
+    # 多模态任务
+    'captioning':          {'name': '图像描述生成', 'path': '多模态任务/图像描述生成/图像描述Web服务.py'},
+    'vqa':                 {'name': '视觉问答',     'path': '多模态任务/视觉问答/视觉问答Web服务.py'},
+    'table-qa':            {'name': '表格问答',     'path': '多模态任务/表格问答/表格问答Web服务.py'},
+    'document-qa':         {'name': '文档理解',     'path': '多模态任务/文档理解/文档理解Web服务.py'},
+    'audio-text':          {'name': '音频文本理解', 'path': '多模态任务/音频文本理解/音频文本理解Web服务.py'},
+    'visual-story':        {'name': '视觉文本生成', 'path': '多模态任务/视觉文本生成/视觉文本生成Web服务.py'},
+    # 图像任务
+    'image-classification': {'name': '图像分类',    'path': '图像任务/图像分类/图像分类Web服务.py'},
+    'object-detection':    {'name': '目标检测',     'path': '图像任务/目标检测/目标检测Web服务.py'},
+    'segmentation':        {'name': '图像分割',     'path': '图像任务/图像分割/图像分割Web服务.py'},
+    'pose':                {'name': '姿态估计',     'path': '图像任务/姿态估计/姿态估计Web服务.py'},
+    'depth':               {'name': '深度估计',     'path': '图像任务/深度估计/深度估计Web服务.py'},
+    'video-classification': {'name': '视频分类',    'path': '图像任务/视频分类/视频分类Web服务.py'},
+    'zero-shot-image':     {'name': '零样本图像分类', 'path': '图像任务/零样本图像分类/零样本图像分类Web服务.py'},
+    'keypoints':           {'name': '关键点检测',   'path': '图像任务/关键点检测/关键点检测Web服务.py'},
+}
+
+# ============================================================================
+# 共享 tokenizer / processor 缓存
+# ============================================================================
+
+SHARED_LOADERS = [
+    'AutoTokenizer', 'AutoProcessor', 'AutoImageProcessor', 'AutoFeatureExtractor',
+    'BlipProcessor',
+]
+
+shared_cache = OrderedDict()
+shared_cache_lock = threading.Lock()
+shared_cache_stats = {'hits': 0, 'misses': 0}
+
+def install_shared_cache():
+    """替换 from_pretrained，使不同任务加载同一 tokenizer / processor 时复用同一实例"""
+    for cls_name in SHARED_LOADERS:
+        cls = getattr(transformers, cls_name, None)
+        if cls is None:
+            continue
+        original = cls.from_pretrained
+
+        def cached_from_pretrained(*args, _original=original, _name=cls_name, **kwargs):
+            key = (_name, repr(args), repr(sorted(kwargs.items())))
+            with shared_cache_lock:
+                if key in shared_cache:
+                    shared_cache.move_to_end(key)
+                    shared_cache_stats['hits'] += 1
+                    return shared_cache[key]
+            obj = _original(*args, **kwargs)
+            with shared_cache_lock:
+                shared_cache_stats['misses'] += 1
+                shared_cache[key] = obj
+                while len(shared_cache) > SHARED_CACHE_SIZE:
+                    shared_cache.popitem(last=False)
+            return obj
+
+        cls.from_pretrained = staticmethod(cached_from_pretrained)
+
+# ============================================================================
+# 模型注册表（懒加载 + LRU 卸载）
+# ============================================================================
+
+def iter_torch_modules(value):
+    """从模块全局变量中找出持有权重的 torch 模型（直接模型或 pipeline.model）"""
+    if isinstance(value, torch.nn.Module):
+        yield value
+    inner = getattr(value, 'model', None)
+    if isinstance(inner, torch.nn.Module):
+        yield inner
+
+def estimate_module_bytes(module):
+    """估算任务模块占用的参数与缓冲区字节数"""
+    seen = set()
+    total = 0
+    for value in list(vars(module).values()):
+        for torch_module in iter_torch_modules(value):
+            for tensor in list(torch_module.parameters()) + list(torch_module.buffers()):
+                if id(tensor) in seen:
+                    continue
+                seen.add(id(tensor))
+                total += tensor.numel() * tensor.element_size()
+    return total
+
+class ModelRegistry:
+    """按需导入任务脚本，记录内存占用，超出预算时按 LRU 卸载空闲任务"""
+
+    def __init__(self, tasks, budget_bytes):
+        self.tasks = tasks
+        self.budget_bytes = budget_bytes
+        self.loaded = OrderedDict()  # slug -> {'module', 'app', 'bytes', 'loaded_at', 'requests'}
+        self.in_flight = {slug: 0 for slug in tasks}
+        self.load_locks = {slug: threading.Lock() for slug in tasks}
+        self.lock = threading.Lock()
+        self.evictions = 0
+
+    def acquire(self, slug):
+        """获取任务的 WSGI 应用，未加载时先加载；调用方处理完请求后需 release"""
+        with self.lock:
+            if slug in self.loaded:
+                self.loaded.move_to_end(slug)
+                self.in_flight[slug] += 1
+                self.loaded[slug]['requests'] += 1
+                return self.loaded[slug]['app']
+
+        with self.load_locks[slug]:
+            with self.lock:
+                entry = self.loaded.get(slug)
+            if entry is None:
+                entry = self._load(slug)
+            with self.lock:
+                self.loaded[slug] = entry
+                self.loaded.move_to_end(slug)
+                self.in_flight[slug] += 1
+                entry['requests'] += 1
+                self._evict_over_budget(keep=slug)
+            return entry['app']
+
+    def release(self, slug):
+        with self.lock:
+            self.in_flight[slug] -= 1
+
+    def _load(self, slug):
+        task = self.tasks[slug]
+        script_path = os.path.join(ROOT_DIR, task['path'])
+        module_name = f"task_{slug.replace('-', '_')}"
+
+        print(f"\n📥 加载任务 [{slug}] {task['name']}: {task['path']}")
+        start_time = time.time()
+
+        spec = importlib.util.spec_from_file_location(module_name, script_path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[module_name] = module
+        try:
+            spec.loader.exec_module(module)
+            init = task.get('init')
+            if init and getattr(module, init)() is False:
+                raise RuntimeError(f"{init}() 返回失败")
+        except BaseException:
+            sys.modules.pop(module_name, None)
+            raise
+
+        entry = {
+            'module': module,
+            'app': module.app,
+            'bytes': estimate_module_bytes(module),
+            'loaded_at': time.time(),
+            'requests': 0,
+        }
+        print(f"✅ 任务 [{slug}] 加载完成: {entry['bytes'] / 1024 / 1024:.0f}MB, "
+              f"耗时 {time.time() - start_time:.1f}s")
+        return entry
+
+    def _evict_over_budget(self, keep):
+        """在持有 self.lock 时调用：卸载最久未使用且空闲的任务，直到总占用回到预算内"""
+        for slug in list(self.loaded):
+            if self.total_bytes() <= self.budget_bytes:
+                break
+            if slug == keep or self.in_flight[slug] > 0:
+                continue
+            self._unload(slug)
+
+    def _unload(self, slug):
+        entry = self.loaded.pop(slug)
+        module = entry['module']
+        sys.modules.pop(module.__name__, None)
+
+        # 后台线程等仍可能引用模块全局变量，显式断开模型引用才能真正释放内存
+        for name, value in list(vars(module).items()):
+            if any(True for _ in iter_torch_modules(value)):
+                setattr(module, name, None)
+
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+        self.evictions += 1
+        print(f"♻️ 已卸载任务 [{slug}]，释放约 {entry['bytes'] / 1024 / 1024:.0f}MB")
+
+    def unload(self, slug):
+        with self.lock:
+            if slug not in self.loaded:
+                return False
+            if self.in_flight[slug] > 0:
+                raise RuntimeError('任务仍有请求在处理中')
+            self._unload(slug)
+            return True
+
+    def total_bytes(self):
+        return sum(entry['bytes'] for entry in self.loaded.values())
+
+    def status(self):
+        with self.lock:
+            tasks = []
+            for slug, task in self.tasks.items():
+                entry = self.loaded.get(slug)
+                tasks.append({
+                    'slug': slug,
+                    'name': task['name'],
+                    'url': f'/{slug}/',
+                    'loaded': entry is not None,
+                    'memory_mb': round(entry['bytes'] / 1024 / 1024, 1) if entry else 0,
+                    'requests': entry['requests'] if entry else 0,
+                    'in_flight': self.in_flight[slug],
+                })
+            with shared_cache_lock:
+                cache = {'entries': len(shared_cache), **shared_cache_stats}
+            return {
+                'memory_budget_mb': round(self.budget_bytes / 1024 / 1024, 1),
+                'memory_used_mb': round(self.total_bytes() / 1024 / 1024, 1),
+                'lru_order': list(self.loaded),
+                'evictions': self.evictions,
+                'max_workers': MAX_WORKERS,
+                'shared_cache': cache,
+                'tasks': tasks,
+            }
+
+registry = ModelRegistry(TASK_REGISTRY, MEMORY_BUDGET_MB * 1024 * 1024)
+
+# ============================================================================
+# 路由分发
+# ============================================================================
+
+class TaskDispatcher:
+    """按路径第一段分发到任务应用；其余请求交给宿主应用"""
+
+    def __init__(self, host_app):
+        self.host_app = host_app
+        self.workers = threading.BoundedSemaphore(MAX_WORKERS)
+
+    def _resolve(self, environ):
+        path = environ.get('PATH_INFO', '')
+        slug, _, rest = path.lstrip('/').partition('/')
+        if slug in TASK_REGISTRY:
+            return slug, '/' + rest, '/' + slug
+
+        # 任务页面里的脚本使用绝对路径（如 fetch('/classify')），按 Referer 归属到对应任务
+        referer_path = urlparse(environ.get('HTTP_REFERER', '')).path
+        referer_slug = referer_path.lstrip('/').partition('/')[0]
+        if referer_slug in TASK_REGISTRY and path not in ('', '/') and not path.startswith('/api/tasks'):
+            return referer_slug, path, '/' + referer_slug
+        return None, path, ''
+
+    def __call__(self, environ, start_response):
+        slug, path_info, script_name = self._resolve(environ)
+        if slug is None:
+            return self.host_app(environ, start_response)
+
+        self.workers.acquire()
+        try:
+            app = registry.acquire(slug)
+        except BaseException:
+            self.workers.release()
+            raise
+
+        def finish():
+            registry.release(slug)
+            self.workers.release()
+
+        environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + script_name
+        environ['PATH_INFO'] = path_info
+        try:
+            return ClosingIterator(app(environ, start_response), [finish])
+        except BaseException:
+            finish()
+            raise
+
+# ============================================================================
+# 宿主应用
+# ============================================================================
+
+app = Flask(__name__)
+
+HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <title>统一推理服务</title>
+    <style>
+        body { font-family: 'Microsoft YaHei', 'Segoe UI', Arial, sans-serif; background: #f5f6fa; padding: 30px; }
+        .container { max-width: 900px; margin: 0 auto; background: white; border-radius: 15px; padding: 30px; box-shadow: 0 4px 6px rgba(0,0,0,0.1); }
+        h1 { color: #667eea; margin-bottom: 10px; }
+        table { width: 100%; border-collapse: collapse; margin-top: 20px; }
+        th, td { padding: 10px; border-bottom: 1px solid #eee; text-align: left; }
+        .loaded { color: #4caf50; font-weight: bold; }
+        a { color: #667eea; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>🚀 统一推理服务</h1>
+        <p>内存预算 {{ status.memory_budget_mb }}MB，已使用 {{ status.memory_used_mb }}MB，累计卸载 {{ status.evictions }} 次</p>
+        <table>
+            <tr><th>任务</th><th>路径</th><th>状态</th><th>内存</th><th>请求数</th></tr>
+            {% for task in status.tasks %}
+            <tr>
+                <td>{{ task.name }}</td>
+                <td><a href="{{ task.url }}">{{ task.url }}</a></td>
+                <td>{% if task.loaded %}<span class="loaded">已加载</span>{% else %}未加载{% endif %}</td>
+                <td>{{ task.memory_mb }}MB</td>
+                <td>{{ task.requests }}</td>
+            </tr>
+            {% endfor %}
+        </table>
+    </div>
+</body>
+</html>
+"""
+
+@app.route('/')
+def index():
+    """任务列表"""
+    return render_template_string(HTML_TEMPLATE, status=registry.status())
+
+@app.route('/api/tasks', methods=['GET'])
+def tasks():
+    """注册表状态"""
+    return jsonify(registry.status())
+
+@app.route('/api/tasks/<slug>/load', methods=['POST'])
+def load_task(slug):
+    """预热加载任务"""
+    if slug not in TASK_REGISTRY:
+        return jsonify({'success': False, 'error': '未知任务'}), 404
+    try:
+        registry.acquire(slug)
+        registry.release(slug)
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/api/tasks/<slug>/unload', methods=['POST'])
+def unload_task(slug):
+    """手动卸载任务"""
+    if slug not in TASK_REGISTRY:
+        return jsonify({'success': False, 'error': '未知任务'}), 404
+    try:
+        return jsonify({'success': True, 'unloaded': registry.unload(slug)})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 409
+
+# ============================================================================
+# 主函数
+# ============================================================================
+
+if __name__ == '__main__':
+    print("\n" + "=" * 70)
+    print("🚀 启动统一推理服务")
+    print("=" * 70)
+
+    install_shared_cache()
+
+    print(f"\n📋 已注册 {len(TASK_REGISTRY)} 个任务（首次访问时加载）")
+    print(f"💾 内存预算: {MEMORY_BUDGET_MB}MB")
+    print(f"🧵 共享工作线程: {MAX_WORKERS}")
+    print(f"\n📱 访问地址: http://127.0.0.1:{PORT}")
+    print("💡 提示: 按 Ctrl+C 停止服务\n")
+
+    run_simple('0.0.0.0', PORT, TaskDispatcher(app), threaded=True)
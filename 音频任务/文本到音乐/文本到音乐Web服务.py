@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -17,10 +18,15 @@ if os.path.exists(ffmpeg_exe):
 
 from flask import Flask, request, jsonify, send_file
 from transformers import pipeline
+from transformers.generation.streamers import BaseStreamer
 import scipy.io.wavfile as wavfile
 import numpy as np
+import torch
 import base64
-import tempfile
+import io
+import uuid
+import queue
+import threading
 
 BACKGROUND_PATH = r'背景.png'
 
@@ -35,6 +41,10 @@ print("✅ 音乐魔法师准备完毕！")
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from artifact_store import ArtifactStore
+from audio_stream import stream_audio_response, encode_wav, StreamJobs
+
 app = Flask(__name__)
 
 background_base64 = ""
@@ -348,36 +358,44 @@ HTML_TEMPLATE = f"""
                 return;
             }}
             
-            const resultDiv = document.getElementById('result');
             const loading = document.getElementById('loading');
             const generateBtn = document.getElementById('generateBtn');
             
             loading.style.display = 'block';
-            resultDiv.style.display = 'none';
             generateBtn.disabled = true;
             
+            const done = () => {{
+                loading.style.display = 'none';
+                generateBtn.disabled = false;
+            }};
+            
+            // 流式播放：POST 启动生成并取得编号，约 1 秒音频解码完成即开始播放，其余部分边生成边发送
+            let data;
             try {{
-                const response = await fetch('/generate', {{
+                const response = await fetch('/stream', {{
                     method: 'POST',
-                    headers: {{
-                        'Content-Type': 'application/json',
-                    }},
+                    headers: {{ 'Content-Type': 'application/json' }},
                     body: JSON.stringify({{ prompt: prompt }})
                 }});
-                
-                const data = await response.json();
-                
-                if (data.success) {{
-                    displayResult(data);
-                }} else {{
-                    alert('生成失败：' + data.error);
-                }}
+                data = await response.json();
             }} catch (error) {{
+                done();
                 alert('请求失败：' + error.message);
-            }} finally {{
-                loading.style.display = 'none';
-                generateBtn.disabled = false;
+                return;
+            }}
+            if (!data.success) {{
+                done();
+                alert('生成失败：' + data.error);
+                return;
             }}
+            displayResult(data);
+            
+            const audio = document.getElementById('resultAudio');
+            audio.addEventListener('playing', done, {{ once: true }});
+            audio.addEventListener('error', () => {{
+                done();
+                alert('生成失败，请检查服务日志');
+            }}, {{ once: true }});
         }}
         
         function displayResult(data) {{
@@ -387,7 +405,7 @@ HTML_TEMPLATE = f"""
             
             html += '<div class="audio-player">';
             html += `<div style="color: #7b1fa2; font-weight: bold; margin-bottom: 10px;">🎵 ${{data.prompt}}</div>`;
-            html += `<audio controls src="/download/${{data.filename}}"></audio>`;
+            html += `<audio id="resultAudio" controls autoplay src="${{data.audio_url || '/download/' + data.filename}}"></audio>`;
             html += `<br><button class="download-btn" onclick="window.open('/download/${{data.filename}}', '_blank')">💾 下载音乐</button>`;
             html += '</div>';
             
@@ -411,7 +429,95 @@ def background():
 def index():
     return HTML_TEMPLATE
 
-generated_files = {}
+# 存储生成的音乐（有总量上限和 TTL，超出内存上限的部分溢写到磁盘）
+audio_store = ArtifactStore('text_to_music')
+
+# 流式生成参数
+MAX_NEW_TOKENS = 256       # 与 /generate 一致，约 5 秒音乐
+PLAY_STEPS = 50            # 每生成多少步解码一次音频（MusicGen 50 步约 1 秒）
+STREAM_TIMEOUT = 120       # 等待下一个音频片段的超时时间（秒）
+
+# 流式生成任务：POST /stream 启动生成，GET /stream/<filename> 只读取结果
+stream_jobs = StreamJobs()
+
+class MusicgenStreamer(BaseStreamer):
+    """
+    MusicGen 音频流：generate 每产出 play_steps 步 token，就用 EnCodec 解码一次，
+    把新增的波形放入队列；末尾保留 stride 个采样点，等下一次解码时补齐，避免片段衔接处失真
+    """
+    
+    def __init__(self, model, play_steps=PLAY_STEPS, timeout=STREAM_TIMEOUT):
+        self.decoder = model.decoder
+        self.audio_encoder = model.audio_encoder
+        self.generation_config = model.generation_config
+        self.play_steps = play_steps
+        hop_length = int(np.prod(self.audio_encoder.config.upsampling_ratios))
+        self.stride = hop_length * (play_steps - self.decoder.num_codebooks) // 6
+        self.token_cache = None
+        self.to_yield = 0
+        self.audio_queue = queue.Queue()
+        self.timeout = timeout
+    
+    def decode(self, input_ids):
+        """去掉延迟模式中的填充 token 后用 EnCodec 解码为波形"""
+        _, delay_pattern_mask = self.decoder.build_delay_pattern_mask(
+            input_ids[:, :1],
+            pad_token_id=self.generation_config.decoder_start_token_id,
+            max_length=input_ids.shape[-1],
+        )
+        input_ids = self.decoder.apply_delay_pattern_mask(input_ids, delay_pattern_mask)
+        input_ids = input_ids[input_ids != self.generation_config.pad_token_id].reshape(
+            1, self.decoder.num_codebooks, -1
+        )
+        input_ids = input_ids[None, ...].to(self.audio_encoder.device)
+        with torch.no_grad():
+            output_values = self.audio_encoder.decode(input_ids, audio_scales=[None])
+        return output_values.audio_values[0, 0].cpu().float().numpy()
+    
+    def put(self, value):
+        if value.shape[0] // self.decoder.num_codebooks > 1:
+            raise ValueError("MusicgenStreamer 只支持 batch_size=1")
+        if self.token_cache is None:
+            self.token_cache = value
+        else:
+            self.token_cache = torch.cat([self.token_cache, value[:, None]], dim=-1)
+        
+        if self.token_cache.shape[-1] % self.play_steps == 0:
+            audio_values = self.decode(self.token_cache)
+            if len(audio_values) - self.stride > self.to_yield:
+                self.audio_queue.put(audio_values[self.to_yield:-self.stride])
+                self.to_yield = len(audio_values) - self.stride
+    
+    def end(self):
+        if self.token_cache is not None:
+            self.audio_queue.put(self.decode(self.token_cache)[self.to_yield:])
+        self.audio_queue.put(None)
+    
+    def abort(self):
+        self.audio_queue.put(None)
+    
+    def __iter__(self):
+        while True:
+            chunk = self.audio_queue.get(timeout=self.timeout)
+            if chunk is None:
+                return
+            yield chunk
+
+def iter_music_chunks(prompt, max_new_tokens=MAX_NEW_TOKENS, play_steps=PLAY_STEPS):
+    """在后台线程中生成音乐，逐段返回已解码的波形"""
+    model = synthesizer.model
+    inputs = synthesizer.tokenizer([prompt], padding=True, return_tensors="pt").to(model.device)
+    streamer = MusicgenStreamer(model, play_steps=play_steps)
+    
+    def run():
+        try:
+            model.generate(**inputs, streamer=streamer, max_new_tokens=max_new_tokens)
+        except Exception as e:
+            print(f"流式生成失败: {e}")
+            streamer.abort()
+    
+    threading.Thread(target=run, daemon=True).start()
+    return iter(streamer)
 
 @app.route('/generate', methods=['POST'])
 def generate():
@@ -425,10 +531,7 @@ def generate():
         # 生成音乐
         music = synthesizer(prompt, forward_params={"max_new_tokens": 256})
         
-        # 保存到临时文件
-        import uuid
         filename = f"music_{uuid.uuid4().hex}.wav"
-        filepath = os.path.join(tempfile.gettempdir(), filename)
         
         # 获取音频数据和采样率
         audio_data = music["audio"][0].squeeze()
@@ -438,13 +541,14 @@ def generate():
         if audio_data.dtype == np.float32 or audio_data.dtype == np.float64:
             audio_data = np.int16(audio_data * 32767)
         
+        buffer = io.BytesIO()
         wavfile.write(
-            filepath,
+            buffer,
             rate=sampling_rate,
             data=audio_data
         )
         
-        generated_files[filename] = filepath
+        audio_store.put(buffer.getvalue(), key=filename)
         
         return jsonify({
             'success': True,
@@ -458,15 +562,64 @@ def generate():
         print(f"错误详情: {error_details}")
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/stream', methods=['POST'])
+def start_stream():
+    """启动流式生成音乐，返回服务端生成的文件名；音频由 GET /stream/<filename> 读取"""
+    data = request.get_json(silent=True) or request.values
+    prompt = data.get('prompt', '').strip()
+    
+    if not prompt:
+        return jsonify({'success': False, 'error': '请输入音乐描述'}), 400
+    
+    filename = f"music_{uuid.uuid4().hex}.wav"
+    sampling_rate = int(synthesizer.model.config.audio_encoder.sampling_rate)
+    
+    def save_audio(pcm):
+        # 生成结束后保存完整音乐，/download/<filename> 可回放和下载
+        audio_store.put(encode_wav(pcm, sampling_rate), key=filename)
+    
+    if stream_jobs.start(iter_music_chunks(prompt), sampling_rate, on_complete=save_audio, job_id=filename) is None:
+        return jsonify({'success': False, 'error': '生成任务过多，请稍后再试'}), 503
+    
+    return jsonify({
+        'success': True,
+        'prompt': prompt,
+        'filename': filename,
+        'audio_url': f'/stream/{filename}'
+    })
+
+@app.route('/stream/<filename>')
+def stream(filename):
+    """读取生成结果（只读，不触发生成）：生成中时以分块 WAV（或 format=pcm 裸 PCM）边生成边发送，
+    生成结束后从产物存储发送完整 WAV（支持 Range 请求）"""
+    audio_format = request.args.get('format', 'wav')
+    if audio_format not in ('wav', 'pcm'):
+        return jsonify({'success': False, 'error': 'format 只支持 wav 或 pcm'}), 400
+    
+    job = stream_jobs.get(filename)
+    if job is not None and (not job.done or audio_format == 'pcm'):
+        return stream_audio_response(job.iter_pieces(), job.sample_rate, audio_format,
+                                     headers={'X-Filename': filename})
+    
+    response = audio_store.send(filename, mimetype='audio/wav') if audio_format == 'wav' else None
+    if response is None:
+        return jsonify({'success': False, 'error': '音乐不存在或已过期'}), 404
+    return response
+
 @app.route('/download/<filename>')
 def download(filename):
-    if filename in generated_files:
-        return send_file(generated_files[filename], mimetype='audio/wav', as_attachment=True, download_name=filename)
-    return 'File not found', 404
+    response = audio_store.send(filename, mimetype='audio/wav', as_attachment=True, download_name=filename)
+    if response is None:
+        return 'File not found', 404
+    return response
+
+@app.route('/api/metrics')
+def metrics():
+    """生成产物存储指标"""
+    return jsonify(audio_store.metrics())
 
 if __name__ == '__main__':
     import webbrowser
-    import threading
     
     print("\n" + "=" * 70)
     print("🎵 启动音乐魔法师...")
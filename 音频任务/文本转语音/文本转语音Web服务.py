@@ -6,6 +6,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
@@ -69,10 +70,17 @@ except Exception as e:
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from artifact_store import ArtifactStore
+from audio_stream import stream_audio_response, split_sentences, encode_wav, StreamJobs
+
 app = Flask(__name__)
 
-# 存储生成的音频文件
-generated_files = {}
+# 存储生成的音频文件（有总量上限和 TTL，超出内存上限的部分溢写到磁盘）
+audio_store = ArtifactStore('tts')
+
+# 流式合成任务：POST /stream 启动合成，GET /stream/<audio_id> 只读取结果
+stream_jobs = StreamJobs()
 
 background_base64 = ""
 if os.path.exists(BACKGROUND_PATH):
@@ -326,27 +334,31 @@ HTML_TEMPLATE = """
             resultDiv.style.display = 'block';
             generateBtn.disabled = true;
             
+            // 流式播放：POST 启动合成并取得音频 ID，第一句合成完成即开始播放，其余句子边合成边发送
+            let data;
             try {
-                const response = await fetch('/generate', {
+                const response = await fetch('/stream', {
                     method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                    },
+                    headers: { 'Content-Type': 'application/json' },
                     body: JSON.stringify({ text: inputText })
                 });
-                
-                const data = await response.json();
-                
-                if (data.error) {
-                    resultDiv.innerHTML = `<p style="text-align: center; color: #d32f2f;">❌ ${data.error}</p>`;
-                } else {
-                    displayResult(data);
-                }
+                data = await response.json();
             } catch (error) {
-                resultDiv.innerHTML = `<p style="text-align: center; color: #d32f2f;">❌ 生成失败: ${error.message}</p>`;
-            } finally {
+                data = { error: error.message };
+            }
+            if (!data.audio_id) {
+                resultDiv.innerHTML = `<p style="text-align: center; color: #d32f2f;">❌ ${data.error || '生成失败'}</p>`;
                 generateBtn.disabled = false;
+                return;
             }
+            displayResult(data);
+            
+            const audio = document.getElementById('resultAudio');
+            audio.addEventListener('playing', () => { generateBtn.disabled = false; }, { once: true });
+            audio.addEventListener('error', () => {
+                resultDiv.innerHTML = '<p style="text-align: center; color: #d32f2f;">❌ 生成失败，请检查服务日志</p>';
+                generateBtn.disabled = false;
+            }, { once: true });
         }
         
         function displayResult(data) {
@@ -359,7 +371,7 @@ HTML_TEMPLATE = """
             
             html += '<div style="background: white; padding: 20px; border-radius: 15px;">';
             html += '<h4 style="color: #7b1fa2; margin-bottom: 10px;">🔊 生成的语音:</h4>';
-            html += `<audio controls src="/audio/${data.audio_id}"></audio>`;
+            html += `<audio id="resultAudio" controls autoplay src="${data.audio_url || '/audio/' + data.audio_id}"></audio>`;
             html += `<button class="download-btn" onclick="downloadAudio('${data.audio_id}')">📥 下载音频</button>`;
             html += '</div>';
             
@@ -431,7 +443,7 @@ def generate():
         wavfile.write(buffer, sampling_rate, audio_data)
         buffer.seek(0)
         
-        generated_files[audio_id] = buffer.getvalue()
+        audio_store.put(buffer.getvalue(), key=audio_id)
         
         print(f"✅ 语音生成成功: {audio_id}")
         
@@ -446,23 +458,78 @@ def generate():
         print(f"错误详情: {error_details}")
         return jsonify({'error': f'生成失败: {str(e)}'}), 500
 
-@app.route('/audio/<audio_id>')
-def get_audio(audio_id):
-    if audio_id not in generated_files:
-        return '音频不存在', 404
+@app.route('/stream', methods=['POST'])
+def start_stream():
+    """启动流式合成：按句切分逐句合成，返回服务端生成的音频 ID，音频由 GET /stream/<audio_id> 读取"""
+    if not model_loaded or tts_pipeline is None:
+        return jsonify({'error': '模型未加载,请检查网络连接后重启服务'}), 500
+    
+    data = request.get_json(silent=True) or request.values
+    text = data.get('text', '').strip()[:200]
+    
+    if not text:
+        return jsonify({'error': '请输入文本'}), 400
+    
+    audio_id = str(uuid.uuid4())
+    sentences = split_sentences(text)
+    sampling_rate = tts_pipeline.sampling_rate or 24000
+    print(f"流式生成语音: {len(sentences)} 句, {audio_id}")
     
-    audio_data = generated_files[audio_id]
-    buffer = io.BytesIO(audio_data)
-    buffer.seek(0)
+    def chunks():
+        for sentence in sentences:
+            speech = tts_pipeline(sentence)
+            yield speech["audio"]
     
+    def save_audio(pcm):
+        # 生成结束后保存完整音频，/audio/<audio_id> 可回放和下载
+        audio_store.put(encode_wav(pcm, sampling_rate), key=audio_id)
+        print(f"✅ 流式语音生成完成: {audio_id}")
+    
+    if stream_jobs.start(chunks(), sampling_rate, on_complete=save_audio, job_id=audio_id) is None:
+        return jsonify({'error': '合成任务过多，请稍后再试'}), 503
+    
+    return jsonify({
+        'text': text,
+        'audio_id': audio_id,
+        'audio_url': f'/stream/{audio_id}'
+    })
+
+@app.route('/stream/<audio_id>')
+def stream(audio_id):
+    """读取合成结果（只读，不触发合成）：合成中时每句完成后立即以分块 WAV（或 format=pcm 裸 PCM）发送，
+    合成结束后从产物存储发送完整 WAV（支持 Range 请求）"""
+    audio_format = request.args.get('format', 'wav')
+    if audio_format not in ('wav', 'pcm'):
+        return jsonify({'error': 'format 只支持 wav 或 pcm'}), 400
+    
+    job = stream_jobs.get(audio_id)
+    if job is not None and (not job.done or audio_format == 'pcm'):
+        return stream_audio_response(job.iter_pieces(), job.sample_rate, audio_format,
+                                     headers={'X-Audio-Id': audio_id})
+    
+    response = audio_store.send(audio_id, mimetype='audio/wav') if audio_format == 'wav' else None
+    if response is None:
+        return '音频不存在', 404
+    return response
+
+@app.route('/audio/<audio_id>')
+def get_audio(audio_id):
     download = request.args.get('download', '0') == '1'
     
-    return send_file(
-        buffer,
+    response = audio_store.send(
+        audio_id,
         mimetype='audio/wav',
         as_attachment=download,
         download_name=f'speech_{audio_id}.wav'
     )
+    if response is None:
+        return '音频不存在', 404
+    return response
+
+@app.route('/api/metrics')
+def metrics():
+    """生成产物存储指标"""
+    return jsonify(audio_store.metrics())
 
 if __name__ == '__main__':
     import webbrowser
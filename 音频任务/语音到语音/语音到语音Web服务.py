@@ -6,6 +6,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['HF_ENDPOINT'] = 'https://hf-mirror.com'
@@ -38,22 +39,23 @@ except ImportError:
     uroman_converter = None
     print("⚠️  uroman未安装,中文TTS可能受限")
 
-# 导入Google翻译
-try:
-    from googletrans import Translator
-    translator = Translator()
-    TRANSLATOR_AVAILABLE = True
-    print("✅ Google翻译已加载")
-except ImportError:
-    translator = None
-    TRANSLATOR_AVAILABLE = False
-    print("⚠️  googletrans未安装，将显示原始文本")
-
 app = Flask(__name__)
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from async_translation import AsyncTranslator
+from artifact_store import ArtifactStore
+
+# 异步翻译阶段：语言检测与翻译合并为一次请求，在线程池中执行，超时返回原文
+translator = AsyncTranslator()
+TRANSLATOR_AVAILABLE = translator.available
+if TRANSLATOR_AVAILABLE:
+    print(f"✅ Google翻译已加载（截止时间 {translator.timeout}s）")
+else:
+    print("⚠️  googletrans未安装，将显示原始文本")
+
 print("=" * 70)
 print("🎙️ 语音到语音 Web 服务 - 语音转换师")
 print("=" * 70)
@@ -354,6 +356,7 @@ HTML_TEMPLATE = """
             
             const formData = new FormData();
             formData.append('audio', selectedFile);
+            formData.append('defer', '1');   // 识别结果先返回，翻译与语音合成由 /synthesize 完成
             
             const loading = document.getElementById('loading');
             const resultContainer = document.getElementById('resultContainer');
@@ -369,7 +372,16 @@ HTML_TEMPLATE = """
                     body: formData
                 });
                 
-                const data = await response.json();
+                let data = await response.json();
+                
+                if (data.success) {
+                    const synthesis = await fetch('/synthesize', {
+                        method: 'POST',
+                        headers: {'Content-Type': 'application/json'},
+                        body: JSON.stringify({translation_id: data.translation_id, text: data.text})
+                    });
+                    data = await synthesis.json();
+                }
                 
                 if (data.success) {
                     displayResult(data);
@@ -425,10 +437,58 @@ def background():
     else:
         return '', 404
 
-generated_files = {}
+# 存储生成的音频文件（有总量上限和 TTL，超出内存上限的部分溢写到磁盘）
+audio_store = ArtifactStore('speech_to_speech')
+
+def synthesize_speech(text_cn):
+    """语音合成（使用翻译后的中文文本），返回音频地址；TTS 不可用或失败时返回 None"""
+    if not (tts_loaded and tts_model and tts_tokenizer):
+        return None
+    try:
+        # 使用uroman进行文本预处理
+        if UROMAN_AVAILABLE and uroman_converter:
+            uromanized_text = uroman_converter.romanize_string(text_cn, lcode="cmn")
+            print(f"Uromanized: {uromanized_text}")
+        else:
+            uromanized_text = text_cn
+        
+        # 生成语音
+        inputs = tts_tokenizer(uromanized_text, return_tensors="pt")
+        
+        with torch.no_grad():
+            output = tts_model(**inputs).waveform
+        
+        # 转换为numpy数组
+        audio_data = output.squeeze().cpu().numpy()
+        sampling_rate = tts_model.config.sampling_rate
+        
+        # 归一化并转换为16位整数
+        audio_data = np.clip(audio_data, -1.0, 1.0)
+        audio_data = (audio_data * 32767).astype(np.int16)
+        
+        # 保存音频
+        audio_id = str(uuid.uuid4())
+        buffer = io.BytesIO()
+        wavfile.write(buffer, sampling_rate, audio_data)
+        buffer.seek(0)
+        
+        audio_store.put(buffer.getvalue(), key=audio_id)
+        print(f"✅ 语音生成成功: {audio_id}")
+        return f'/audio/{audio_id}'
+    except Exception as e:
+        print(f"TTS生成失败: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
 
 @app.route('/convert', methods=['POST'])
 def convert():
+    """
+    语音识别 -> 翻译 -> 语音合成
+    默认在一个请求内完成（翻译在后台线程执行，最多等待截止时间，超时使用原文）；
+    defer=1 时识别完成即返回识别文本和翻译编号，翻译与语音合成由 /synthesize 完成，
+    处理本请求的线程不等待翻译，可以立即处理下一次识别
+    """
     try:
         if 'audio' not in request.files:
             return jsonify({'success': False, 'error': '没有上传音频'})
@@ -446,69 +506,52 @@ def convert():
         
         print(f"原始识别文本: {text}")
         
-        # 翻译成中文
-        text_cn = text
-        original_text = None
-        if TRANSLATOR_AVAILABLE and translator:
-            try:
-                # 检测语言，如果不是中文则翻译
-                detected = translator.detect(text)
-                if detected.lang != 'zh-cn' and detected.lang != 'zh-tw':
-                    translation = translator.translate(text, dest='zh-cn')
-                    text_cn = translation.text
-                    original_text = text
-                    print(f"翻译后文本: {text_cn}")
-            except Exception as e:
-                print(f"翻译失败: {e}")
-                text_cn = text
-        
-        # 语音合成（使用翻译后的中文文本）
-        audio_url = None
-        if tts_loaded and tts_model and tts_tokenizer:
-            try:
-                # 使用uroman进行文本预处理
-                if UROMAN_AVAILABLE and uroman_converter:
-                    uromanized_text = uroman_converter.romanize_string(text_cn, lcode="cmn")
-                    print(f"Uromanized: {uromanized_text}")
-                else:
-                    uromanized_text = text_cn
-                
-                # 生成语音
-                inputs = tts_tokenizer(uromanized_text, return_tensors="pt")
-                
-                with torch.no_grad():
-                    output = tts_model(**inputs).waveform
-                
-                # 转换为numpy数组
-                audio_data = output.squeeze().cpu().numpy()
-                sampling_rate = tts_model.config.sampling_rate
-                
-                # 归一化并转换为16位整数
-                audio_data = np.clip(audio_data, -1.0, 1.0)
-                audio_data = (audio_data * 32767).astype(np.int16)
-                
-                # 保存音频
-                audio_id = str(uuid.uuid4())
-                buffer = io.BytesIO()
-                wavfile.write(buffer, sampling_rate, audio_data)
-                buffer.seek(0)
-                
-                generated_files[audio_id] = buffer.getvalue()
-                audio_url = f'/audio/{audio_id}'
-                
-                print(f"✅ 语音生成成功: {audio_id}")
-            except Exception as e:
-                print(f"TTS生成失败: {e}")
-                import traceback
-                traceback.print_exc()
-        
+        if request.values.get('defer') == '1':
+            translation_id = translator.defer(text, dest='zh-cn')
+            os.unlink(tmp_path)
+            return jsonify({
+                'success': True,
+                'text': text,
+                'translation_id': translation_id
+            })
+        
+        # 翻译成中文（后台线程执行，与临时文件清理并行；超时返回原文）
+        translation_future = translator.submit(text, dest='zh-cn')
         os.unlink(tmp_path)
+        translation = translator.wait(translation_future, text)
+        text_cn = translation['text']
+        
+        return jsonify({
+            'success': True,
+            'text': text_cn,
+            'original_text': text if translation['translated'] else None,
+            'audio_url': synthesize_speech(text_cn)
+        })
+        
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        })
+
+@app.route('/synthesize', methods=['POST'])
+def synthesize():
+    """/convert?defer=1 的第二步：JSON {"translation_id", "text"}，取回译文并合成语音"""
+    try:
+        data = request.get_json(silent=True) or {}
+        text = data.get('text', '')
+        
+        # 取回 /convert 提交的译文（截止时间内等待，超时或编号无效时使用原文）
+        translation = translator.collect(data.get('translation_id')) or {'text': text, 'translated': False}
+        text_cn = translation['text']
         
         return jsonify({
             'success': True,
             'text': text_cn,
-            'original_text': original_text,
-            'audio_url': audio_url
+            'original_text': text if translation['translated'] else None,
+            'audio_url': synthesize_speech(text_cn)
         })
         
     except Exception as e:
@@ -521,19 +564,20 @@ def convert():
 
 @app.route('/audio/<audio_id>')
 def get_audio(audio_id):
-    if audio_id not in generated_files:
-        return '音频不存在', 404
-    
-    audio_data = generated_files[audio_id]
-    buffer = io.BytesIO(audio_data)
-    buffer.seek(0)
-    
-    return send_file(
-        buffer,
+    response = audio_store.send(
+        audio_id,
         mimetype='audio/wav',
         as_attachment=False,
         download_name=f'converted_{audio_id}.wav'
     )
+    if response is None:
+        return '音频不存在', 404
+    return response
+
+@app.route('/api/metrics')
+def metrics():
+    """生成产物存储指标"""
+    return jsonify(audio_store.metrics())
 
 if __name__ == '__main__':
     import webbrowser
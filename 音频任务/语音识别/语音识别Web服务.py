@@ -5,6 +5,7 @@
 """
 
 import os
+import sys
 os.environ['HF_HOME'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 os.environ['TRANSFORMERS_CACHE'] = r'D:\transformers训练\transformers-main\预训练模型下载处'
 
@@ -20,22 +21,22 @@ from transformers import pipeline
 import base64
 import tempfile
 
-# 导入Google翻译
-try:
-    from googletrans import Translator
-    translator = Translator()
-    TRANSLATOR_AVAILABLE = True
-    print("✅ Google翻译已加载")
-except ImportError:
-    translator = None
-    TRANSLATOR_AVAILABLE = False
-    print("⚠️  googletrans未安装，将显示原始文本")
-
 app = Flask(__name__)
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 BACKGROUND_PATH = os.path.join(CURRENT_DIR, '背景.png')
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(CURRENT_DIR)), '公共模块'))
+from async_translation import AsyncTranslator
+
+# 异步翻译阶段：语言检测与翻译合并为一次请求，在线程池中执行，超时返回原文
+translator = AsyncTranslator()
+TRANSLATOR_AVAILABLE = translator.available
+if TRANSLATOR_AVAILABLE:
+    print(f"✅ Google翻译已加载（截止时间 {translator.timeout}s）")
+else:
+    print("⚠️  googletrans未安装，将显示原始文本")
+
 print("=" * 70)
 print("🎤 语音识别 Web 服务 - 语音识别师")
 print("=" * 70)
@@ -322,6 +323,7 @@ HTML_TEMPLATE = """
             
             const formData = new FormData();
             formData.append('audio', selectedFile);
+            formData.append('defer', '1');   // 识别结果先显示，译文稍后取回
             
             const loading = document.getElementById('loading');
             const resultContainer = document.getElementById('resultContainer');
@@ -341,6 +343,13 @@ HTML_TEMPLATE = """
                 
                 if (data.success) {
                     displayResult(data);
+                    if (data.translation_id) {
+                        // 识别结果先显示，译文在后台翻译完成后再取回
+                        const translation = await (await fetch('/translation/' + data.translation_id)).json();
+                        if (translation.success && translation.translated) {
+                            displayResult({text: translation.text, original_text: data.text});
+                        }
+                    }
                 } else {
                     alert('识别失败：' + data.error);
                 }
@@ -405,22 +414,24 @@ def recognize():
         
         print(f"原始识别文本: {text}")
         
-        # 翻译成中文
-        text_cn = text
-        if TRANSLATOR_AVAILABLE and translator:
-            try:
-                # 检测语言，如果不是中文则翻译
-                detected = translator.detect(text)
-                if detected.lang != 'zh-cn' and detected.lang != 'zh-tw':
-                    translation = translator.translate(text, dest='zh-cn')
-                    text_cn = translation.text
-                    print(f"翻译后文本: {text_cn}")
-            except Exception as e:
-                print(f"翻译失败: {e}")
-                text_cn = text
+        # defer=1 时响应先返回原文和翻译编号，页面再到 /translation/<编号> 取译文，
+        # 处理本请求的线程不等待翻译，可以立即处理下一次识别
+        if request.values.get('defer') == '1':
+            translation_id = translator.defer(text, dest='zh-cn')
+            os.unlink(tmp_path)
+            return jsonify({
+                'success': True,
+                'text': text,
+                'translation_id': translation_id
+            })
+        
+        # 翻译成中文（后台线程执行，与临时文件清理并行；超时返回原文）
+        translation_future = translator.submit(text, dest='zh-cn')
         
         os.unlink(tmp_path)
         
+        text_cn = translator.wait(translation_future, text)['text']
+        
         return jsonify({
             'success': True,
             'text': text_cn,
@@ -435,6 +446,18 @@ def recognize():
             'error': str(e)
         })
 
+@app.route('/translation/<translation_id>')
+def get_translation(translation_id):
+    # 在截止时间内等待译文，超时返回原文
+    translation = translator.collect(translation_id)
+    if translation is None:
+        return jsonify({'success': False, 'error': '翻译不存在或已取回'}), 404
+    return jsonify({
+        'success': True,
+        'text': translation['text'],
+        'translated': translation['translated']
+    })
+
 if __name__ == '__main__':
     import webbrowser
     import threading